@@ -0,0 +1,432 @@
+# Índice de ocupación por fecha: responde reglas y avisos de Captura sin escanear la agenda
+import datetime as dt
+import threading
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+MAX_POR_DIA = 3
+COLS_DIA = ["numero","nombre","equipo","tipo"]
+EPOCA = np.datetime64("1970-01-01", "D")
+
+# ---------- Representación compacta de la agenda ----------
+def dia_n(fecha) -> int:
+    """Fecha -> días desde 1970-01-01 (la columna `dia_n` de la agenda)."""
+    return int((np.datetime64(pd.Timestamp(fecha).date(), "D") - EPOCA).astype(np.int64))
+
+def dias_desde_epoca(fechas) -> np.ndarray:
+    """int32 por fila (solo para fechas válidas)."""
+    return (pd.to_datetime(fechas).to_numpy(dtype="datetime64[D]") - EPOCA).astype(np.int32)
+
+def ids_empleado(numero) -> np.ndarray:
+    """int32 por fila de `numero` ("000123" -> 123; -1 si no es entero). Se parsea cada número distinto una vez."""
+    num = numero if isinstance(numero, pd.Categorical) else pd.Categorical(numero)
+    if not len(num.categories):
+        return np.full(len(num), -1, dtype=np.int32)
+    ids = pd.to_numeric(pd.Series(num.categories, dtype=object), errors="coerce")
+    ids = ids.where((ids >= 0) & (ids < 2 ** 31) & (ids == ids.round())).fillna(-1).to_numpy(dtype=np.int32)
+    return np.where(num.codes >= 0, ids[num.codes], -1).astype(np.int32)
+
+def compactar_agenda(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Forma canónica en memoria de la agenda (la que devuelven los backends):
+    numero/nombre/equipo/tipo categóricas (cada texto distinto se guarda una vez),
+    id_empleado int32 (-1 si el número no es entero; `numero` conserva los ceros),
+    fecha datetime64[s] a medianoche y dia_n int32 (días desde 1970-01-01) para
+    filtrar por rango sin crear objetos date. Filas sin fecha válida se descartan.
+    """
+    fechas = pd.to_datetime(df["fecha"], errors="coerce")
+    ok = fechas.notna().to_numpy()
+    dias = fechas.to_numpy(dtype="datetime64[D]")[ok]
+    cats = {c: pd.Categorical(df[c].astype(str).str.strip().to_numpy()[ok]) for c in COLS_DIA}
+    return pd.DataFrame({
+        "numero": cats["numero"],
+        "nombre": cats["nombre"],
+        "equipo": cats["equipo"],
+        "fecha": dias.astype("datetime64[s]"),
+        "tipo": cats["tipo"],
+        "id_empleado": ids_empleado(cats["numero"]),
+        "dia_n": (dias - EPOCA).astype(np.int32),
+    })
+
+def unir_agenda(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Concatena dos agendas compactas sin perder los tipos (une las categorías)."""
+    if a is None or a.empty:
+        return b
+    if b.empty:
+        return a
+    data = {}
+    for c in a.columns:
+        if isinstance(a[c].dtype, pd.CategoricalDtype):
+            data[c] = union_categoricals([a[c], b[c]])
+        else:
+            data[c] = np.concatenate([a[c].to_numpy(), b[c].to_numpy()])
+    return pd.DataFrame(data)
+
+def filtrar_anios(df: pd.DataFrame, anios) -> pd.DataFrame:
+    """Filas de la agenda compacta cuyos días caen en `anios` (por rango de dia_n)."""
+    if df.empty:
+        return df
+    d = df["dia_n"].to_numpy()
+    m = np.zeros(len(df), dtype=bool)
+    for a in set(int(a) for a in anios):
+        m |= (d >= dia_n(dt.date(a, 1, 1))) & (d <= dia_n(dt.date(a, 12, 31)))
+    return df[m]
+
+def validar_reglas(equipos_dia, equipo: str):
+    """Lanza ValueError("LLENO" | "MISMO_EQUIPO") si `equipo` no cabe en un día con `equipos_dia`."""
+    if len(equipos_dia) >= MAX_POR_DIA:
+        raise ValueError("LLENO")
+    if equipo in equipos_dia:
+        raise ValueError("MISMO_EQUIPO")
+
+# ---------- Claves de deduplicado (numero, día, tipo) ----------
+_MEZCLA_DIA = np.uint64(0x9E3779B97F4A7C15)
+_MEZCLA_TIPO = np.uint64(0xBF58476D1CE4E5B9)
+
+def _hash_texto(s: pd.Series) -> np.ndarray:
+    """uint64 por fila; en columnas categóricas solo se hashea cada texto distinto una vez."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cats = pd.util.hash_array(np.asarray(s.cat.categories, dtype=object))
+        return cats[s.cat.codes.to_numpy()]
+    return pd.util.hash_array(s.astype(str).str.strip().to_numpy(dtype=object))
+
+def hash_claves(df: pd.DataFrame) -> np.ndarray:
+    """Hash uint64 de numero|día|tipo por fila (usa dia_n si la agenda ya viene compacta)."""
+    if df.empty:
+        return np.zeros(0, dtype=np.uint64)
+    dias = df["dia_n"].to_numpy() if "dia_n" in df else dias_desde_epoca(df["fecha"])
+    h_dia = pd.util.hash_array(np.asarray(dias, dtype=np.int64))
+    return _hash_texto(df["numero"]) ^ (h_dia * _MEZCLA_DIA) ^ (_hash_texto(df["tipo"]) * _MEZCLA_TIPO)
+
+class ClavesAgenda:
+    """
+    Conjunto de claves (numero, día, tipo) de la agenda como hashes uint64: un arreglo
+    ordenado (búsqueda binaria vectorizada) más las anexadas desde la última fusión.
+    Se construye una vez por carga completa y se actualiza con cada alta; consultar
+    un archivo de N filas cuesta O(N log H) sin armar cadenas de la agenda.
+    (64 bits: una colisión accidental es despreciable con cientos de miles de filas.)
+    """
+    FUSION = 50_000     # claves pendientes antes de fusionarlas al arreglo ordenado
+
+    def __init__(self, hashes=None):
+        self._orden = np.unique(hashes) if hashes is not None else np.zeros(0, dtype=np.uint64)
+        self._nuevas = []
+        self._n_nuevas = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_df(cls, df: pd.DataFrame) -> "ClavesAgenda":
+        return cls(hash_claves(df) if df is not None else None)
+
+    def agregar(self, hashes: np.ndarray):
+        with self._lock:
+            self._nuevas.append(np.asarray(hashes, dtype=np.uint64))
+            self._n_nuevas += len(hashes)
+            if self._n_nuevas >= self.FUSION:
+                self._orden = np.union1d(self._orden, np.concatenate(self._nuevas))
+                self._nuevas = []
+                self._n_nuevas = 0
+
+    def agregar_df(self, df: pd.DataFrame):
+        self.agregar(hash_claves(df))
+
+    def contiene(self, hashes: np.ndarray) -> np.ndarray:
+        """bool por hash: ya está en la agenda."""
+        with self._lock:
+            orden, nuevas = self._orden, list(self._nuevas)
+        pos = np.searchsorted(orden, hashes)
+        esta = orden[np.minimum(pos, len(orden) - 1)] == hashes if len(orden) else np.zeros(len(hashes), dtype=bool)
+        if nuevas:
+            esta |= np.isin(hashes, np.concatenate(nuevas))
+        return esta
+
+    def duplicadas(self, df: pd.DataFrame) -> np.ndarray:
+        """bool por fila de `df`: su clave ya está en la agenda o se repite antes en `df`."""
+        h = hash_claves(df)
+        return self.contiene(h) | pd.Series(h).duplicated().to_numpy()
+
+    def __len__(self):
+        return len(self._orden) + self._n_nuevas
+
+# ---------- Registro de varias fechas ----------
+OK = "OK"
+DUPLICADA = "DUPLICADA"     # la misma fecha vino dos veces en la solicitud
+CANCELADO = "CANCELADO"     # válida, pero no se escribió (todo o nada y otra fecha falló)
+
+def fila_agenda(rec: dict):
+    """Normaliza un registro -> (fecha: date, fila [numero, nombre, equipo, fecha_iso, tipo])."""
+    try:
+        fecha = pd.to_datetime(rec.get("fecha"), errors="coerce").date()
+    except Exception:
+        raise ValueError("FORMATO_FECHA")
+    if pd.isna(fecha):
+        raise ValueError("FORMATO_FECHA")
+    fila = [
+        str(rec.get("numero", "")).strip(),
+        str(rec.get("nombre", "")).strip(),
+        str(rec.get("equipo", "")).strip(),
+        fecha.isoformat(),
+        str(rec.get("tipo", "")).strip(),
+    ]
+    return fecha, fila
+
+def evaluar_fechas(indice: "OcupacionIndex", filas, todo_o_nada: bool = False) -> list:
+    """
+    Código por cada (fecha, fila) contra `indice` (una sola foto de la ocupación):
+    OK | LLENO | MISMO_EQUIPO | DUPLICADA | CANCELADO. Las filas OK se agregan a
+    `indice`, de modo que solicitudes posteriores del mismo lote las ven.
+    """
+    codigos = []
+    vistas = set()
+    for fecha, fila in filas:
+        if fecha in vistas:
+            codigos.append(DUPLICADA)
+            continue
+        vistas.add(fecha)
+        try:
+            indice.validar(fecha, fila[2])
+            codigos.append(OK)
+        except ValueError as e:
+            codigos.append(str(e))
+    if todo_o_nada and any(c not in (OK, DUPLICADA) for c in codigos):
+        return [CANCELADO if c == OK else c for c in codigos]
+    for (fecha, fila), c in zip(filas, codigos):
+        if c == OK:
+            indice.agregar(*fila)
+    return codigos
+
+def registrar_fechas(rec: dict, fechas, todo_o_nada: bool, escribir) -> list:
+    """
+    Parte común de append_agenda_rows_safe: normaliza cada fecha, delega en
+    escribir(filas, todo_o_nada) -> códigos (validación + un solo append) y arma
+    [(fecha_iso, código)] en el orden pedido. Una fecha inválida es FORMATO_FECHA.
+    """
+    pedidas = []
+    filas = []
+    for f in fechas:
+        try:
+            fecha, fila = fila_agenda(dict(rec, fecha=f))
+        except ValueError as e:
+            pedidas.append((str(f), str(e)))
+            continue
+        pedidas.append((fecha.isoformat(), None))
+        filas.append((fecha, fila))
+    if todo_o_nada and any(c is not None for _, c in pedidas):
+        return [(f, c or CANCELADO) for f, c in pedidas]
+    codigos = iter(escribir(filas, todo_o_nada) if filas else [])
+    return [(f, c if c is not None else next(codigos)) for f, c in pedidas]
+
+class OcupacionIndex:
+    """
+    fecha (date) -> registros del día (numero, nombre, equipo, tipo).
+    Se construye una vez por lectura completa de la agenda y se actualiza en sitio
+    con cada alta aceptada; todas las consultas por día son O(1).
+    """
+
+    def __init__(self):
+        self._dias = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_df(cls, df: pd.DataFrame) -> "OcupacionIndex":
+        idx = cls()
+        if df is None or df.empty:
+            return idx
+        fechas = pd.to_datetime(df["fecha"], errors="coerce")
+        ok = fechas.notna().to_numpy()
+        dias = fechas[ok].to_numpy().astype("datetime64[D]").tolist()
+        cols = [(np.asarray(df[c], dtype=object) if isinstance(df[c].dtype, pd.CategoricalDtype)
+                 else df[c].astype(str).str.strip().to_numpy())[ok] for c in COLS_DIA]
+        d = idx._dias
+        for f, num, nom, eq, tip in zip(dias, *cols):
+            d.setdefault(f, []).append((num, nom, eq, tip))
+        return idx
+
+    @classmethod
+    def desde_equipos(cls, equipos_por_fecha: dict) -> "OcupacionIndex":
+        """Índice parcial (solo equipos) a partir de {fecha: [equipos]}."""
+        idx = cls()
+        for f, equipos in equipos_por_fecha.items():
+            idx._dias[f] = [("", "", eq, "") for eq in equipos]
+        return idx
+
+    @staticmethod
+    def _key(fecha) -> dt.date:
+        if isinstance(fecha, dt.datetime):
+            return fecha.date()
+        if isinstance(fecha, dt.date):
+            return fecha
+        return pd.Timestamp(fecha).date()
+
+    def agregar(self, numero, nombre, equipo, fecha, tipo):
+        with self._lock:
+            self._dias.setdefault(self._key(fecha), []).append(
+                (str(numero).strip(), str(nombre).strip(), str(equipo).strip(), str(tipo).strip()))
+
+    def registros(self, fecha) -> list:
+        return list(self._dias.get(self._key(fecha), ()))
+
+    def conteo(self, fecha) -> int:
+        return len(self._dias.get(self._key(fecha), ()))
+
+    def equipos(self, fecha) -> set:
+        return {r[2] for r in self._dias.get(self._key(fecha), ())}
+
+    def nombres(self, fecha) -> list:
+        return [r[1] for r in self._dias.get(self._key(fecha), ())]
+
+    def detalle_df(self, fecha) -> pd.DataFrame:
+        return pd.DataFrame(self.registros(fecha), columns=COLS_DIA)
+
+    def validar(self, fecha, equipo: str):
+        validar_reglas([r[2] for r in self._dias.get(self._key(fecha), ())], str(equipo).strip())
+
+    def mapa(self, desde, dias: int):
+        """
+        Ocupación de `dias` días desde `desde` en arreglos: conteo int16 por día y
+        {equipo: bool por día} (un bitmap por equipo). Una pasada sobre el horizonte.
+        """
+        ini = self._key(desde)
+        conteo = np.zeros(dias, dtype=np.int16)
+        equipos = {}
+        with self._lock:
+            for i in range(dias):
+                regs = self._dias.get(ini + dt.timedelta(days=i))
+                if not regs:
+                    continue
+                conteo[i] = len(regs)
+                for r in regs:
+                    equipos.setdefault(r[2], np.zeros(dias, dtype=bool))[i] = True
+        return conteo, equipos
+
+    def __len__(self):
+        return sum(len(v) for v in self._dias.values())
+
+def buscar_disponibles(indice: OcupacionIndex, equipo: str, desde, horizonte: int, cantidad: int,
+                       consecutivos: bool = False, solo_habiles: bool = False) -> list:
+    """
+    Primeras `cantidad` fechas (date) en [desde, desde + horizonte) donde `equipo` cabe
+    (menos de MAX_POR_DIA y nadie de su equipo). Con `consecutivos`, el primer bloque
+    seguido de ese largo (con `solo_habiles` el fin de semana no corta el bloque).
+    [] si no hay suficientes.
+    """
+    desde = OcupacionIndex._key(desde)
+    if horizonte <= 0 or cantidad <= 0:
+        return []
+    conteo, equipos = indice.mapa(desde, horizonte)
+    libre = conteo < MAX_POR_DIA
+    propio = equipos.get(str(equipo).strip())
+    if propio is not None:
+        libre &= ~propio
+
+    pos = np.arange(horizonte)
+    if solo_habiles:
+        # weekday de desde + i sin crear fechas: 1970-01-01 fue jueves (3)
+        dow = (dia_n(desde) + 3 + pos) % 7
+        pos = pos[dow < 5]
+    libre = libre[pos]
+
+    if not consecutivos:
+        sel = pos[np.flatnonzero(libre)[:cantidad]]
+        if len(sel) < cantidad:
+            return []
+    else:
+        if len(libre) < cantidad:
+            return []
+        # ventanas de largo `cantidad` totalmente libres: suma acumulada
+        acum = np.concatenate([[0], np.cumsum(libre, dtype=np.int32)])
+        llenas = np.flatnonzero(acum[cantidad:] - acum[:-cantidad] == cantidad)
+        if not len(llenas):
+            return []
+        sel = pos[llenas[0]:llenas[0] + cantidad]
+    return [desde + dt.timedelta(days=int(i)) for i in sel]
+
+class OcupacionPorAnio:
+    """
+    Misma interfaz de consulta que OcupacionIndex sobre una agenda repartida por año:
+    cada consulta va al índice de su año, que `indice_de(anio)` carga solo al primer uso.
+    """
+
+    def __init__(self, indice_de):
+        self._indice_de = indice_de
+
+    def _de(self, fecha) -> OcupacionIndex:
+        return self._indice_de(OcupacionIndex._key(fecha).year)
+
+    def agregar(self, numero, nombre, equipo, fecha, tipo):
+        self._de(fecha).agregar(numero, nombre, equipo, fecha, tipo)
+
+    def registros(self, fecha) -> list:
+        return self._de(fecha).registros(fecha)
+
+    def conteo(self, fecha) -> int:
+        return self._de(fecha).conteo(fecha)
+
+    def equipos(self, fecha) -> set:
+        return self._de(fecha).equipos(fecha)
+
+    def nombres(self, fecha) -> list:
+        return self._de(fecha).nombres(fecha)
+
+    def detalle_df(self, fecha) -> pd.DataFrame:
+        return self._de(fecha).detalle_df(fecha)
+
+    def validar(self, fecha, equipo: str):
+        self._de(fecha).validar(fecha, equipo)
+
+    def mapa(self, desde, dias: int):
+        """Como OcupacionIndex.mapa, uniendo los tramos de cada año del horizonte."""
+        desde = OcupacionIndex._key(desde)
+        conteo = np.zeros(dias, dtype=np.int16)
+        equipos = {}
+        i = 0
+        while i < dias:
+            ini = desde + dt.timedelta(days=i)
+            n = min(dias - i, (dt.date(ini.year, 12, 31) - ini).days + 1)
+            c, eq = self._de(ini).mapa(ini, n)
+            conteo[i:i + n] = c
+            for e, b in eq.items():
+                equipos.setdefault(e, np.zeros(dias, dtype=bool))[i:i + n] = b
+            i += n
+        return conteo, equipos
+
+class OcupacionConPendientes:
+    """
+    Misma interfaz de consulta que OcupacionIndex: `base` (lo que ya está en el
+    almacenamiento) más `pendientes` (OcupacionIndex de registros aceptados que aún
+    no se escriben). Ninguno de los dos se copia.
+    """
+
+    def __init__(self, base, pendientes: OcupacionIndex):
+        self._base = base
+        self._pend = pendientes
+
+    def agregar(self, numero, nombre, equipo, fecha, tipo):
+        self._base.agregar(numero, nombre, equipo, fecha, tipo)
+
+    def registros(self, fecha) -> list:
+        return self._base.registros(fecha) + self._pend.registros(fecha)
+
+    def conteo(self, fecha) -> int:
+        return self._base.conteo(fecha) + self._pend.conteo(fecha)
+
+    def equipos(self, fecha) -> set:
+        return self._base.equipos(fecha) | self._pend.equipos(fecha)
+
+    def nombres(self, fecha) -> list:
+        return self._base.nombres(fecha) + self._pend.nombres(fecha)
+
+    def detalle_df(self, fecha) -> pd.DataFrame:
+        return pd.DataFrame(self.registros(fecha), columns=COLS_DIA)
+
+    def validar(self, fecha, equipo: str):
+        validar_reglas([r[2] for r in self.registros(fecha)], str(equipo).strip())
+
+    def mapa(self, desde, dias: int):
+        conteo, equipos = self._base.mapa(desde, dias)
+        c, eq = self._pend.mapa(desde, dias)
+        conteo = conteo + c
+        for e, b in eq.items():
+            equipos[e] = equipos[e] | b if e in equipos else b
+        return conteo, equipos
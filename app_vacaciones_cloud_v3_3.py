@@ -4,42 +4,53 @@ import streamlit.components.v1 as components
 import pandas as pd
 import datetime as dt
 import calendar
-from io import BytesIO
+import functools
 
-from storage_gsheets_v3 import (
-    get_empleados_dict, get_empleados_df,
-    get_agenda_df, append_agenda_row_safe, replace_agenda_df,
-    append_empleados_rows, replace_empleados_df,
-)
+import calendario
+import exportes
+import importacion
+import storage_metrics
+from agenda_index import buscar_disponibles
+from storage_backend import get_backend
+
+backend = get_backend()
 
 st.set_page_config(page_title="Vacaciones CH-1 (Cloud)", page_icon="📅", layout="wide")
 
 MESES = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
-DIAS = ["Lun","Mar","Mié","Jue","Vie","Sáb","Dom"]
 ADMIN_PASSWORD = st.secrets.get("admin_password", "CH1-Admin-2025")
 
-@st.cache_data(ttl=5)
+# El backend mantiene una caché compartida por todas las sesiones del proceso,
+# sincronizada por versión de datos y actualizada en cada escritura (write-through).
 def load_empleados():
-    return get_empleados_dict()
+    return backend.get_empleados_index()
 
-@st.cache_data(ttl=5)
 def load_agenda_df():
-    df = get_agenda_df()
-    # 🔧 Normalizar fecha SIEMPRE
-    if df is None or df.empty:
-        return pd.DataFrame(columns=["numero","nombre","equipo","fecha","tipo"])
-    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-    df = df.dropna(subset=["fecha"])
-    return df
-
-def clear_cache():
-    load_empleados.clear()
-    load_agenda_df.clear()
+    return backend.get_agenda_df()
+
+# Solo se ejecuta la sección elegida (st.tabs ejecutaría las cuatro en cada rerun) y
+# cada sección es un fragmento: sus widgets re-ejecutan solo esa sección.
+SECCIONES = {
+    "📝 Captura": "captura",
+    "📅 Calendario / Exportación": "calendario",
+    "🧰 Admin avanzado": "admin",
+    "📊 Reportes": "reportes",
+}
+
+def fragmento(nombre: str):
+    def deco(fn):
+        @st.fragment
+        @functools.wraps(fn)
+        def run():
+            with storage_metrics.seccion(nombre):
+                fn()
+        return run
+    return deco
 
 if "is_admin" not in st.session_state:
     st.session_state.is_admin = False
 
-with st.sidebar:
+with st.sidebar, storage_metrics.seccion("sidebar"):
     st.header("Vacaciones CH-1 (Cloud)")
     with st.expander("🔑 Administrador", expanded=False):
         if not st.session_state.is_admin:
@@ -55,13 +66,124 @@ with st.sidebar:
             if st.button("Cerrar sesión admin", key="btn_admin_logout"):
                 st.session_state.is_admin = False
 
-tab1, tab2, tab3, tab4 = st.tabs(["📝 Captura", "📅 Calendario / Exportación", "🧰 Admin avanzado", "📊 Reportes"])
+seccion_activa = st.radio("Sección", list(SECCIONES), horizontal=True, key="seccion_app", label_visibility="collapsed")
 
 # ---------------- Captura ----------------
-with tab1:
+MAX_DIAS_RANGO = 31
+HORIZONTE_MAX = 3 * 366
+DIAS_SEMANA = ["Lunes","Martes","Miércoles","Jueves","Viernes","Sábado","Domingo"]
+MENSAJES_REGISTRO = {
+    "OK": "✅ Registrado",
+    "LLENO": "Día lleno (3 personas)",
+    "MISMO_EQUIPO": "Ya hay alguien de tu equipo",
+    "FORMATO_FECHA": "Fecha inválida",
+    "DUPLICADA": "Fecha repetida",
+    "CANCELADO": "No se registró (todo o nada)",
+}
+
+def captura_varios_dias(emp, ocupacion):
+    """Bloque de fechas: una validación y una escritura para todo el rango."""
+    hoy = dt.date.today()
+    rango = st.date_input("Del / al", value=(hoy, hoy + dt.timedelta(days=4)),
+                          min_value=dt.date(hoy.year, 1, 1), max_value=dt.date(hoy.year+2, 12, 31),
+                          format="YYYY-MM-DD", key="rango_cap")
+    tipo = st.selectbox("Tipo", ["Vacaciones", "Permiso", "Sanción"], key="tipo_rango_cap")
+    c1, c2 = st.columns(2)
+    with c1:
+        habiles = st.checkbox("Omitir sábados y domingos", value=False, key="habiles_cap")
+    with c2:
+        todo_o_nada = st.checkbox("Todo o nada", value=False, key="todo_cap",
+                                  help="Si algún día no se puede, no se registra ninguno.")
+
+    if not isinstance(rango, (tuple, list)) or len(rango) != 2:
+        st.info("Selecciona la fecha inicial y la final.")
+        return
+    ini, fin = rango
+    fechas = [ini + dt.timedelta(days=i) for i in range((fin - ini).days + 1)]
+    if habiles:
+        fechas = [f for f in fechas if f.weekday() < 5]
+    if not fechas:
+        st.info("No hay días en el rango seleccionado.")
+        return
+    if len(fechas) > MAX_DIAS_RANGO:
+        st.warning(f"Máximo {MAX_DIAS_RANGO} días por solicitud.")
+        return
+
+    # Vista previa con el índice; la validación definitiva ocurre al escribir
+    previa = []
+    for f in fechas:
+        try:
+            ocupacion.validar(f, emp["equipo"])
+            previa.append((f.isoformat(), "Disponible"))
+        except ValueError as e:
+            previa.append((f.isoformat(), MENSAJES_REGISTRO.get(str(e), str(e))))
+    st.dataframe(pd.DataFrame(previa, columns=["fecha", "estado"]), hide_index=True, use_container_width=True)
+
+    if st.button(f"Registrar {len(fechas)} día(s)", key="btn_registrar_rango"):
+        registrar_varios(emp, tipo, fechas, todo_o_nada)
+
+def registrar_varios(emp, tipo, fechas, todo_o_nada):
+    """Una sola llamada al backend para todas las fechas y tabla de resultados por fecha."""
+    try:
+        with storage_metrics.seccion("registro"):
+            res = backend.append_agenda_rows_safe({
+                "numero": emp["numero"],
+                "nombre": emp["nombre"],
+                "equipo": emp["equipo"],
+                "tipo": tipo,
+            }, [f.isoformat() for f in fechas], todo_o_nada=todo_o_nada)
+    except Exception as e:
+        st.error(f"Error registrando: {e}")
+        return
+    ok = sum(1 for _, c in res if c == "OK")
+    if ok == len(res):
+        st.success(f"{ok} día(s) registrados exitosamente")
+    elif ok:
+        st.warning(f"Se registraron {ok} de {len(res)} días.")
+    else:
+        st.error("No se registró ningún día.")
+    st.dataframe(pd.DataFrame([(f, MENSAJES_REGISTRO.get(c, c)) for f, c in res], columns=["fecha", "resultado"]),
+                 hide_index=True, use_container_width=True)
+
+def captura_buscar_libres(emp, ocupacion):
+    """Primeros días donde cabe el equipo del empleado: una consulta sobre todo el horizonte."""
+    hoy = dt.date.today()
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        desde = st.date_input("Desde", value=hoy, min_value=dt.date(hoy.year, 1, 1),
+                              max_value=dt.date(hoy.year+2, 12, 31), format="YYYY-MM-DD", key="desde_buscar")
+    with c2:
+        horizonte = st.number_input("Buscar en los próximos (días)", min_value=7, max_value=HORIZONTE_MAX,
+                                    value=365, step=1, key="horizonte_buscar")
+    with c3:
+        cantidad = st.number_input("Días que necesitas", min_value=1, max_value=MAX_DIAS_RANGO,
+                                   value=5, step=1, key="cantidad_buscar")
+    c4, c5 = st.columns(2)
+    with c4:
+        consecutivos = st.checkbox("Seguidos", value=True, key="consecutivos_buscar")
+    with c5:
+        habiles = st.checkbox("Omitir sábados y domingos", value=True, key="habiles_buscar")
+
+    fechas = buscar_disponibles(ocupacion, emp["equipo"], desde, int(horizonte), int(cantidad),
+                                consecutivos=consecutivos, solo_habiles=habiles)
+    if not fechas:
+        st.warning("No hay suficientes días disponibles en ese horizonte. Prueba con otro rango o sin 'Seguidos'.")
+        return
+    st.success(f"Primeros días disponibles: {fechas[0].isoformat()} — {fechas[-1].isoformat()}")
+    st.dataframe(pd.DataFrame({"fecha": [f.isoformat() for f in fechas],
+                               "día": [DIAS_SEMANA[f.weekday()] for f in fechas]}),
+                 hide_index=True, use_container_width=True)
+
+    tipo = st.selectbox("Tipo", ["Vacaciones", "Permiso", "Sanción"], key="tipo_buscar")
+    # Todo o nada: las fechas se buscaron como un bloque
+    if st.button(f"Registrar estos {len(fechas)} día(s)", key="btn_registrar_buscar"):
+        registrar_varios(emp, tipo, fechas, todo_o_nada=True)
+
+@fragmento("captura")
+def seccion_captura():
     st.subheader("Captura de solicitudes")
     empleados_db = load_empleados()
-    agenda_df = load_agenda_df()
+    ocupacion = backend.get_ocupacion()   # al día con la versión de datos (ingiere solo el delta)
 
     c1, c2 = st.columns(2)
     with c1:
@@ -69,9 +191,17 @@ with tab1:
     with c2:
         numero_empleado = st.text_input("Número de empleado", key="num_emp")
 
-    if password and numero_empleado in empleados_db:
-        emp = empleados_db[numero_empleado]
+    # Acepta el número exacto o sin ceros a la izquierda ("123" encuentra "000123")
+    emp = empleados_db.buscar(numero_empleado) if password and numero_empleado else None
+    if emp:
         st.success(f"{emp['nombre']} — Equipo: {emp['equipo']}")
+        modo = st.radio("Registrar", ["Un día", "Varios días", "Buscar disponibles"], horizontal=True, key="modo_cap")
+        if modo == "Varios días":
+            captura_varios_dias(emp, ocupacion)
+            return
+        if modo == "Buscar disponibles":
+            captura_buscar_libres(emp, ocupacion)
+            return
 
         hoy = dt.date.today()
         c3, c4, c5 = st.columns(3)
@@ -86,25 +216,25 @@ with tab1:
         tipo = st.selectbox("Tipo", ["Vacaciones", "Permiso", "Sanción"], key="tipo_cap")
         fecha = dt.date(int(anio), int(mes), int(dia))
 
-        # Seguro contra .dt en DF vacío
-        personas_mismo_dia = agenda_df[agenda_df["fecha"].dt.date == fecha] if not agenda_df.empty else agenda_df.iloc[0:0]
-        if len(personas_mismo_dia) >= 3:
+        # Consulta O(1) al índice por fecha
+        registrados = ocupacion.nombres(fecha)
+        if len(registrados) >= 3:
             st.warning("Seleccione otro día, ya que el día que solicitas ya está llena la agenda")
-        elif any(personas_mismo_dia["equipo"] == emp["equipo"]):
+        elif emp["equipo"] in ocupacion.equipos(fecha):
             st.warning("No puedes seleccionar este día porque ya hay alguien de tu equipo registrado")
 
         colA, colB = st.columns([1,2])
         with colA:
             if st.button("Registrar día", key="btn_registrar"):
                 try:
-                    append_agenda_row_safe({
-                        "numero": numero_empleado,
-                        "nombre": emp["nombre"],
-                        "equipo": emp["equipo"],
-                        "fecha": fecha.isoformat(),
-                        "tipo": tipo
-                    })
-                    clear_cache()
+                    with storage_metrics.seccion("registro"):
+                        backend.append_agenda_row_safe({
+                            "numero": emp["numero"],
+                            "nombre": emp["nombre"],
+                            "equipo": emp["equipo"],
+                            "fecha": fecha.isoformat(),
+                            "tipo": tipo
+                        })
                     st.success("Día registrado exitosamente")
                 except ValueError as e:
                     code = str(e)
@@ -114,19 +244,17 @@ with tab1:
                         st.warning("No puedes seleccionar este día porque ya hay alguien de tu equipo registrado")
                     elif "FORMATO_FECHA" in code:
                         st.error("Fecha inválida. Intenta de nuevo.")
-                    elif "RACE_CONDITION" in code:
-                        st.warning("Se alcanzó el límite de 3 justo ahora. Intenta con otro día.")
                     else:
                         st.error(f"Error registrando: {e}")
         with colB:
             st.info(
                 f"Registrados el {fecha.isoformat()}: "
-                + (", ".join(personas_mismo_dia['nombre'].tolist()) if not personas_mismo_dia.empty else "ninguno")
+                + (", ".join(registrados) if registrados else "ninguno")
             )
 
-        if not personas_mismo_dia.empty:
+        if registrados:
             st.write("**Detalle del día**")
-            st.table(personas_mismo_dia[["numero","nombre","equipo","tipo"]])
+            st.table(ocupacion.detalle_df(fecha))
 
     else:
         if password and numero_empleado:
@@ -134,151 +262,102 @@ with tab1:
         st.info("Ingresa tu contraseña y un número de empleado válido para capturar.")
 
 # ---------------- Calendario / Exportación ----------------
-with tab2:
+@fragmento("calendario")
+def seccion_calendario():
     st.subheader("Calendario mensual y exportación")
     empleados_db = load_empleados()
-    df = load_agenda_df()
+    version = backend.get_data_version()
 
     hoy = dt.date.today()
     c1, c2, c3, c4 = st.columns([1,1,1,1])
     with c1:
         anioC = st.number_input("Año", value=hoy.year, min_value=hoy.year-1, max_value=hoy.year+3, key="anio_cal")
+    # Solo el año elegido (con la agenda por año, solo se lee esa hoja), y solo si el
+    # agregado de (versión, año) no está ya en caché
+    def agenda_anio():
+        return backend.get_agenda_df(anios=[int(anioC)])
+    agg = calendario.agregado((version, int(anioC)), agenda_anio)   # una pasada por versión de datos y año
     with c2:
         mesC = st.selectbox("Mes", list(range(1,13)), index=hoy.month-1, format_func=lambda m: MESES[m-1], key="mes_cal")
     with c3:
-        equipos = sorted({ v["equipo"] for v in empleados_db.values() })
+        equipos = empleados_db.equipos
         equipo_sel = st.selectbox("Equipo", ["Todos"] + equipos, key="equipo_cal")
     with c4:
         solo_llenos = st.checkbox("Solo días llenos (3)", value=False, key="llenos_cal")
 
-    dias_mes = calendar.monthrange(int(anioC), int(mesC))[1]
-    f_ini_date = dt.date(int(anioC), int(mesC), 1)
-    f_fin_date = dt.date(int(anioC), int(mesC), dias_mes)
-
-    if not df.empty:
-        fechas_date = df["fecha"].dt.date
-        mask = (fechas_date >= f_ini_date) & (fechas_date <= f_fin_date)
-        df_mes = df[mask].copy()
-        df_mes["dia"] = df_mes["fecha"].dt.day
-    else:
-        df_mes = df.copy()
-        df_mes["dia"] = []
-
-    if equipo_sel != "Todos" and not df_mes.empty:
-        df_eq = df_mes[df_mes["equipo"] == equipo_sel]
-    else:
-        df_eq = pd.DataFrame(columns=df_mes.columns)
-
-    conteo_total = df_mes.groupby("dia")["numero"].count().to_dict() if not df_mes.empty else {}
-    conteo_equipo = df_eq.groupby("dia")["numero"].count().to_dict() if not df_eq.empty else {}
-
-    # --- NUEVO: nombres por día para mostrar en cada celda (máx 3, con “…” si hay más)
-    nombres_por_dia = {}
-    if not df_mes.empty:
-        tmp = df_mes.groupby("dia")["nombre"].apply(list).to_dict()
-        for d, lista in tmp.items():
-            top3 = lista[:3]
-            texto = "<br>".join(top3)
-            if len(lista) > 3:
-                texto += "<br>…"
-            nombres_por_dia[d] = texto
-
-    def color_for(c):
-        if not c or c == 0: return "#e9ecef"
-        if c == 1: return "#2ecc71"
-        if c == 2: return "#f1c40f"
-        return "#e74c3c"
-
-    cal = calendar.Calendar(firstweekday=0)
-    weeks = cal.monthdayscalendar(int(anioC), int(mesC))
-
-    legend = """
-    <div style='display:flex; gap:12px; align-items:center; font-size:14px;'>
-      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#e9ecef;border:1px solid #ccc;'></span> 0</div>
-      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#2ecc71;'></span> 1</div>
-      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#f1c40f;'></span> 2</div>
-      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#e74c3c;'></span> 3</div>
-      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:12px;height:12px;border-radius:50%;background:#00bcd4;'></span> Equipo seleccionado</div>
-    </div>
-    """
-    st.markdown(legend, unsafe_allow_html=True)
+    st.markdown(calendario.LEYENDA_HTML, unsafe_allow_html=True)
     st.markdown("<br>", unsafe_allow_html=True)
 
-    html = "<table style='border-collapse:separate;border-spacing:8px;width:100%;table-layout:fixed;'>"
-    html += "<tr>" + "".join([f"<th style='text-align:center;font-weight:600;color:#333'>{d}</th>" for d in DIAS]) + "</tr>"
-    for week in weeks:
-        html += "<tr>"
-        for d in week:
-            if d == 0:
-                html += "<td></td>"
-                continue
-            count = int(conteo_total.get(d, 0))
-            if solo_llenos and count < 3:
-                html += "<td style='height:120px'></td>"
-                continue
-            color = color_for(count)
-            dot = ""
-            if equipo_sel != "Todos" and conteo_equipo.get(d, 0) > 0:
-                dot = "<div style='margin-top:6px;'><span style='display:inline-block;width:10px;height:10px;border-radius:50%;background:#00bcd4;'></span></div>"
-            nombres_html = nombres_por_dia.get(d, "")
-            cell = f"""
-            <td style='vertical-align:top; padding:8px; background:{color}; border:1px solid #ddd; border-radius:10px; text-align:center; height:120px;'>
-              <div style='font-weight:700;color:#1b1e23;font-size:16px'>{d}</div>
-              <div style='font-size:12px;color:#1b1e23'>{count} registro(s)</div>
-              {dot}
-              <div style='margin-top:6px; font-size:11px; line-height:1.25; color:#111'>
-                {nombres_html}
-              </div>
-            </td>
-            """
-            html += cell
-        html += "</tr>"
-    html += "</table>"
-
-    cal_height = 80 + (len(weeks) * 140)
+    html, cal_height = agg.html(anioC, mesC, equipo_sel, solo_llenos)
     components.html(html, height=cal_height, scrolling=True)
 
     # --- NUEVO: detalle por día + descargas del mes
     st.markdown("---")
     c_det1, c_det2 = st.columns([1,3])
     with c_det1:
-        dias_disponibles = sorted(df_mes["dia"].unique().tolist()) if not df_mes.empty else []
+        dias_disponibles = agg.dias_con_registros(anioC, mesC)
         dia_det = st.selectbox("Ver detalle del día", dias_disponibles, index=0 if dias_disponibles else None)
 
     with c_det2:
         if dias_disponibles:
-            detalle = df_mes[df_mes["dia"] == dia_det].sort_values(["equipo","nombre"])
             st.markdown(f"**Detalle {int(anioC)}-{int(mesC):02d}-{int(dia_det):02d}**")
-            st.dataframe(detalle[["numero","nombre","equipo","tipo"]], use_container_width=True)
+            st.dataframe(agg.detalle_df(anioC, mesC, dia_det), use_container_width=True)
         else:
             st.info("No hay registros para el mes seleccionado.")
 
-    if not df_mes.empty:
-        # Excel del detalle del mes
-        excel_mes = BytesIO()
-        with pd.ExcelWriter(excel_mes, engine="xlsxwriter") as writer:
-            df_export = df_mes.copy()
-            df_export["fecha"] = pd.to_datetime(df_export["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
-            df_export[["numero","nombre","equipo","fecha","tipo"]].to_excel(writer, sheet_name="Detalle_Mes", index=False)
+    # Los archivos se generan al hacer clic y se cachean por (mes, equipo, versión de datos)
+    sufijo = "" if equipo_sel == "Todos" else f"_{equipo_sel}"
+    def df_mes_equipo():
+        return exportes.filtrar_equipo(calendario.filtrar_mes(agenda_anio(), anioC, mesC), equipo_sel)
+
+    if dias_disponibles:
+        # Excel del detalle del mes (del equipo seleccionado, si hay)
         st.download_button(
             "⬇️ Descargar Excel (detalle del mes)",
-            data=excel_mes.getvalue(),
-            file_name=f"detalle_mes_{int(anioC)}_{int(mesC):02d}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            data=lambda: exportes.cacheado(
+                ("detalle_xlsx", int(anioC), int(mesC), equipo_sel, version),
+                lambda: exportes.excel_detalle_mes(df_mes_equipo())),
+            file_name=f"detalle_mes_{int(anioC)}_{int(mesC):02d}{sufijo}.xlsx",
+            mime=exportes.XLSX_MIME,
             key="dl_det_mes_xlsx"
         )
 
         # CSV rápido
         st.download_button(
             "⬇️ Descargar CSV (detalle del mes)",
-            data=df_mes[["numero","nombre","equipo","fecha","tipo"]].to_csv(index=False).encode("utf-8"),
-            file_name=f"detalle_mes_{int(anioC)}_{int(mesC):02d}.csv",
+            data=lambda: exportes.cacheado(
+                ("detalle_csv", int(anioC), int(mesC), equipo_sel, version),
+                lambda: exportes.csv_detalle_mes(df_mes_equipo())),
+            file_name=f"detalle_mes_{int(anioC)}_{int(mesC):02d}{sufijo}.csv",
             mime="text/csv",
             key="dl_det_mes_csv"
         )
 
+    # Varios meses / año completo (se escribe en streaming, sin copias intermedias)
+    with st.expander("⬇️ Exportar varios meses / año completo"):
+        c_r1, c_r2 = st.columns(2)
+        with c_r1:
+            mes_ini = st.selectbox("Desde", list(range(1,13)), index=0, format_func=lambda m: MESES[m-1], key="mes_ini_exp")
+        with c_r2:
+            mes_fin = st.selectbox("Hasta", list(range(1,13)), index=11, format_func=lambda m: MESES[m-1], key="mes_fin_exp")
+        if mes_fin < mes_ini:
+            st.warning("El mes final debe ser igual o posterior al inicial.")
+        else:
+            desde = dt.date(int(anioC), int(mes_ini), 1)
+            hasta = dt.date(int(anioC), int(mes_fin), calendar.monthrange(int(anioC), int(mes_fin))[1])
+            st.download_button(
+                "⬇️ Descargar Excel (rango)",
+                data=lambda: exportes.cacheado(
+                    ("rango_xlsx", int(anioC), (int(mes_ini), int(mes_fin)), equipo_sel, version),
+                    lambda: exportes.excel_rango(agenda_anio(), desde, hasta, equipo_sel)),
+                file_name=f"agenda_{int(anioC)}_{int(mes_ini):02d}-{int(mes_fin):02d}{sufijo}.xlsx",
+                mime=exportes.XLSX_MIME,
+                key="dl_rango_xlsx"
+            )
+
 # ---------------- Admin avanzado ----------------
-with tab3:
+@fragmento("admin")
+def seccion_admin():
     st.subheader("🧰 Admin avanzado")
     if not st.session_state.is_admin:
         st.info("Inicia sesión como admin para usar estas funciones.")
@@ -290,124 +369,80 @@ with tab3:
             upE = st.file_uploader("Archivo de empleados", type=["csv","xlsx"], key="emp_upload")
             modeE = st.radio("Modo", ["Anexar", "Reemplazar TODO"], index=0, horizontal=True)
 
-            def norm_emp(df: pd.DataFrame) -> pd.DataFrame:
-                cols_map = {c.lower().strip(): c for c in df.columns}
-                def pick(*names):
-                    for n in names:
-                        if n in cols_map:
-                            return cols_map[n]
-                    return None
-                cn = pick("numero","id","empleado","num","número")
-                nn = pick("nombre","name")
-                eq = pick("equipo","team","depto","departamento")
-                if any(x is None for x in [cn,nn,eq]):
-                    st.error("Faltan columnas requeridas (numero, nombre, equipo).")
-                    return pd.DataFrame(columns=["numero","nombre","equipo"])
-                out = pd.DataFrame({
-                    "numero": df[cn].astype(str).str.strip(),
-                    "nombre": df[nn].astype(str).str.strip(),
-                    "equipo": df[eq].astype(str).str.strip(),
-                })
-                return out
-
             if upE is not None:
                 try:
                     if upE.name.lower().endswith(".csv"):
                         df_in = pd.read_csv(upE)
                     else:
                         df_in = pd.read_excel(upE)
-                    df_norm = norm_emp(df_in)
+                    df_norm = importacion.norm_emp(df_in)
                     if df_norm.empty:
                         st.warning("No hay filas válidas.")
                     else:
                         st.dataframe(df_norm.head(10), use_container_width=True)
                         if st.button("Confirmar empleados", type="primary", key="btn_import_emp"):
-                            if modeE.startswith("Anexar"):
-                                append_empleados_rows(df_norm)
-                                clear_cache()
-                                st.success(f"Empleados agregados: {len(df_norm)}")
-                            else:
-                                replace_empleados_df(df_norm)
-                                clear_cache()
-                                st.success(f"Empleados reemplazados: {len(df_norm)}")
+                            with storage_metrics.seccion("importacion"):
+                                if modeE.startswith("Anexar"):
+                                    backend.append_empleados_rows(df_norm)
+                                    st.success(f"Empleados agregados: {len(df_norm)}")
+                                else:
+                                    backend.replace_empleados_df(df_norm)
+                                    st.success(f"Empleados reemplazados: {len(df_norm)}")
                 except Exception as e:
                     st.error(f"Error importando empleados: {e}")
             else:
                 st.info("Selecciona archivo de empleados para importar.")
 
         elif sec == "Importar HISTÓRICO (Agenda)":
-            st.markdown("Sube **JSON/CSV/Excel** con columnas: `numero, nombre, equipo, fecha, tipo`.")
-            up = st.file_uploader("Archivo histórico", type=["json","csv","xlsx"], key="hist_upload")
+            st.markdown("Sube **JSON/JSONL/CSV/Excel** con columnas: `numero, nombre, equipo, fecha, tipo`. "
+                        "Se procesa por partes: archivos grandes no se cargan completos en memoria.")
+            up = st.file_uploader("Archivo histórico", type=["json","jsonl","csv","xlsx"], key="hist_upload")
             mode = st.radio("Modo de importación", ["Anexar (evita duplicados)", "Reemplazar TODO"], index=0, horizontal=True)
 
-            def norm_agenda(df: pd.DataFrame) -> pd.DataFrame:
-                cols_map = {c.lower().strip(): c for c in df.columns}
-                def pick(*names):
-                    for n in names:
-                        if n in cols_map:
-                            return cols_map[n]
-                    return None
-                col_num = pick("numero","número","id","empleado","num")
-                col_nom = pick("nombre","name","empleado_nombre")
-                col_eq  = pick("equipo","team","depto","departamento")
-                col_fec = pick("fecha","date","dia","día")
-                col_tip = pick("tipo","motivo","clase")
-                required = [col_num, col_nom, col_eq, col_fec, col_tip]
-                if any(x is None for x in required):
-                    st.error("Faltan columnas requeridas.")
-                    return pd.DataFrame(columns=["numero","nombre","equipo","fecha","tipo"])
-                out = pd.DataFrame({
-                    "numero": df[col_num].astype(str).str.strip(),
-                    "nombre": df[col_nom].astype(str).str.strip(),
-                    "equipo": df[col_eq].astype(str).str.strip(),
-                    "fecha": pd.to_datetime(df[col_fec], errors="coerce"),
-                    "tipo":   df[col_tip].astype(str).str.strip().replace({"Sansión":"Sanción"})
-                }).dropna(subset=["fecha"])
-                return out
-
             if up is not None:
                 try:
-                    if up.name.lower().endswith(".json"):
-                        import json
-                        raw = json.load(up)
-                        if isinstance(raw, dict) and "agenda" in raw:
-                            raw = raw["agenda"]
-                        df_in = pd.DataFrame(raw)
-                    elif up.name.lower().endswith(".csv"):
-                        df_in = pd.read_csv(up)
-                    else:
-                        df_in = pd.read_excel(up)
-
-                    df_norm = norm_agenda(df_in)
-                    if df_norm.empty:
-                        st.warning("No hay filas válidas.")
-                    else:
-                        st.dataframe(df_norm.head(10), use_container_width=True)
-                        if st.button("Confirmar importación", type="primary", key="btn_import_hist"):
-                            if mode.startswith("Anexar"):
-                                actual = load_agenda_df()
-                                if not actual.empty:
-                                    actual["clave"] = actual["numero"].astype(str)+"|"+actual["fecha"].dt.strftime("%Y-%m-%d")+"|"+actual["tipo"].astype(str)
-                                else:
-                                    actual = pd.DataFrame(columns=["clave"])
-                                df_norm["clave"] = df_norm["numero"].astype(str)+"|"+df_norm["fecha"].dt.strftime("%Y-%m-%d")+"|"+df_norm["tipo"].astype(str)
-                                nuevos = df_norm[~df_norm["clave"].isin(actual.get("clave", pd.Series([], dtype=str)))].copy()
-                                if nuevos.empty:
-                                    st.info("No hay filas nuevas (todo eran duplicados).")
-                                else:
-                                    from storage_gsheets_v3 import _ws, AGENDA_HEADERS
-                                    ws = _ws("agenda", AGENDA_HEADERS)
-                                    nuevos2 = nuevos.copy()
-                                    nuevos2["fecha"] = pd.to_datetime(nuevos2["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
-                                    vals = nuevos2[["numero","nombre","equipo","fecha","tipo"]].astype(str).values.tolist()
-                                    start_row = max(2, len(ws.get_all_values()) + 1)
-                                    ws.update(f"A{start_row}", vals)
-                                    clear_cache()
-                                    st.success(f"Importados {len(nuevos)} registros.")
+                    previa = importacion.vista_previa(up)
+                    if previa.empty:
+                        st.warning("No hay filas válidas en las primeras filas del archivo.")
+                    st.caption("Vista previa (primeras filas normalizadas)")
+                    st.dataframe(previa, use_container_width=True)
+                    if st.button("Confirmar importación", type="primary", key="btn_import_hist"):
+                        reemplazar = not mode.startswith("Anexar")
+                        barra = st.progress(0.0, text="Importando...")
+                        res = None
+                        try:
+                            with storage_metrics.seccion("importacion"):
+                                partes = importacion.leer_agenda_por_partes(up)
+                                for res in importacion.importar_agenda(backend, partes, reemplazar):
+                                    barra.progress(res["avance"], text=f"Leídas {res['leidas']:,} · importadas {res['importadas']:,}")
+                        except Exception as e:
+                            hechas = res["importadas"] if res else 0
+                            if reemplazar:
+                                st.error(f"Reemplazo interrumpido: {e}. Vuelve a importar el mismo archivo en modo "
+                                         "Reemplazar: solo se escriben las filas que aún difieren.")
+                            else:
+                                st.error(f"Importación interrumpida tras {hechas:,} registros: {e}. "
+                                         "Vuelve a importar el mismo archivo en modo Anexar para continuar "
+                                         "(los ya escritos se omiten).")
+                        else:
+                            barra.progress(1.0, text="Importación completa")
+                            if res is None or res["validas"] == 0:
+                                st.warning("No hay filas válidas.")
+                            elif reemplazar:
+                                st.success(f"Reemplazo completo realizado: {res['importadas']} registros.")
+                            elif res["importadas"] == 0:
+                                st.info("No hay filas nuevas (todo eran duplicados).")
                             else:
-                                replace_agenda_df(df_norm[["numero","nombre","equipo","fecha","tipo"]])
-                                clear_cache()
-                                st.success(f"Reemplazo completo realizado: {len(df_norm)} registros.")
+                                st.success(f"Importados {res['importadas']} registros "
+                                           f"({res['duplicadas']} duplicados omitidos).")
+                        dups = importacion.reporte_duplicados(res)
+                        if not dups.empty:
+                            st.caption(f"Duplicados omitidos del archivo: {len(dups):,} (ya estaban en la agenda o repetidos)")
+                            st.dataframe(dups.head(100), use_container_width=True, hide_index=True)
+                            # on_click="ignore": descargar no re-ejecuta ni pierde este reporte
+                            st.download_button("⬇️ Reporte de duplicados (CSV)", data=dups.to_csv(index=False).encode("utf-8"),
+                                               file_name=f"duplicados_{up.name.rsplit('.', 1)[0]}.csv", mime="text/csv",
+                                               key="dl_dup_hist", on_click="ignore")
                 except Exception as e:
                     st.error(f"Error importando: {e}")
             else:
@@ -418,73 +453,159 @@ with tab3:
             has_sa = "gcp_service_account" in st.secrets
             sheet_url = st.secrets.get("sheet_url") or (st.secrets.get("gcp_service_account", {}).get("sheet_url") if has_sa else None)
             st.write(f"**Secrets:** SA={'OK' if has_sa else 'FALTA'} | sheet_url={'OK' if sheet_url else 'FALTA'}")
-            emp_df = get_empleados_df()
+            st.write(f"**Backend:** {backend.nombre}" + (f" (espejo: {backend.espejo.nombre})" if getattr(backend, "espejo", None) else ""))
+            sheets = backend if backend.nombre == "gsheets" else getattr(backend, "espejo", None)
+            if sheets is not None:
+                est_sheets = sheets.estado()
+                foto = est_sheets.get("foto_local") or {}
+                if not foto.get("activa"):
+                    st.write("**Foto local:** desactivada (secret `snapshot_dir`)")
+                else:
+                    st.write(f"**Foto local:** versión {foto.get('version') or '—'}"
+                             + (f", guardada hace {foto['edad_s']} s" if foto.get("edad_s") is not None else "")
+                             + (" · sirviendo la foto: el Sheet aún no responde" if foto.get("sirviendo_foto") else ""))
+                    if foto.get("ultimo_error"):
+                        st.caption(f"Último error al sincronizar: {foto['ultimo_error']}")
+                diario = est_sheets.get("diario") or {}
+                if not diario.get("activo"):
+                    st.write("**Diario de registros:** desactivado (cada registro espera su escritura en el Sheet; "
+                             "se activa con `diario_path` en Secrets, solo con disco persistente)")
+                else:
+                    st.write(f"**Diario de registros:** {diario.get('pendientes', 0)} por enviar al Sheet · "
+                             f"{diario.get('enviadas', 0)} enviados en este proceso"
+                             + (f" · último envío hace {diario['ultimo_envio_s']} s" if diario.get("ultimo_envio_s") is not None else ""))
+                    if diario.get("fallos_seguidos"):
+                        st.warning(f"El envío al Sheet falló {diario['fallos_seguidos']} vez/veces seguidas; se reintenta solo. "
+                                   f"Último error: {diario.get('ultimo_error')}")
+                    if diario.get("rechazadas"):
+                        st.warning("Registros aceptados que el Sheet ya no admitió al enviarlos (alguien ocupó el día antes):")
+                        st.dataframe(pd.DataFrame(diario["rechazadas"]), use_container_width=True, hide_index=True)
+                por_anio = est_sheets.get("agenda_por_anio")
+                st.write(f"**Agenda en Sheets:** {'una hoja por año (agenda_AAAA)' if por_anio else 'hoja única'}")
+                if not por_anio and st.button("Migrar agenda a hojas por año", key="btn_migrar_anio",
+                                              help="Copia 'agenda' a agenda_AAAA; 'agenda' queda como respaldo."):
+                    try:
+                        with storage_metrics.seccion("migracion"):
+                            res = sheets.migrar_agenda_por_anio()
+                        st.success("Migración completa: " + ", ".join(f"{a}: {n}" for a, n in res["anios"].items())
+                                   + (f" · {res['descartadas']} filas sin fecha válida no se migraron" if res["descartadas"] else ""))
+                    except Exception as e:
+                        st.error(f"Error migrando: {e}")
+            emp_df = backend.get_empleados_df()
+            emp_idx = load_empleados()
             ag_df = load_agenda_df()
             st.write(f"**Empleados cargados:** {len(emp_df)}")
             st.write(f"**Registros en agenda:** {0 if ag_df is None else len(ag_df)}")
             if not emp_df.empty:
                 st.dataframe(emp_df.head(10), use_container_width=True)
+            dup = emp_idx.duplicados
+            if not dup.empty:
+                st.warning(f"Números de empleado repetidos: {len(dup)} "
+                           f"({int(dup['conflicto'].sum())} con nombre/equipo distintos; se usa la última fila).")
+                st.dataframe(dup, use_container_width=True, hide_index=True)
+            if not emp_idx.alias_en_conflicto.empty:
+                st.warning("Números que coinciden sin ceros a la izquierda (el alias apunta al primero):")
+                st.dataframe(emp_idx.alias_en_conflicto, use_container_width=True, hide_index=True)
             if ag_df is not None and not ag_df.empty:
-                tmp = ag_df.copy()
-                tmp["fecha"] = pd.to_datetime(tmp["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
+                tmp = ag_df.head(10).copy()
+                tmp["fecha"] = tmp["fecha"].dt.strftime("%Y-%m-%d")
                 st.dataframe(tmp.head(10), use_container_width=True)
 
+            st.markdown("#### Llamadas al almacenamiento (este proceso)")
+            met = storage_metrics.resumen()
+            if met.empty:
+                st.info("Aún no hay llamadas registradas.")
+            else:
+                st.dataframe(met, use_container_width=True, hide_index=True)
+            estado = backend.estado()
+            if estado:
+                st.json(estado, expanded=False)
+            c_m1, c_m2 = st.columns(2)
+            with c_m1:
+                if st.button("Reiniciar métricas", key="btn_reset_metricas"):
+                    storage_metrics.reset()
+                    st.rerun()
+            with c_m2:
+                trace_path = storage_metrics.trace_path()
+                st.caption(f"Traza JSON-lines: `{trace_path}`" if trace_path else "Traza JSON-lines desactivada (secret `storage_trace_file`).")
+
 # ---------------- Reportes ----------------
-with tab4:
+@fragmento("reportes")
+def seccion_reportes():
     st.subheader("Reportes mensuales por equipo")
-    df_all = load_agenda_df().copy()
-    if df_all.empty:
+    hoy = dt.date.today()
+    c1, c2 = st.columns(2)
+    with c1:
+        anioR = st.number_input("Año", value=hoy.year, min_value=hoy.year-3, max_value=hoy.year+3, step=1, key="anio_rep")
+    with c2:
+        mesR = st.selectbox("Mes", list(range(1,13)), index=hoy.month-1, format_func=lambda m: MESES[m-1], key="mes_rep")
+    df_anio = backend.get_agenda_df(anios=[int(anioR)])
+    if df_anio.empty:
         st.info("No hay registros para generar reportes.")
     else:
-        df_all["anio"] = df_all["fecha"].dt.year
-        df_all["mes"] = df_all["fecha"].dt.month
-        hoy = dt.date.today()
-        c1, c2 = st.columns(2)
-        with c1:
-            anioR = st.number_input("Año", value=hoy.year, min_value=hoy.year-3, max_value=hoy.year+3, step=1, key="anio_rep")
-        with c2:
-            mesR = st.selectbox("Mes", list(range(1,13)), index=hoy.month-1, format_func=lambda m: MESES[m-1], key="mes_rep")
-
-        df_mes = df_all[(df_all["anio"]==int(anioR)) & (df_all["mes"]==int(mesR))].copy()
+        df_mes = calendario.filtrar_mes(df_anio, anioR, mesR)
         if df_mes.empty:
             st.warning("No hay datos en el mes seleccionado.")
         else:
-            pivot = pd.crosstab(df_mes["equipo"], df_mes["tipo"]).astype(int)
-            pivot = pivot.reindex(columns=["Vacaciones","Permiso","Sanción"], fill_value=0)
-            pivot["Total"] = pivot.sum(axis=1)
-            pivot = pivot.sort_values("Total", ascending=False)
+            pivot, dcnt, criticos = exportes.reporte_mes(df_mes)
+            version = backend.get_data_version()
 
             st.markdown("**Resumen por equipo**")
             st.dataframe(pivot, use_container_width=True)
             st.bar_chart(pivot["Total"])
 
-            dcnt = df_mes.groupby(df_mes["fecha"].dt.date)["numero"].count().reset_index(name="registros")
-            criticos = dcnt[dcnt["registros"]>=3].sort_values(["registros","fecha"], ascending=[False, True])
             st.markdown("**Días críticos (3 o más registros en el día)**")
             if criticos.empty:
                 st.info("No hubo días críticos en este mes.")
             else:
                 st.dataframe(criticos.rename(columns={"fecha":"día"}), use_container_width=True)
 
-            excel_io = BytesIO()
-            with pd.ExcelWriter(excel_io, engine="xlsxwriter") as writer:
-                pivot.to_excel(writer, sheet_name="Resumen_Equipos")
-                dcnt.to_excel(writer, sheet_name="Conteo_por_Dia", index=False)
-                if not criticos.empty:
-                    criticos.rename(columns={"fecha":"dia"}).to_excel(writer, sheet_name="Dias_Criticos", index=False)
-
             st.download_button(
                 "⬇️ Descargar Excel del reporte",
-                data=excel_io.getvalue(),
+                data=lambda: exportes.cacheado(
+                    ("reporte_xlsx", int(anioR), int(mesR), "Todos", version),
+                    lambda: exportes.excel_reporte(pivot, dcnt, criticos)),
                 file_name=f"reporte_{int(anioR)}_{int(mesR):02d}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                mime=exportes.XLSX_MIME,
                 key="dl_rep_xlsx"
             )
 
             st.download_button(
                 "⬇️ Descargar CSV (Resumen por equipo)",
-                data=pivot.to_csv().encode("utf-8"),
+                data=lambda: exportes.cacheado(
+                    ("reporte_csv", int(anioR), int(mesR), "Todos", version),
+                    lambda: pivot.to_csv().encode("utf-8")),
                 file_name=f"reporte_equipos_{int(anioR)}_{int(mesR):02d}.csv",
                 mime="text/csv",
                 key="dl_rep_csv"
             )
+
+    # Varios años: una consulta que une solo las particiones del rango
+    with st.expander("Resumen de varios años"):
+        c3, c4 = st.columns(2)
+        with c3:
+            anio_ini = st.number_input("Desde", value=hoy.year-1, min_value=2000, max_value=hoy.year+3, step=1, key="anio_ini_rep")
+        with c4:
+            anio_fin = st.number_input("Hasta", value=hoy.year, min_value=2000, max_value=hoy.year+3, step=1, key="anio_fin_rep")
+        if anio_fin < anio_ini:
+            st.warning("El año final debe ser igual o posterior al inicial.")
+        elif st.checkbox("Calcular resumen", key="calc_anios_rep"):
+            # lee las particiones del rango solo a pedido; el resultado se guarda en la
+            # sesión por (versión, rango) y los reruns siguientes no tocan el almacenamiento
+            clave = (backend.get_data_version(), int(anio_ini), int(anio_fin))
+            previo = st.session_state.get("resumen_anios")
+            if previo is None or previo[0] != clave:
+                df_anios = backend.get_agenda_df(anios=range(int(anio_ini), int(anio_fin) + 1))
+                previo = st.session_state["resumen_anios"] = (clave, exportes.reporte_anios(df_anios))
+            resumen = previo[1]
+            if resumen.empty:
+                st.info("No hay registros en esos años.")
+            else:
+                st.dataframe(resumen, use_container_width=True)
+
+{
+    "captura": seccion_captura,
+    "calendario": seccion_calendario,
+    "admin": seccion_admin,
+    "reportes": seccion_reportes,
+}[SECCIONES[seccion_activa]]()
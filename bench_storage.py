@@ -0,0 +1,334 @@
+# Benchmarks sin red: storage_gsheets_v3 y las rutas de datos de la app contra fake_gspread.
+#
+#   python bench_storage.py                               # 1k / 10k / 100k filas, JSON a stdout
+#   python bench_storage.py --filas 1000 --latencia-ms 50 --salida bench.json
+#
+# La salida es JSON (una entrada por caso y tamaño) para comparar entre versiones.
+import argparse
+import datetime as dt
+import io
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import calendario
+import exportes
+import importacion
+import storage_gsheets_v3 as s3
+from agenda_index import ClavesAgenda, OcupacionIndex, buscar_disponibles, compactar_agenda
+from empleados_index import EmpleadosIndex
+from fake_gspread import FakeSpreadsheet
+from gsheets_scheduler import Planificador
+from storage_backend import GSheetsBackend
+
+TIPOS = ["Vacaciones", "Permiso", "Sanción"]
+COLS_TEXTO = ["numero", "nombre", "equipo", "tipo"]
+INICIO = dt.date(2020, 1, 1)
+
+# ---------- datos sintéticos ----------
+def empleados_filas(n: int, equipos: int) -> list:
+    return [[f"{i:06d}", f"Empleado {i}", f"EQ{i % equipos:02d}"] for i in range(1, n + 1)]
+
+def agenda_filas(n: int, empleados: int, equipos: int, seed: int = 7, inicio: dt.date = INICIO) -> list:
+    """~2 registros por día desde `inicio`, de equipos distintos; respeta las reglas."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        fecha = inicio + dt.timedelta(days=i // 2)
+        eq = (i // 2 * 2 + i % 2) % equipos
+        num = eq + equipos * rnd.randrange(max(1, empleados // equipos)) + 1
+        out.append([f"{num:06d}", f"Empleado {num}", f"EQ{eq:02d}", fecha.isoformat(), rnd.choice(TIPOS)])
+    return out
+
+def agenda_df(filas: list) -> pd.DataFrame:
+    """Agenda en la forma compacta que devuelven los backends."""
+    return compactar_agenda(pd.DataFrame(filas, columns=s3.AGENDA_HEADERS))
+
+def preparar(args, filas_agenda: list, filas_emp: list) -> FakeSpreadsheet:
+    sh = FakeSpreadsheet(latencia_s=args.latencia_ms / 1000, por_celda_s=args.por_celda_us / 1e6,
+                         lecturas_por_minuto=args.cuota_lecturas, escrituras_por_minuto=args.cuota_escrituras)
+    sh.hoja("agenda", [s3.AGENDA_HEADERS] + filas_agenda)
+    sh.hoja("empleados", [s3.EMP_HEADERS] + filas_emp)
+    sh.hoja("meta", [s3.META_HEADERS, ["version", "1"]])
+    # Sin cuota propia en el planificador salvo que se pida: medimos el almacenamiento, no la espera
+    plan = Planificador(lecturas_por_minuto=args.cuota_lecturas or 1e9,
+                        escrituras_por_minuto=args.cuota_escrituras or 1e9,
+                        backoff_base_s=0.05)
+    s3.usar_spreadsheet(sh, plan)
+    return sh
+
+# ---------- medición ----------
+def resumen_ms(muestras: list) -> dict:
+    a = np.asarray(muestras, dtype=float) * 1000
+    if a.size == 0:
+        return {"n": 0}
+    p50, p95 = np.percentile(a, [50, 95])
+    return {"n": int(a.size), "media_ms": round(float(a.mean()), 3), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "max_ms": round(float(a.max()), 3)}
+
+def cronometrar(fn, repeticiones: int) -> list:
+    out = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+def llamadas(sh: FakeSpreadsheet, antes: dict = None) -> dict:
+    antes = antes or {}
+    return {k: v - antes.get(k, 0) for k, v in sh.llamadas.items() if v - antes.get(k, 0)}
+
+# ---------- casos ----------
+def caso_registro(args, n: int) -> list:
+    filas = agenda_filas(n, args.empleados, args.equipos)
+    sh = preparar(args, filas, empleados_filas(args.empleados, args.equipos))
+    # Fechas libres: después del último día sembrado
+    base = INICIO + dt.timedelta(days=n // 2 + 10)
+    fechas = iter(base + dt.timedelta(days=k) for k in range(10 ** 6))
+
+    def rec():
+        f = next(fechas)
+        return {"numero": "000001", "nombre": "Empleado 1", "equipo": "EQ01", "fecha": f.isoformat(), "tipo": "Vacaciones"}
+
+    res = []
+    antes = dict(sh.llamadas)
+    frio = cronometrar(lambda: s3.append_agenda_row_safe(rec()), 1)
+    res.append({"caso": "registro_frio", "filas": n, **resumen_ms(frio), "llamadas": llamadas(sh, antes)})
+
+    antes = dict(sh.llamadas)
+    sec = cronometrar(lambda: s3.append_agenda_row_safe(rec()), args.repeticiones)
+    res.append({"caso": "registro_secuencial", "filas": n, **resumen_ms(sec),
+                "ops_por_s": round(len(sec) / sum(sec), 2), "llamadas": llamadas(sh, antes)})
+
+    recs = [rec() for _ in range(args.rafaga)]
+    lat = []
+    def uno(r):
+        t0 = time.perf_counter()
+        s3.append_agenda_row_safe(r)
+        lat.append(time.perf_counter() - t0)
+    antes = dict(sh.llamadas)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.rafaga) as ex:
+        list(ex.map(uno, recs))
+    total = time.perf_counter() - t0
+    res.append({"caso": "registro_rafaga", "filas": n, "concurrentes": args.rafaga, **resumen_ms(lat),
+                "ops_por_s": round(len(recs) / total, 2), "llamadas": llamadas(sh, antes)})
+
+    # Varios días de una vez: una validación y un append por lote de 10 fechas
+    def lote():
+        r = rec()
+        s3.append_agenda_rows_safe(r, [next(fechas) for _ in range(10)])
+    antes = dict(sh.llamadas)
+    res.append({"caso": "registro_lote_10_dias", "filas": n, **resumen_ms(cronometrar(lote, args.repeticiones)),
+                "llamadas": llamadas(sh, antes)})
+    return res
+
+def caso_empleados(args) -> list:
+    sh = preparar(args, [], empleados_filas(args.empleados, args.equipos))
+    antes = dict(sh.llamadas)
+    frio = cronometrar(s3.get_empleados_dict, 1)
+    res = [{"caso": "empleados_dict_frio", "filas": args.empleados, **resumen_ms(frio), "llamadas": llamadas(sh, antes)}]
+
+    # Solo construcción (sin leer el Sheet): índice a partir del DataFrame ya leído
+    df_emp = s3.get_empleados_df()
+    res.append({"caso": "empleados_indice_construccion", "filas": args.empleados,
+                **resumen_ms(cronometrar(lambda: EmpleadosIndex(df_emp), args.repeticiones))})
+    return res
+
+def caso_calendario(args, df: pd.DataFrame) -> list:
+    mitad = df["fecha"].iloc[len(df) // 2]
+    anio, mes = mitad.year, mitad.month
+
+    def mes_completo():
+        df_mes = calendario.filtrar_mes(df, anio, mes)
+        tot, eq, nombres = calendario.agregar_mes(df_mes, "EQ01")
+        calendario.html_mes(anio, mes, tot, eq, nombres, "EQ01", False)
+
+    def solo_filtro():
+        calendario.filtrar_mes(df, anio, mes)
+    agg = calendario.AgregadoMeses(df)
+    meses = [(a, m) for a in range(anio - 1, anio + 1) for m in range(1, 13)]
+
+    def cambiar_mes():
+        # vista ya armada (caso típico tras la primera visita): búsqueda en dict
+        for a, m in meses:
+            agg.html(a, m, "EQ01", False)
+    return [
+        {"caso": "calendario_filtro_mes", "filas": len(df), **resumen_ms(cronometrar(solo_filtro, args.repeticiones))},
+        {"caso": "calendario_mes_html", "filas": len(df), **resumen_ms(cronometrar(mes_completo, args.repeticiones))},
+        {"caso": "calendario_agregado_construccion", "filas": len(df),
+         **resumen_ms(cronometrar(lambda: calendario.AgregadoMeses(df), max(1, args.repeticiones // 4)))},
+        {"caso": "calendario_24_meses_cacheado", "filas": len(df), **resumen_ms(cronometrar(cambiar_mes, args.repeticiones))},
+    ]
+
+def caso_disponibles(args, df: pd.DataFrame) -> list:
+    # Horizonte de un año desde la mitad de la agenda (días ya ocupados por otros equipos)
+    indice = OcupacionIndex.desde_df(df)
+    desde = df["fecha"].iloc[len(df) // 2].date()
+
+    def buscar():
+        buscar_disponibles(indice, "EQ01", desde, 365, 10, consecutivos=True, solo_habiles=True)
+    return [{"caso": "buscar_disponibles_365_dias", "filas": len(df),
+             **resumen_ms(cronometrar(buscar, args.repeticiones))}]
+
+def caso_importacion(args, df: pd.DataFrame) -> list:
+    # Archivo subido (forma de importacion.norm_agenda): mitad repetidos y mitad nuevos
+    k = min(args.importar, len(df))
+    repetidos = df.sample(n=k // 2, random_state=1)[s3.AGENDA_HEADERS].astype({c: str for c in COLS_TEXTO})
+    nuevos = pd.DataFrame(agenda_filas(k - len(repetidos), args.empleados, args.equipos, seed=99,
+                                       inicio=INICIO + dt.timedelta(days=len(df))), columns=s3.AGENDA_HEADERS)
+    nuevos["fecha"] = pd.to_datetime(nuevos["fecha"])
+    subida = pd.concat([repetidos, nuevos], ignore_index=True)
+    claves = ClavesAgenda.desde_df(df)
+    # en frío: primera importación del proceso (arma el índice y consulta)
+    return [{"caso": "importacion_dedup", "filas": len(df), "subidas": len(subida),
+             **resumen_ms(cronometrar(lambda: ClavesAgenda.desde_df(df).duplicadas(subida), args.repeticiones))},
+            {"caso": "importacion_claves_construccion", "filas": len(df),
+             **resumen_ms(cronometrar(lambda: ClavesAgenda.desde_df(df), max(1, args.repeticiones // 4)))},
+            # índice mantenido (caso de la app): solo se hashea el archivo subido
+            {"caso": "importacion_dedup_indice", "filas": len(df), "subidas": len(subida),
+             **resumen_ms(cronometrar(lambda: claves.duplicadas(subida), args.repeticiones))}]
+
+def caso_importacion_archivo(args, n: int) -> list:
+    # CSV subido completo al Sheet por partes: leer, normalizar, deduplicar y anexar en lotes
+    sh = preparar(args, agenda_filas(n, args.empleados, args.equipos), empleados_filas(args.empleados, args.equipos))
+    filas = agenda_filas(args.importar, args.empleados, args.equipos, seed=99, inicio=INICIO + dt.timedelta(days=n))
+    up = io.BytesIO(pd.DataFrame(filas, columns=s3.AGENDA_HEADERS).to_csv(index=False).encode())
+    up.name = "historico.csv"
+    backend = GSheetsBackend()
+    backend.get_agenda_df()     # caché caliente, como en la app
+    antes = dict(sh.llamadas)
+    t = cronometrar(lambda: list(importacion.importar_agenda(backend, importacion.leer_agenda_por_partes(up))), 1)
+    return [{"caso": "importacion_archivo_por_partes", "filas": n, "subidas": len(filas), **resumen_ms(t),
+             "llamadas": llamadas(sh, antes)}]
+
+def caso_reemplazo(args, n: int) -> list:
+    # "Reemplazar TODO" con correcciones menores: 1% de filas editadas, 10 borradas y 10 nuevas
+    filas = agenda_filas(n, args.empleados, args.equipos)
+    sh = preparar(args, filas, empleados_filas(args.empleados, args.equipos))
+    nuevas = [list(f) for f in filas]
+    for i in range(0, n, 100):
+        nuevas[i][4] = "Permiso" if nuevas[i][4] != "Permiso" else "Vacaciones"
+    del nuevas[n // 2:n // 2 + 10]
+    nuevas += agenda_filas(10, args.empleados, args.equipos, seed=5, inicio=INICIO + dt.timedelta(days=n))
+    df = pd.DataFrame(nuevas, columns=s3.AGENDA_HEADERS)
+    antes, celdas = dict(sh.llamadas), sh.celdas
+    t = cronometrar(lambda: s3.replace_agenda_df(df), 1)
+    return [{"caso": "reemplazo_por_diferencias", "filas": n, **resumen_ms(t),
+             "celdas": sh.celdas - celdas, "llamadas": llamadas(sh, antes)}]
+
+def caso_registro_diario(args, n: int) -> list:
+    # Registro con diario local: el clic espera el disco, el envío al Sheet va en segundo plano
+    filas = agenda_filas(n, args.empleados, args.equipos)
+    base = INICIO + dt.timedelta(days=n // 2 + 10)
+    with tempfile.TemporaryDirectory() as tmp:
+        sh = preparar(args, filas, empleados_filas(args.empleados, args.equipos))
+        s3.usar_spreadsheet(sh, diario=f"{tmp}/diario.db")
+        s3.get_ocupacion()
+        antes = dict(sh.llamadas)
+        fechas = iter(base + dt.timedelta(days=k) for k in range(10 ** 6))
+
+        def registrar():
+            s3.append_agenda_row_safe({"numero": "000001", "nombre": "Empleado 1", "equipo": "EQ01",
+                                       "fecha": next(fechas).isoformat(), "tipo": "Vacaciones"})
+        t = cronometrar(registrar, args.repeticiones)
+        t0 = time.perf_counter()
+        s3._DIARIO.enviar_todo()
+        vaciado = time.perf_counter() - t0
+        res = [{"caso": "registro_con_diario", "filas": n, **resumen_ms(t),
+                "vaciado_ms": round(vaciado * 1000, 3), "llamadas": llamadas(sh, antes)}]
+        s3.usar_spreadsheet(sh)
+    return res
+
+def caso_arranque_foto(args, n: int) -> list:
+    # Primera lectura del proceso (empleados + ocupación + agenda) sin foto local y desde la foto
+    filas, emp = agenda_filas(n, args.empleados, args.equipos), empleados_filas(args.empleados, args.equipos)
+
+    def primera_lectura():
+        s3.get_empleados_index()
+        s3.get_ocupacion()
+        s3.get_agenda_df()
+    res = []
+    with tempfile.TemporaryDirectory() as foto:
+        sh = preparar(args, filas, emp)
+        s3.usar_spreadsheet(sh, foto=foto)
+        t = cronometrar(primera_lectura, 1)
+        res.append({"caso": "arranque_sin_foto", "filas": n, **resumen_ms(t), "llamadas": llamadas(sh)})
+        s3._FOTO.guardar()
+        sh = preparar(args, filas, emp)
+        s3.usar_spreadsheet(sh, foto=foto)     # "reinicio": cachés vacías, foto en disco
+        t = cronometrar(primera_lectura, 1)
+        res.append({"caso": "arranque_desde_foto", "filas": n, **resumen_ms(t), "llamadas": llamadas(sh)})
+        s3.usar_spreadsheet(sh)
+    return res
+
+def caso_exportes(args, df: pd.DataFrame) -> list:
+    mitad = df["fecha"].iloc[len(df) // 2]
+    df_mes = calendario.filtrar_mes(df, mitad.year, mitad.month)
+
+    def reporte():
+        exportes.excel_reporte(*exportes.reporte_mes(df_mes))
+    return [
+        {"caso": "excel_detalle_mes", "filas": len(df), "filas_mes": len(df_mes),
+         **resumen_ms(cronometrar(lambda: exportes.excel_detalle_mes(df_mes), args.repeticiones))},
+        {"caso": "excel_reporte_mes", "filas": len(df), "filas_mes": len(df_mes),
+         **resumen_ms(cronometrar(reporte, args.repeticiones))},
+        {"caso": "excel_agenda_completa", "filas": len(df),
+         **resumen_ms(cronometrar(lambda: exportes.excel_detalle_mes(df), 1))},
+        {"caso": "excel_agenda_completa_streaming", "filas": len(df),
+         **resumen_ms(cronometrar(lambda: exportes.excel_rango(df, df["fecha"].min().date(),
+                                                               df["fecha"].max().date()), 1))},
+    ]
+
+def main(argv=None) -> dict:
+    ap = argparse.ArgumentParser(description="Benchmarks de almacenamiento y rutas de datos (sin red).")
+    ap.add_argument("--filas", type=int, nargs="+", default=[1000, 10000, 100000], help="tamaños de agenda")
+    ap.add_argument("--empleados", type=int, default=5000)
+    ap.add_argument("--equipos", type=int, default=40)
+    ap.add_argument("--latencia-ms", type=float, default=20.0, help="latencia fija por llamada del fake")
+    ap.add_argument("--por-celda-us", type=float, default=0.0, help="latencia extra por celda transferida")
+    ap.add_argument("--cuota-lecturas", type=float, default=None, help="lecturas/min del fake (429 al exceder)")
+    ap.add_argument("--cuota-escrituras", type=float, default=None, help="escrituras/min del fake (429 al exceder)")
+    ap.add_argument("--repeticiones", type=int, default=20)
+    ap.add_argument("--rafaga", type=int, default=20, help="registros concurrentes en el caso ráfaga")
+    ap.add_argument("--importar", type=int, default=2000, help="filas del archivo simulado de importación")
+    ap.add_argument("--salida", default=None, help="archivo JSON (por defecto stdout)")
+    args = ap.parse_args(argv)
+
+    resultados = caso_empleados(args)
+    for n in args.filas:
+        resultados += caso_registro(args, n)
+        resultados += caso_importacion_archivo(args, n)
+        resultados += caso_reemplazo(args, n)
+        resultados += caso_registro_diario(args, n)
+        resultados += caso_arranque_foto(args, n)
+        df = agenda_df(agenda_filas(n, args.empleados, args.equipos))
+        resultados += caso_calendario(args, df)
+        resultados += caso_disponibles(args, df)
+        resultados += caso_importacion(args, df)
+        resultados += caso_exportes(args, df)
+
+    salida = {
+        "fecha": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "parametros": {k: v for k, v in vars(args).items() if k != "salida"},
+        "resultados": resultados,
+    }
+    texto = json.dumps(salida, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as fh:
+            fh.write(texto + "\n")
+    else:
+        sys.stdout.write(texto + "\n")
+    return salida
+
+if __name__ == "__main__":
+    main()
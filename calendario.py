@@ -0,0 +1,192 @@
+# Calendario mensual: agregación por día y HTML de la vista (pestaña Calendario / Exportación)
+import calendar
+import datetime as dt
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from agenda_index import dia_n
+
+DIAS = ["Lun","Mar","Mié","Jue","Vie","Sáb","Dom"]
+
+LEYENDA_HTML = """
+    <div style='display:flex; gap:12px; align-items:center; font-size:14px;'>
+      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#e9ecef;border:1px solid #ccc;'></span> 0</div>
+      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#2ecc71;'></span> 1</div>
+      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#f1c40f;'></span> 2</div>
+      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:16px;height:16px;background:#e74c3c;'></span> 3</div>
+      <div style='display:flex; align-items:center; gap:6px;'><span style='display:inline-block;width:12px;height:12px;border-radius:50%;background:#00bcd4;'></span> Equipo seleccionado</div>
+    </div>
+    """
+
+def color_for(c):
+    if not c or c == 0: return "#e9ecef"
+    if c == 1: return "#2ecc71"
+    if c == 2: return "#f1c40f"
+    return "#e74c3c"
+
+def filtrar_mes(df: pd.DataFrame, anio: int, mes: int) -> pd.DataFrame:
+    """Registros del mes (agenda compacta) con columna `dia`; filtra sobre dia_n (int32)."""
+    dias_mes = calendar.monthrange(int(anio), int(mes))[1]
+    d0 = dia_n(dt.date(int(anio), int(mes), 1))
+    if df.empty:
+        return df.assign(dia=pd.Series([], dtype="int32"))
+    n = df["dia_n"]
+    df_mes = df[(n >= d0) & (n < d0 + dias_mes)]
+    return df_mes.assign(dia=df_mes["dia_n"] - d0 + 1)
+
+def _nombres_celda(lista) -> str:
+    # nombres por día para mostrar en cada celda (máx 3, con “…” si hay más)
+    texto = "<br>".join(lista[:3])
+    if len(lista) > 3:
+        texto += "<br>…"
+    return texto
+
+def agregar_mes(df_mes: pd.DataFrame, equipo_sel: str):
+    """(conteo_total, conteo_equipo, nombres_por_dia) por número de día."""
+    if equipo_sel != "Todos" and not df_mes.empty:
+        df_eq = df_mes[df_mes["equipo"] == equipo_sel]
+    else:
+        df_eq = pd.DataFrame(columns=df_mes.columns)
+
+    conteo_total = df_mes.groupby("dia")["numero"].count().to_dict() if not df_mes.empty else {}
+    conteo_equipo = df_eq.groupby("dia")["numero"].count().to_dict() if not df_eq.empty else {}
+
+    nombres_por_dia = {}
+    if not df_mes.empty:
+        tmp = df_mes.groupby("dia")["nombre"].apply(list).to_dict()
+        nombres_por_dia = {d: _nombres_celda(lista) for d, lista in tmp.items()}
+    return conteo_total, conteo_equipo, nombres_por_dia
+
+def html_mes(anio: int, mes: int, conteo_total: dict, conteo_equipo: dict, nombres_por_dia: dict,
+             equipo_sel: str, solo_llenos: bool):
+    """(html de la tabla, alto sugerido en px)."""
+    cal = calendar.Calendar(firstweekday=0)
+    weeks = cal.monthdayscalendar(int(anio), int(mes))
+
+    partes = ["<table style='border-collapse:separate;border-spacing:8px;width:100%;table-layout:fixed;'>",
+              "<tr>", *[f"<th style='text-align:center;font-weight:600;color:#333'>{d}</th>" for d in DIAS], "</tr>"]
+    for week in weeks:
+        partes.append("<tr>")
+        for d in week:
+            if d == 0:
+                partes.append("<td></td>")
+                continue
+            count = int(conteo_total.get(d, 0))
+            if solo_llenos and count < 3:
+                partes.append("<td style='height:120px'></td>")
+                continue
+            color = color_for(count)
+            dot = ""
+            if equipo_sel != "Todos" and conteo_equipo.get(d, 0) > 0:
+                dot = "<div style='margin-top:6px;'><span style='display:inline-block;width:10px;height:10px;border-radius:50%;background:#00bcd4;'></span></div>"
+            nombres_html = nombres_por_dia.get(d, "")
+            partes.append(f"""
+            <td style='vertical-align:top; padding:8px; background:{color}; border:1px solid #ddd; border-radius:10px; text-align:center; height:120px;'>
+              <div style='font-weight:700;color:#1b1e23;font-size:16px'>{d}</div>
+              <div style='font-size:12px;color:#1b1e23'>{count} registro(s)</div>
+              {dot}
+              <div style='margin-top:6px; font-size:11px; line-height:1.25; color:#111'>
+                {nombres_html}
+              </div>
+            </td>
+            """)
+        partes.append("</tr>")
+    partes.append("</table>")
+    html = "".join(partes)
+
+    return html, 80 + (len(weeks) * 140)
+
+COLS_DETALLE = ["numero","nombre","equipo","tipo"]
+HTML_CACHE_MAX = 256
+
+class AgregadoMeses:
+    """
+    Toda la agenda agrupada en una sola pasada: (año, mes) -> {día: [(numero, nombre, equipo, tipo)]}.
+    Se construye una vez por versión de datos (ver `agregado`); cambiar de mes o equipo
+    es una búsqueda en dict y el HTML de cada (mes, equipo, solo_llenos) se guarda ya armado.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._meses = {}
+        self._conteos = {}
+        self._html = OrderedDict()
+        self._lock = threading.Lock()
+        if df is None or df.empty:
+            return
+        # año/mes/día desde la fecha a resolución de día, sin pasar por .dt
+        dias = df["fecha"].to_numpy(dtype="datetime64[D]")
+        meses = dias.astype("datetime64[M]")
+        anio = meses.astype("datetime64[Y]").astype(np.int64) + 1970
+        mes = meses.astype(np.int64) % 12 + 1
+        dia = (dias - meses).astype(np.int64) + 1
+        cols = [np.asarray(df[c], dtype=object) for c in COLS_DETALLE]
+        m = self._meses
+        for a, me, d, *reg in zip(anio.tolist(), mes.tolist(), dia.tolist(), *cols):
+            m.setdefault((a, me), {}).setdefault(d, []).append(tuple(reg))
+
+    def dias(self, anio: int, mes: int) -> dict:
+        """{día: registros} del mes (compartido: solo lectura)."""
+        return self._meses.get((int(anio), int(mes)), {})
+
+    def dias_con_registros(self, anio: int, mes: int) -> list:
+        return sorted(self.dias(anio, mes))
+
+    def detalle_df(self, anio: int, mes: int, dia: int) -> pd.DataFrame:
+        regs = self.dias(anio, mes).get(int(dia), [])
+        return pd.DataFrame(regs, columns=COLS_DETALLE).sort_values(["equipo","nombre"], ignore_index=True)
+
+    def mes(self, anio: int, mes: int, equipo_sel: str):
+        """Mismo resultado que agregar_mes(filtrar_mes(...)), sin pandas."""
+        clave = (int(anio), int(mes), equipo_sel)
+        out = self._conteos.get(clave)
+        if out is None:
+            dias = self.dias(anio, mes)
+            conteo_total = {d: len(regs) for d, regs in dias.items()}
+            conteo_equipo = {}
+            if equipo_sel != "Todos":
+                for d, regs in dias.items():
+                    n = sum(1 for r in regs if r[2] == equipo_sel)
+                    if n:
+                        conteo_equipo[d] = n
+            nombres_por_dia = {d: _nombres_celda([r[1] for r in regs]) for d, regs in dias.items()}
+            out = self._conteos[clave] = (conteo_total, conteo_equipo, nombres_por_dia)
+        return out
+
+    def html(self, anio: int, mes: int, equipo_sel: str, solo_llenos: bool):
+        """(html, alto) del mes, armado una vez por (mes, equipo, solo_llenos)."""
+        clave = (int(anio), int(mes), equipo_sel, bool(solo_llenos))
+        with self._lock:
+            out = self._html.get(clave)
+            if out is not None:
+                self._html.move_to_end(clave)
+                return out
+        out = html_mes(anio, mes, *self.mes(anio, mes, equipo_sel), equipo_sel, solo_llenos)
+        with self._lock:
+            self._html[clave] = out
+            while len(self._html) > HTML_CACHE_MAX:
+                self._html.popitem(last=False)
+        return out
+
+AGREGADO_MAX = 8      # (versión, año) vivos a la vez: sesiones en años distintos no se desalojan
+
+_AGREGADO = OrderedDict()
+_AGREGADO_LOCK = threading.Lock()
+
+def agregado(clave, cargar) -> AgregadoMeses:
+    """
+    AgregadoMeses compartido entre sesiones, por `clave` (versión de datos, o (versión, año)
+    si es un solo año), en un LRU de AGREGADO_MAX. `cargar()` devuelve la agenda y solo
+    se llama si la clave no está: un rerun con la misma versión no toca el almacenamiento.
+    """
+    with _AGREGADO_LOCK:
+        agg = _AGREGADO.get(clave)
+        if agg is None:
+            agg = _AGREGADO[clave] = AgregadoMeses(cargar())
+            while len(_AGREGADO) > AGREGADO_MAX:
+                _AGREGADO.popitem(last=False)
+        else:
+            _AGREGADO.move_to_end(clave)
+        return agg
@@ -0,0 +1,110 @@
+# Índice de empleados: búsqueda O(1) por número exacto o normalizado (sin ceros a la izquierda)
+import numpy as np
+import pandas as pd
+
+def normalizar_numero(numero) -> str:
+    """'  000123 ' -> '123' (alias sin ceros a la izquierda; '' si no queda nada)."""
+    return str(numero).strip().lstrip("0")
+
+class EmpleadosIndex:
+    """
+    Se construye con operaciones por columna una vez por versión de datos.
+    - Número exacto repetido: gana la última fila (como al anexar al Sheet).
+    - Alias sin ceros: gana la primera fila y nunca tapa un número exacto.
+    `duplicados` y `alias_en_conflicto` reportan lo que esas reglas resolvieron.
+    Se usa como dict de solo lectura: `num in idx`, `idx[num]` -> {"nombre", "equipo"}.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        if df is None or df.empty:
+            df = pd.DataFrame(columns=["numero", "nombre", "equipo"])
+        num = df["numero"].astype(str).str.strip()
+        ok = (num != "").to_numpy()
+        num = num[ok].to_numpy(dtype=object)
+        self._nombre = df["nombre"].to_numpy(dtype=object)[ok]
+        self._equipo = df["equipo"].to_numpy(dtype=object)[ok]
+        self._numero = num
+        filas = range(len(num))
+
+        # Exactos: dict(zip) se queda con la última aparición de cada número
+        self._pos = dict(zip(num, filas))
+        # Alias: recorrer al revés para que se quede la primera aparición
+        alias = pd.Series(num, dtype=object).str.lstrip("0").to_numpy(dtype=object)
+        es_alias = (alias != "") & (alias != num)
+        pos_alias = dict(zip(alias[es_alias][::-1], np.flatnonzero(es_alias)[::-1].tolist()))
+        self._alias = {a: p for a, p in pos_alias.items() if a not in self._pos}
+
+        eq = pd.unique(self._equipo)
+        self.equipos = sorted(e for e in eq if e)
+
+        self.duplicados = self._duplicados(num)
+        self.alias_en_conflicto = self._conflictos_alias(num, np.where(alias == "", num, alias))
+        self._dict = None
+
+    def _duplicados(self, num) -> pd.DataFrame:
+        """numero, filas, conflicto (las filas repetidas no coinciden en nombre/equipo)."""
+        df = pd.DataFrame({"numero": num, "nombre": self._nombre, "equipo": self._equipo})
+        rep = df[df["numero"].duplicated(keep=False)]
+        if rep.empty:
+            return pd.DataFrame(columns=["numero", "filas", "conflicto"])
+        g = rep.groupby("numero", sort=True)
+        out = g.size().rename("filas").to_frame()
+        out["conflicto"] = (g["nombre"].nunique() > 1) | (g["equipo"].nunique() > 1)
+        return out.reset_index()
+
+    @staticmethod
+    def _conflictos_alias(num, norm) -> pd.DataFrame:
+        """Números distintos que se leen igual sin ceros ('012' y '0012' y '12')."""
+        df = pd.DataFrame({"alias": norm, "numero": num}).drop_duplicates()
+        rep = df[df["alias"].duplicated(keep=False)]
+        if rep.empty:
+            return pd.DataFrame(columns=["alias", "numeros"])
+        return (rep.groupby("alias", sort=True)["numero"]
+                .agg(lambda s: ", ".join(sorted(s))).rename("numeros").reset_index())
+
+    def _fila(self, numero):
+        p = self._pos.get(numero)
+        return self._alias.get(numero) if p is None else p
+
+    def posicion(self, numero):
+        """Fila del empleado para `numero` tal como lo escribió el usuario (exacto, alias o normalizado)."""
+        numero = str(numero).strip()
+        p = self._fila(numero)
+        if p is None:
+            nz = normalizar_numero(numero)
+            if nz and nz != numero:
+                p = self._fila(nz)
+        return p
+
+    def buscar(self, numero):
+        """{"numero" (el del catálogo), "nombre", "equipo"} o None."""
+        p = self.posicion(numero)
+        if p is None:
+            return None
+        return {"numero": self._numero[p], "nombre": self._nombre[p], "equipo": self._equipo[p]}
+
+    # ---------- interfaz de dict (compatibilidad con get_empleados_dict) ----------
+    def __contains__(self, numero):
+        return self._fila(numero) is not None
+
+    def __getitem__(self, numero):
+        p = self._fila(numero)
+        if p is None:
+            raise KeyError(numero)
+        return {"nombre": self._nombre[p], "equipo": self._equipo[p]}
+
+    def get(self, numero, default=None):
+        p = self._fila(numero)
+        return default if p is None else {"nombre": self._nombre[p], "equipo": self._equipo[p]}
+
+    def __len__(self):
+        return len(self._pos) + len(self._alias)
+
+    def como_dict(self) -> dict:
+        """numero/alias -> {nombre, equipo}; se arma una vez y se comparte (solo lectura)."""
+        if self._dict is None:
+            d = {n: {"nombre": self._nombre[p], "equipo": self._equipo[p]} for n, p in self._pos.items()}
+            for a, p in self._alias.items():
+                d[a] = {"nombre": self._nombre[p], "equipo": self._equipo[p]}
+            self._dict = d
+        return self._dict
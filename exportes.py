@@ -0,0 +1,121 @@
+# Exportaciones (Excel / CSV) del calendario y de los reportes
+import datetime as dt
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from agenda_index import dia_n, ids_empleado
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+COLS_EXPORT = ["numero","nombre","equipo","fecha","tipo","id_empleado"]
+
+# ---------- Caché de archivos generados ----------
+# Los botones de descarga generan sus bytes solo al hacer clic; el resultado se guarda
+# aquí (LRU por tamaño) con una clave que incluye la versión de datos, así que un
+# cambio en la agenda los invalida solo.
+CACHE_MAX_BYTES = 64 * 2 ** 20
+_CACHE = OrderedDict()     # clave -> bytes
+_CACHE_LOCK = threading.Lock()
+_cache_bytes = 0
+
+def cacheado(clave: tuple, generar) -> bytes:
+    """generar() solo si `clave` (p. ej. (tipo, año, mes, equipo, versión)) no está en caché."""
+    global _cache_bytes
+    with _CACHE_LOCK:
+        data = _CACHE.get(clave)
+        if data is not None:
+            _CACHE.move_to_end(clave)
+            return data
+    data = generar()
+    with _CACHE_LOCK:
+        if clave not in _CACHE:
+            _CACHE[clave] = data
+            _cache_bytes += len(data)
+        while _cache_bytes > CACHE_MAX_BYTES and len(_CACHE) > 1:
+            _, viejo = _CACHE.popitem(last=False)
+            _cache_bytes -= len(viejo)
+    return data
+
+def filtrar_equipo(df: pd.DataFrame, equipo: str) -> pd.DataFrame:
+    return df if equipo == "Todos" or df.empty else df[df["equipo"] == equipo]
+
+def _para_exportar(df: pd.DataFrame) -> pd.DataFrame:
+    """COLS_EXPORT; id_empleado entero, vacío si el número no es entero (-1 en memoria)."""
+    ids = pd.Series(df["id_empleado"] if "id_empleado" in df else ids_empleado(df["numero"]),
+                    index=df.index, dtype="Int32")
+    return df.assign(id_empleado=ids.mask(ids < 0))[COLS_EXPORT]
+
+def excel_detalle_mes(df_mes: pd.DataFrame) -> bytes:
+    excel_mes = BytesIO()
+    with pd.ExcelWriter(excel_mes, engine="xlsxwriter") as writer:
+        df_export = _para_exportar(df_mes)
+        df_export["fecha"] = pd.to_datetime(df_export["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
+        df_export.to_excel(writer, sheet_name="Detalle_Mes", index=False)
+    return excel_mes.getvalue()
+
+def csv_detalle_mes(df_mes: pd.DataFrame) -> bytes:
+    return _para_exportar(df_mes).to_csv(index=False).encode("utf-8")
+
+def reporte_mes(df_mes: pd.DataFrame):
+    """(pivot por equipo/tipo, conteo por día, días críticos) de los registros de un mes."""
+    # observed: con columnas categóricas, solo equipos/tipos presentes en el mes
+    pivot = df_mes.groupby(["equipo", "tipo"], observed=True).size().unstack(fill_value=0).astype(int)
+    pivot.index = pivot.index.astype(str)
+    pivot.columns = pivot.columns.astype(str)
+    pivot = pivot.reindex(columns=["Vacaciones","Permiso","Sanción"], fill_value=0)
+    pivot["Total"] = pivot.sum(axis=1)
+    pivot = pivot.sort_values("Total", ascending=False)
+
+    dcnt = df_mes.groupby("fecha")["numero"].count().reset_index(name="registros")
+    dcnt["fecha"] = dcnt["fecha"].dt.date
+    criticos = dcnt[dcnt["registros"]>=3].sort_values(["registros","fecha"], ascending=[False, True])
+    return pivot, dcnt, criticos
+
+def reporte_anios(df: pd.DataFrame) -> pd.DataFrame:
+    """Registros por equipo y año (columnas: años + Total) de una agenda de varios años."""
+    if df.empty:
+        return pd.DataFrame(columns=["Total"])
+    pivot = df.groupby([df["equipo"], df["fecha"].dt.year.rename("anio")], observed=True).size().unstack(fill_value=0)
+    pivot.index = pivot.index.astype(str)
+    pivot.columns = [str(c) for c in pivot.columns]
+    pivot["Total"] = pivot.sum(axis=1)
+    return pivot.sort_values("Total", ascending=False)
+
+def excel_reporte(pivot: pd.DataFrame, dcnt: pd.DataFrame, criticos: pd.DataFrame) -> bytes:
+    excel_io = BytesIO()
+    with pd.ExcelWriter(excel_io, engine="xlsxwriter") as writer:
+        pivot.to_excel(writer, sheet_name="Resumen_Equipos")
+        dcnt.to_excel(writer, sheet_name="Conteo_por_Dia", index=False)
+        if not criticos.empty:
+            criticos.rename(columns={"fecha":"dia"}).to_excel(writer, sheet_name="Dias_Criticos", index=False)
+    return excel_io.getvalue()
+
+def excel_rango(df: pd.DataFrame, desde: dt.date, hasta: dt.date, equipo: str = "Todos") -> bytes:
+    """
+    Agenda de varios meses / año completo. Escribe fila por fila con xlsxwriter en modo
+    constant_memory (cada fila se vuelca al disco al pasar a la siguiente) leyendo
+    directo de los arreglos de las columnas: sin DataFrame intermedio ni copia del rango.
+    """
+    out = BytesIO()
+    wb = xlsxwriter.Workbook(out, {"constant_memory": True, "in_memory": False})
+    ws = wb.add_worksheet("Agenda")
+    ws.write_row(0, 0, COLS_EXPORT)
+    if not df.empty:
+        fechas = df["fecha"].to_numpy(dtype="datetime64[D]")
+        n = df["dia_n"].to_numpy()
+        mask = (n >= dia_n(desde)) & (n <= dia_n(hasta))
+        if equipo != "Todos":
+            mask &= (df["equipo"] == equipo).to_numpy()
+        sel = np.flatnonzero(mask)
+        sel = sel[np.argsort(n[sel], kind="stable")]
+        num, nom, eq, tip = (np.asarray(df[c], dtype=object) for c in ("numero", "nombre", "equipo", "tipo"))
+        ids = df["id_empleado"].to_numpy() if "id_empleado" in df else ids_empleado(df["numero"])
+        for fila, i in enumerate(sel, start=1):
+            ws.write_row(fila, 0, (num[i], nom[i], eq[i], str(fechas[i]), tip[i],
+                                   int(ids[i]) if ids[i] >= 0 else None))
+    wb.close()
+    return out.getvalue()
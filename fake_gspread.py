@@ -0,0 +1,216 @@
+# Doble en memoria de gspread (Spreadsheet / Worksheet) con latencia y cuota simuladas.
+# Implementa solo lo que usa storage_gsheets_v3; sirve para benchmarks y pruebas sin red.
+import json
+import threading
+import time
+from collections import deque
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range
+
+def _error_429() -> APIError:
+    r = requests.Response()
+    r.status_code = 429
+    r._content = json.dumps({"error": {"code": 429, "message": "Quota exceeded (fake)",
+                                       "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return APIError(r)
+
+class FakeSpreadsheet:
+    """
+    latencia_s: costo fijo por llamada; por_celda_s: costo adicional por celda transferida.
+    lecturas_por_minuto / escrituras_por_minuto: cuota (ventana deslizante de 60 s);
+    al excederla la llamada lanza APIError 429 como la API real. None = sin cuota.
+    """
+
+    def __init__(self, latencia_s=0.0, por_celda_s=0.0, lecturas_por_minuto=None, escrituras_por_minuto=None):
+        self.latencia_s = latencia_s
+        self.por_celda_s = por_celda_s
+        self.cuota = {"lectura": lecturas_por_minuto, "escritura": escrituras_por_minuto}
+        self._ventanas = {"lectura": deque(), "escritura": deque()}
+        self._lock = threading.RLock()
+        self._hojas = {}
+        self.llamadas = {}      # op -> conteo
+        self.celdas = 0         # celdas transferidas (leídas + escritas)
+
+    # ---------- simulación ----------
+    def _costo(self, op: str, tipo: str, celdas: int = 0):
+        with self._lock:
+            lim = self.cuota[tipo]
+            if lim is not None:
+                v = self._ventanas[tipo]
+                ahora = time.monotonic()
+                while v and ahora - v[0] > 60:
+                    v.popleft()
+                if len(v) >= lim:
+                    raise _error_429()
+                v.append(ahora)
+            self.llamadas[op] = self.llamadas.get(op, 0) + 1
+            self.celdas += celdas
+        espera = self.latencia_s + celdas * self.por_celda_s
+        if espera > 0:
+            time.sleep(espera)
+
+    # ---------- API de Spreadsheet ----------
+    def worksheets(self):
+        self._costo("worksheets", "lectura")
+        return list(self._hojas.values())
+
+    def worksheet(self, title):
+        self._costo("worksheet", "lectura")
+        if title not in self._hojas:
+            raise WorksheetNotFound(title)
+        return self._hojas[title]
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self._costo("add_worksheet", "escritura")
+        with self._lock:
+            ws = self._hojas.get(title) or FakeWorksheet(self, title)
+            self._hojas[title] = ws
+        return ws
+
+    def del_worksheet(self, ws):
+        self._costo("del_worksheet", "escritura")
+        with self._lock:
+            self._hojas.pop(ws.title, None)
+
+    def hoja(self, title, filas=None) -> "FakeWorksheet":
+        """Crea/llena una hoja sin costo (preparación de escenarios)."""
+        with self._lock:
+            ws = self._hojas.get(title) or FakeWorksheet(self, title)
+            self._hojas[title] = ws
+            if filas is not None:
+                ws.rows = [[str(c) for c in r] for r in filas]
+        return ws
+
+class FakeWorksheet:
+    def __init__(self, sh: FakeSpreadsheet, title: str):
+        self._sh = sh
+        self.title = title
+        self.rows = []
+
+    @staticmethod
+    def _grid(rango: str):
+        g = a1_range_to_grid_range(rango.split("!")[-1])
+        return (g.get("startRowIndex", 0), g.get("endRowIndex"),
+                g.get("startColumnIndex", 0), g.get("endColumnIndex"))
+
+    def _slice(self, rango: str) -> list:
+        r0, r1, c0, c1 = self._grid(rango)
+        out = []
+        for r in self.rows[r0:r1]:
+            fila = list(r[c0:c1]) if c1 is not None else list(r[c0:])
+            while fila and fila[-1] == "":
+                fila.pop()
+            out.append(fila)
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def _put(self, r0: int, c0: int, values):
+        for i, fila in enumerate(values):
+            while len(self.rows) <= r0 + i:
+                self.rows.append([])
+            cur = self.rows[r0 + i]
+            while len(cur) < c0 + len(fila):
+                cur.append("")
+            for j, v in enumerate(fila):
+                cur[c0 + j] = "" if v is None else str(v)
+
+    def _ultima_fila(self) -> int:
+        n = len(self.rows)
+        while n > 0 and not any(self.rows[n - 1]):
+            n -= 1
+        return n
+
+    def _fin_tabla(self) -> int:
+        """Filas de la tabla que empieza en A1 (hasta la primera fila vacía)."""
+        n = 0
+        while n < len(self.rows) and any(self.rows[n]):
+            n += 1
+        return n
+
+    @staticmethod
+    def _celdas(values) -> int:
+        return sum(len(r) for r in values or [])
+
+    # ---------- lecturas ----------
+    def row_values(self, row: int):
+        out = list(self.rows[row - 1]) if len(self.rows) >= row else []
+        self._sh._costo("row_values", "lectura", len(out))
+        return out
+
+    def get_all_values(self, **kwargs):
+        out = self._slice("A1:ZZ")
+        self._sh._costo("get_all_values", "lectura", self._celdas(out))
+        return out
+
+    def get_all_records(self, **kwargs):
+        values = self._slice("A1:ZZ")
+        self._sh._costo("get_all_records", "lectura", self._celdas(values))
+        if not values:
+            return []
+        h = values[0]
+        return [dict(zip(h, r + [""] * (len(h) - len(r)))) for r in values[1:]]
+
+    def batch_get(self, ranges, **kwargs):
+        out = [self._slice(r) for r in ranges]
+        self._sh._costo("batch_get", "lectura", sum(self._celdas(v) for v in out))
+        return out
+
+    # ---------- escrituras ----------
+    def update(self, *args, **kwargs):
+        if args and isinstance(args[0], str):
+            rango, values = args[0], args[1]
+        else:
+            values = kwargs.get("values", args[0] if args else None)
+            rango = kwargs.get("range_name", args[1] if len(args) > 1 else "A1")
+        self._sh._costo("update", "escritura", self._celdas(values))
+        with self._sh._lock:
+            r0, _, c0, _ = self._grid(rango)
+            self._put(r0, c0, values)
+        return {"updatedRange": f"{self.title}!{rango}"}
+
+    def batch_update(self, data, **kwargs):
+        self._sh._costo("batch_update", "escritura", sum(self._celdas(d["values"]) for d in data))
+        with self._sh._lock:
+            for d in data:
+                r0, _, c0, _ = self._grid(d["range"])
+                self._put(r0, c0, d["values"])
+        return {}
+
+    def append_rows(self, values, table_range=None, **kwargs):
+        """
+        Como values.append (insertDataOption OVERWRITE): con table_range="A1" escribe
+        tras la tabla que empieza en A1, o sea en la primera fila vacía aunque haya
+        datos más abajo (un hueco en medio de la hoja).
+        """
+        self._sh._costo("append_rows", "escritura", self._celdas(values))
+        with self._sh._lock:
+            n = self._fin_tabla() if table_range else self._ultima_fila()
+            self._put(n, 0, values)
+        return {"updates": {"updatedRange": f"{self.title}!A{n + 1}:E{n + len(values)}"}}
+
+    def insert_row(self, values, index=1, **kwargs):
+        self._sh._costo("insert_row", "escritura", len(values))
+        with self._sh._lock:
+            self.rows.insert(index - 1, [str(v) for v in values])
+
+    def clear(self):
+        self._sh._costo("clear", "escritura")
+        with self._sh._lock:
+            self.rows = []
+
+    def batch_clear(self, ranges):
+        self._sh._costo("batch_clear", "escritura")
+        with self._sh._lock:
+            for rango in ranges:
+                r0, r1, c0, c1 = self._grid(rango)
+                for r in self.rows[r0:r1]:
+                    for j in range(c0, min(c1 if c1 is not None else len(r), len(r))):
+                        r[j] = ""
+
+    def delete_rows(self, start_index, end_index=None):
+        self._sh._costo("delete_rows", "escritura")
+        with self._sh._lock:
+            del self.rows[start_index - 1:(end_index or start_index)]
@@ -0,0 +1,191 @@
+# Planificador de llamadas a Google Sheets: cuota (token bucket), prioridades, lecturas
+# duplicadas fusionadas y reintentos con backoff exponencial + jitter ante 429/5xx
+# (solo en llamadas idempotentes: un append que falla puede haber quedado escrito).
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from gspread.exceptions import APIError
+
+PRIO_ESCRITURA = 0      # escrituras y lecturas que forman parte de una escritura
+PRIO_LECTURA = 1        # lecturas para la sesión que está esperando
+PRIO_FONDO = 2          # refrescos en segundo plano
+
+LECTURA = "lectura"
+ESCRITURA = "escritura"
+
+# Llamadas que repetidas duplican su efecto; nunca se reintentan solas
+NO_IDEMPOTENTES = {"append_row", "append_rows", "insert_row", "insert_rows", "add_worksheet", "duplicate"}
+
+def es_idempotente(fn) -> bool:
+    return getattr(fn, "__name__", "") not in NO_IDEMPOTENTES
+
+def _status(e) -> int:
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code
+    resp = getattr(e, "response", None)
+    return getattr(resp, "status_code", 0) or 0
+
+def es_reintentable(e) -> bool:
+    if isinstance(e, APIError):
+        s = _status(e)
+        return s == 429 or s >= 500
+    try:
+        import requests
+        return isinstance(e, (requests.ConnectionError, requests.Timeout))
+    except ImportError:
+        return False
+
+class TokenBucket:
+    """`capacidad` fichas que se reponen a `por_minuto`/60 fichas por segundo."""
+
+    def __init__(self, por_minuto: float, capacidad: float = None):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = capacidad if capacidad is not None else por_minuto
+        self.fichas = self.capacidad
+        self._t = time.monotonic()
+
+    def _reponer(self):
+        ahora = time.monotonic()
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self._t) * self.tasa)
+        self._t = ahora
+
+    def espera(self) -> float:
+        """Segundos hasta que haya una ficha (0 si ya hay)."""
+        self._reponer()
+        return 0.0 if self.fichas >= 1 else (1 - self.fichas) / self.tasa
+
+    def tomar(self):
+        self._reponer()
+        self.fichas -= 1
+
+    def vaciar(self):
+        """Tras un 429: dejar que la cuota se recupere antes de seguir."""
+        self._reponer()
+        self.fichas = min(self.fichas, 0)
+
+class Planificador:
+    """
+    Toda llamada pasa por `llamar`. Se admite cuando hay ficha en el bucket de su
+    tipo y un lugar libre de `max_concurrentes`; entre las solicitudes en espera
+    que podrían pasar, gana la de menor prioridad numérica (escrituras primero).
+    Lecturas con la misma `clave` en vuelo se fusionan en una sola llamada.
+    """
+
+    def __init__(self, lecturas_por_minuto=60, escrituras_por_minuto=60, max_concurrentes=4,
+                 reintentos=6, backoff_base_s=0.5, backoff_max_s=32.0):
+        self.buckets = {LECTURA: TokenBucket(lecturas_por_minuto), ESCRITURA: TokenBucket(escrituras_por_minuto)}
+        self.max_concurrentes = max_concurrentes
+        self.reintentos = reintentos
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self._cond = threading.Condition()
+        self._espera = []          # heap de (prioridad, seq, tipo)
+        self._seq = itertools.count()
+        self._activos = 0
+        self._en_vuelo = {}        # clave -> Future (lecturas)
+        self._local = threading.local()
+        self.stats = {"llamadas": 0, "fusionadas": 0, "reintentos": 0, "espera_s": 0.0}
+
+    # ---------- prioridad por hilo ----------
+    @contextmanager
+    def prioridad(self, prio: int):
+        previa = getattr(self._local, "prio", None)
+        self._local.prio = prio
+        try:
+            yield
+        finally:
+            self._local.prio = previa
+
+    def _prio(self, tipo: str) -> int:
+        p = getattr(self._local, "prio", None)
+        if p is not None:
+            return p
+        return PRIO_ESCRITURA if tipo == ESCRITURA else PRIO_LECTURA
+
+    # ---------- admisión ----------
+    def _puede_pasar(self, ticket) -> bool:
+        if self._activos >= self.max_concurrentes:
+            return False
+        if self.buckets[ticket[2]].espera() > 0:
+            return False
+        # ¿hay alguien con mejor prioridad que también podría pasar ahora?
+        for otro in self._espera:
+            if otro < ticket and self.buckets[otro[2]].espera() == 0:
+                return False
+        return True
+
+    def _admitir(self, tipo: str):
+        ticket = (self._prio(tipo), next(self._seq), tipo)
+        t0 = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._espera, ticket)
+            while not self._puede_pasar(ticket):
+                self._cond.wait(timeout=max(0.01, self.buckets[tipo].espera()))
+            self._espera.remove(ticket)
+            heapq.heapify(self._espera)
+            self.buckets[tipo].tomar()
+            self._activos += 1
+            self.stats["espera_s"] += time.monotonic() - t0
+
+    def _liberar(self):
+        with self._cond:
+            self._activos -= 1
+            self._cond.notify_all()
+
+    def _backoff(self, intento: int) -> float:
+        # "full jitter": uniforme entre 0 y el tope exponencial
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** intento)))
+
+    def _ejecutar(self, tipo: str, fn, args, kwargs):
+        intento = 0
+        reintentable = es_idempotente(fn)
+        while True:
+            self._admitir(tipo)
+            try:
+                self.stats["llamadas"] += 1
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if _status(e) == 429:
+                    with self._cond:
+                        self.buckets[tipo].vaciar()
+                if not reintentable or intento >= self.reintentos or not es_reintentable(e):
+                    raise
+                self.stats["reintentos"] += 1
+                espera = self._backoff(intento)
+                intento += 1
+            finally:
+                self._liberar()
+            time.sleep(espera)
+
+    def llamar(self, tipo: str, fn, *args, clave=None, **kwargs):
+        """
+        Ejecuta fn(*args, **kwargs) respetando cuota/prioridad. `clave` fusiona lecturas iguales.
+        Las llamadas de NO_IDEMPOTENTES no se reintentan: el error sube a quien llama, que
+        debe releer la hoja antes de repetir.
+        """
+        if tipo != LECTURA or clave is None:
+            return self._ejecutar(tipo, fn, args, kwargs)
+        with self._cond:
+            fut = self._en_vuelo.get(clave)
+            propio = fut is None
+            if propio:
+                fut = Future()
+                self._en_vuelo[clave] = fut
+            else:
+                self.stats["fusionadas"] += 1
+        if not propio:
+            return fut.result()
+        try:
+            fut.set_result(self._ejecutar(tipo, fn, args, kwargs))
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self._cond:
+                self._en_vuelo.pop(clave, None)
+        return fut.result()
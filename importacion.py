@@ -0,0 +1,159 @@
+# Importación de empleados y de histórico de agenda (normalización y deduplicado)
+import io
+import json
+import pandas as pd
+
+def _picker(df: pd.DataFrame):
+    cols_map = {str(c).lower().strip(): c for c in df.columns}
+    def pick(*names):
+        for n in names:
+            if n in cols_map:
+                return cols_map[n]
+        return None
+    return pick
+
+def norm_emp(df: pd.DataFrame) -> pd.DataFrame:
+    pick = _picker(df)
+    cn = pick("numero","id","empleado","num","número")
+    nn = pick("nombre","name")
+    eq = pick("equipo","team","depto","departamento")
+    if any(x is None for x in [cn,nn,eq]):
+        raise ValueError("Faltan columnas requeridas (numero, nombre, equipo).")
+    out = pd.DataFrame({
+        "numero": df[cn].astype(str).str.strip(),
+        "nombre": df[nn].astype(str).str.strip(),
+        "equipo": df[eq].astype(str).str.strip(),
+    })
+    return out
+
+def norm_agenda(df: pd.DataFrame) -> pd.DataFrame:
+    pick = _picker(df)
+    col_num = pick("numero","número","id","empleado","num")
+    col_nom = pick("nombre","name","empleado_nombre")
+    col_eq  = pick("equipo","team","depto","departamento")
+    col_fec = pick("fecha","date","dia","día")
+    col_tip = pick("tipo","motivo","clase")
+    required = [col_num, col_nom, col_eq, col_fec, col_tip]
+    if any(x is None for x in required):
+        raise ValueError("Faltan columnas requeridas (numero, nombre, equipo, fecha, tipo).")
+    out = pd.DataFrame({
+        "numero": df[col_num].astype(str).str.strip(),
+        "nombre": df[col_nom].astype(str).str.strip(),
+        "equipo": df[col_eq].astype(str).str.strip(),
+        "fecha": pd.to_datetime(df[col_fec], errors="coerce"),
+        "tipo":   df[col_tip].astype(str).str.strip().replace({"Sansión":"Sanción"})
+    }).dropna(subset=["fecha"])
+    return out
+
+# ---------- Importación por partes (archivos grandes) ----------
+TAM_PARTE = 5000    # filas por parte: normalización, deduplicado y escritura
+
+def _tamano(up) -> int:
+    up.seek(0, 2)
+    n = up.tell()
+    up.seek(0)
+    return n or 1
+
+def leer_agenda_por_partes(up, tam: int = TAM_PARTE):
+    """
+    Genera (df_crudo, avance 0..1) de `tam` filas sin cargar el archivo completo:
+    CSV y JSON Lines con chunksize, Excel con openpyxl en modo solo lectura.
+    Un JSON normal (lista o {"agenda": [...]}) se parsea completo y se reparte.
+    """
+    nombre = up.name.lower()
+    if nombre.endswith(".csv") or nombre.endswith(".jsonl"):
+        total = _tamano(up)
+        # pandas cierra el archivo que envuelve al soltar el lector: le damos un envoltorio
+        # de texto propio y lo desprendemos al final para que `up` siga abierto
+        texto = io.TextIOWrapper(up, encoding="utf-8-sig", newline="")
+        try:
+            # todo como texto: "000123" conserva los ceros (norm_agenda convierte la fecha)
+            partes = (pd.read_csv(texto, chunksize=tam, dtype=str, keep_default_na=False) if nombre.endswith(".csv")
+                      else pd.read_json(texto, lines=True, chunksize=tam, dtype=False))
+            for df in partes:
+                yield df, min(up.tell() / total, 1.0)
+        finally:
+            texto.detach()
+    elif nombre.endswith(".json"):
+        raw = json.load(up)
+        if isinstance(raw, dict) and "agenda" in raw:
+            raw = raw["agenda"]
+        for i in range(0, len(raw), tam):
+            yield pd.DataFrame(raw[i:i + tam]), min((i + tam) / len(raw), 1.0)
+    else:
+        from openpyxl import load_workbook
+        wb = load_workbook(up, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            total = max((ws.max_row or 0) - 1, 1)
+            filas = ws.iter_rows(values_only=True)
+            header = [str(h) if h is not None else "" for h in next(filas, ())]
+            leidas = 0
+            bloque = []
+            for fila in filas:
+                if not any(v is not None and v != "" for v in fila):
+                    continue
+                bloque.append(fila[:len(header)])
+                if len(bloque) >= tam:
+                    leidas += len(bloque)
+                    yield pd.DataFrame(bloque, columns=header), min(leidas / total, 1.0)
+                    bloque = []
+            if bloque:
+                yield pd.DataFrame(bloque, columns=header), 1.0
+        finally:
+            wb.close()
+
+def vista_previa(up, n: int = 10) -> pd.DataFrame:
+    """Primeras `n` filas normalizadas (lee solo la primera parte) y rebobina el archivo."""
+    partes = leer_agenda_por_partes(up, tam=n)
+    try:
+        crudo, _ = next(partes, (pd.DataFrame(columns=["numero","nombre","equipo","fecha","tipo"]), 1.0))
+    finally:
+        partes.close()
+        up.seek(0)
+    return norm_agenda(crudo)
+
+def importar_agenda(backend, partes, reemplazar: bool = False):
+    """
+    Normaliza cada parte en cuanto se lee y genera el resumen acumulado
+    ({"leidas", "validas", "importadas", "duplicadas", "avance", "reporte"}) tras cada
+    parte. Anexar escribe cada parte y omite las claves (numero, día, tipo) que ya
+    están en la agenda o que se repiten en el archivo (backend.append_agenda_rows_nuevas);
+    las omitidas se juntan en "reporte" (ver reporte_duplicados). Repetir la
+    importación tras un corte continúa donde quedó. Reemplazar junta las partes
+    normalizadas y hace un solo replace_agenda_df al final (el backend escribe solo
+    las diferencias); el último resumen llega después de escribir.
+    """
+    res = {"leidas": 0, "validas": 0, "importadas": 0, "duplicadas": 0, "avance": 0.0, "reporte": []}
+    todas = []
+    for crudo, avance in partes:
+        df = norm_agenda(crudo)[["numero","nombre","equipo","fecha","tipo"]]
+        res["leidas"] += len(crudo)
+        res["validas"] += len(df)
+        res["avance"] = avance
+        if reemplazar:
+            todas.append(df)
+            res["avance"] = avance * 0.9    # el resto es la escritura final
+            yield dict(res)
+            continue
+        dup = backend.append_agenda_rows_nuevas(df)
+        if dup.any():
+            res["reporte"].append(df[dup])
+            res["duplicadas"] += int(dup.sum())
+        res["importadas"] += len(df) - int(dup.sum())
+        yield dict(res)
+    if reemplazar:
+        df = (pd.concat(todas, ignore_index=True) if todas
+              else pd.DataFrame(columns=["numero","nombre","equipo","fecha","tipo"]))
+        backend.replace_agenda_df(df)
+        res["importadas"] = len(df)
+        res["avance"] = 1.0
+        yield dict(res)
+
+def reporte_duplicados(res: dict) -> pd.DataFrame:
+    """Filas del archivo omitidas por duplicadas (fecha en ISO)."""
+    if not res or not res["reporte"]:
+        return pd.DataFrame(columns=["numero","nombre","equipo","fecha","tipo"])
+    out = pd.concat(res["reporte"], ignore_index=True)
+    out["fecha"] = out["fecha"].dt.strftime("%Y-%m-%d")
+    return out
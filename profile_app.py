@@ -0,0 +1,121 @@
+# Perfil de reruns de la app: la maneja sin navegador (streamlit.testing AppTest) contra una
+# base SQLite temporal sembrada con datos sintéticos y mide cada interacción típica.
+#
+#   python profile_app.py                          # 10k filas de agenda, JSON a stdout
+#   python profile_app.py --filas 50000 --salida perfil.json --sin-memoria
+#
+# Por rerun: tiempo de pared, tiempo por sección (sidebar, captura, calendario, admin,
+# reportes, registro...), pico de memoria (tracemalloc) y llamadas al almacenamiento.
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+import storage_metrics
+from bench_storage import agenda_filas, empleados_filas
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_vacaciones_cloud_v3_3.py")
+NUMERO = "000001"
+
+def sembrar(path: str, filas: int, empleados: int, equipos: int):
+    """Agenda hasta hoy (el mes actual y los anteriores con datos) y catálogo de empleados."""
+    os.environ["VACACIONES_STORAGE_BACKEND"] = "sqlite"
+    os.environ["VACACIONES_SQLITE_PATH"] = path
+    from storage_backend import get_backend, EMP_HEADERS, AGENDA_HEADERS
+    backend = get_backend()      # la misma instancia que usará la app (una por proceso)
+    inicio = dt.date.today() - dt.timedelta(days=filas // 2)
+    backend.replace_empleados_df(pd.DataFrame(empleados_filas(empleados, equipos), columns=EMP_HEADERS))
+    backend.replace_agenda_df(pd.DataFrame(agenda_filas(filas, empleados, equipos, inicio=inicio), columns=AGENDA_HEADERS))
+    return backend
+
+def guion(hoy: dt.date):
+    """(nombre, acción sobre AppTest) de las interacciones típicas, en orden."""
+    mes_ant = (hoy.month - 2) % 12 + 1
+
+    def ir(nombre):
+        return lambda at: at.radio(key="seccion_app").set_value(nombre)
+    return [
+        ("arranque", lambda at: at),
+        ("rerun_sin_cambios", lambda at: at),
+        ("escribir_numero", lambda at: (at.text_input(key="pwd_user").input("x"),
+                                        at.text_input(key="num_emp").input(NUMERO))),
+        ("cambiar_anio_captura", lambda at: at.number_input(key="anio_cap").set_value(hoy.year + 1)),
+        ("registrar_dia", lambda at: at.button(key="btn_registrar").click()),
+        ("abrir_calendario", ir("📅 Calendario / Exportación")),
+        ("cambiar_mes_calendario", lambda at: at.selectbox(key="mes_cal").select(mes_ant)),
+        ("cambiar_equipo_calendario", lambda at: at.selectbox(key="equipo_cal").select("EQ01")),
+        ("solo_dias_llenos", lambda at: at.checkbox(key="llenos_cal").check()),
+        ("abrir_reportes", ir("📊 Reportes")),
+        ("cambiar_mes_reportes", lambda at: at.selectbox(key="mes_rep").select(mes_ant)),
+    ]
+
+def perfilar(args) -> list:
+    at = AppTest.from_file(APP, default_timeout=args.timeout)
+    at.secrets["admin_password"] = "perfil"
+    res = []
+    for nombre, accion in guion(dt.date.today()):
+        accion(at)
+        storage_metrics.reset()
+        if args.memoria:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        at.run()
+        wall = time.perf_counter() - t0
+        pico = tracemalloc.get_traced_memory()[1] if args.memoria else None
+        if args.memoria:
+            tracemalloc.stop()
+
+        met = storage_metrics.resumen()
+        res.append({
+            "interaccion": nombre,
+            "wall_ms": round(wall * 1000, 2),
+            "secciones_ms": {k: round(v * 1000, 2) for k, v in storage_metrics.secciones().items()},
+            "pico_memoria_mb": round(pico / 2 ** 20, 2) if pico is not None else None,
+            "llamadas_almacenamiento": int(met["llamadas"].sum()),
+            "llamadas_por_op": {f"{r.contexto}:{r.op}": int(r.llamadas) for r in met.itertuples()},
+            "excepciones": [e.value for e in at.exception],
+            "avisos": [w.value for w in at.warning] + [e.value for e in at.error],
+        })
+    return res
+
+def main(argv=None) -> dict:
+    ap = argparse.ArgumentParser(description="Perfil de reruns de la app con AppTest (sin navegador ni red).")
+    ap.add_argument("--filas", type=int, default=10000, help="filas de agenda sembradas")
+    ap.add_argument("--empleados", type=int, default=2000)
+    ap.add_argument("--equipos", type=int, default=40)
+    ap.add_argument("--timeout", type=float, default=120, help="segundos máximos por rerun")
+    ap.add_argument("--sin-memoria", dest="memoria", action="store_false",
+                    help="no usar tracemalloc (los tiempos quedan sin su sobrecosto)")
+    ap.add_argument("--salida", default=None, help="archivo JSON (por defecto stdout)")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = sembrar(os.path.join(tmp, "perfil.db"), args.filas, args.empleados, args.equipos)
+        resultados = perfilar(args)
+        backend._con.close()
+
+    salida = {
+        "fecha": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "parametros": {k: v for k, v in vars(args).items() if k != "salida"},
+        "resultados": resultados,
+    }
+    texto = json.dumps(salida, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as fh:
+            fh.write(texto + "\n")
+    else:
+        sys.stdout.write(texto + "\n")
+    return salida
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# Interfaz de almacenamiento: la app habla con un backend, no con Google Sheets directo
+import os
+import threading
+import pandas as pd
+
+EMP_HEADERS = ["numero","nombre","equipo"]
+AGENDA_HEADERS = ["numero","nombre","equipo","fecha","tipo"]
+
+def _secret(key: str, default=None):
+    """Lee de variables de entorno (VACACIONES_<KEY>) o de st.secrets, sin exigir secrets.toml."""
+    env = os.environ.get(f"VACACIONES_{key.upper()}")
+    if env is not None:
+        return env
+    try:
+        import streamlit as st
+        return st.secrets.get(key, default)
+    except Exception:
+        return default
+
+class StorageBackend:
+    """
+    Contrato común de los backends. Reglas de agenda (en append_agenda_row_safe):
+      - Máx 3 personas por día
+      - No dos del mismo equipo el mismo día
+    Errores de regla se reportan como ValueError("LLENO" | "MISMO_EQUIPO" | "FORMATO_FECHA").
+    """
+    nombre = "base"
+
+    def get_data_version(self) -> str:
+        """Sello que cambia con cada escritura; barato de consultar en cada rerun."""
+        raise NotImplementedError
+
+    def estado(self) -> dict:
+        """Estado interno para el panel de Diagnóstico (cuotas, colas, etc.)."""
+        return {}
+
+    # ---------- Empleados ----------
+    def get_empleados_df(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def get_empleados_index(self):
+        """empleados_index.EmpleadosIndex: búsqueda por número/alias, equipos y duplicados."""
+        from empleados_index import EmpleadosIndex
+        return EmpleadosIndex(self.get_empleados_df())
+
+    def get_empleados_dict(self) -> dict:
+        return self.get_empleados_index().como_dict()
+
+    def append_empleados_rows(self, df: pd.DataFrame):
+        raise NotImplementedError
+
+    def replace_empleados_df(self, df: pd.DataFrame):
+        raise NotImplementedError
+
+    # ---------- Agenda ----------
+    def get_agenda_df(self, anios=None) -> pd.DataFrame:
+        """Agenda compacta; `anios` limita a esos años (consulta entre particiones si son varios)."""
+        raise NotImplementedError
+
+    def get_ocupacion(self):
+        """agenda_index.OcupacionIndex: reglas y avisos por fecha en O(1)."""
+        raise NotImplementedError
+
+    def append_agenda_row_safe(self, rec: dict):
+        raise NotImplementedError
+
+    def append_agenda_rows_safe(self, rec: dict, fechas, todo_o_nada: bool = False) -> list:
+        """
+        `rec` en cada una de `fechas`, validadas contra una sola foto de la agenda y
+        escritas en un solo lote. Devuelve [(fecha_iso, código)] con código
+        OK | LLENO | MISMO_EQUIPO | FORMATO_FECHA | DUPLICADA | CANCELADO.
+        todo_o_nada: si alguna fecha falla no se escribe ninguna (las válidas quedan CANCELADO).
+        """
+        raise NotImplementedError
+
+    def append_agenda_rows(self, df: pd.DataFrame):
+        """Anexa sin validar reglas (importación de histórico)."""
+        raise NotImplementedError
+
+    def append_agenda_rows_nuevas(self, df: pd.DataFrame):
+        """
+        Anexa sin validar reglas solo las filas cuya clave (numero, día, tipo) no está en
+        la agenda ni se repite antes en `df` (agenda_index.ClavesAgenda, mantenido con
+        cada alta). Devuelve bool por fila de `df`: True = duplicada, no se escribió.
+        """
+        raise NotImplementedError
+
+    def replace_agenda_df(self, df: pd.DataFrame):
+        raise NotImplementedError
+
+    def migrar_agenda_por_anio(self) -> dict:
+        """Pasa la agenda a una partición por año. {"anios": {anio: filas}, "descartadas", "ya_migrada"}."""
+        raise NotImplementedError
+
+class GSheetsBackend(StorageBackend):
+    """Google Sheets (storage_gsheets_v3)."""
+    nombre = "gsheets"
+
+    def __init__(self):
+        import storage_gsheets_v3
+        self._m = storage_gsheets_v3
+
+    def get_data_version(self) -> str:
+        return self._m.get_data_version()
+
+    def estado(self) -> dict:
+        return self._m.estado()
+
+    def get_empleados_df(self) -> pd.DataFrame:
+        return self._m.get_empleados_df()
+
+    def get_empleados_index(self):
+        return self._m.get_empleados_index()
+
+    def get_empleados_dict(self) -> dict:
+        return self._m.get_empleados_dict()
+
+    def append_empleados_rows(self, df: pd.DataFrame):
+        self._m.append_empleados_rows(df)
+
+    def replace_empleados_df(self, df: pd.DataFrame):
+        return self._m.replace_empleados_df(df)
+
+    def get_agenda_df(self, anios=None) -> pd.DataFrame:
+        return self._m.get_agenda_df(anios)
+
+    def get_ocupacion(self):
+        return self._m.get_ocupacion()
+
+    def append_agenda_row_safe(self, rec: dict):
+        self._m.append_agenda_row_safe(rec)
+
+    def append_agenda_rows_safe(self, rec: dict, fechas, todo_o_nada: bool = False) -> list:
+        return self._m.append_agenda_rows_safe(rec, fechas, todo_o_nada)
+
+    def append_agenda_rows(self, df: pd.DataFrame):
+        self._m.append_agenda_rows(df)
+
+    def append_agenda_rows_nuevas(self, df: pd.DataFrame):
+        return self._m.append_agenda_rows_nuevas(df)
+
+    def replace_agenda_df(self, df: pd.DataFrame):
+        return self._m.replace_agenda_df(df)
+
+    def migrar_agenda_por_anio(self) -> dict:
+        return self._m.migrar_agenda_por_anio()
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+def crear_backend(tipo: str = None) -> StorageBackend:
+    """
+    tipo = "gsheets" (default) | "sqlite".
+    Para SQLite: sqlite_path (default vacaciones.db) y sqlite_espejo_gsheets = true
+    para replicar cada escritura a Google Sheets.
+    """
+    tipo = (tipo or _secret("storage_backend", "gsheets") or "gsheets").strip().lower()
+    if tipo == "gsheets":
+        return GSheetsBackend()
+    if tipo == "sqlite":
+        from storage_sqlite import SQLiteBackend
+        espejo = None
+        if str(_secret("sqlite_espejo_gsheets", "")).strip().lower() in ("1", "true", "si", "sí"):
+            espejo = GSheetsBackend()
+        return SQLiteBackend(_secret("sqlite_path", "vacaciones.db"), espejo=espejo)
+    raise ValueError(f"storage_backend desconocido: {tipo}")
+
+def get_backend() -> StorageBackend:
+    """
+    Backend único por proceso (compartido por todas las sesiones).
+    storage_trace_file = "ruta.jsonl" activa la traza de llamadas (storage_metrics).
+    """
+    global _BACKEND
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                trace = _secret("storage_trace_file")
+                if trace:
+                    import storage_metrics
+                    storage_metrics.configurar_trace(trace)
+                _BACKEND = crear_backend()
+    return _BACKEND
@@ -0,0 +1,107 @@
+# Diario local (SQLite en modo WAL) de registros aceptados que aún no llegan al Sheet
+import json
+import sqlite3
+import threading
+import time
+
+import storage_metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pendientes (
+    id       INTEGER PRIMARY KEY,
+    origen   TEXT NOT NULL,            -- URL del Sheet destino
+    fila     TEXT NOT NULL,            -- JSON [numero, nombre, equipo, fecha_iso, tipo]
+    creada   REAL NOT NULL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    error    TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS ix_pendientes_origen ON pendientes(origen, id);
+
+CREATE TABLE IF NOT EXISTS rechazadas (
+    id        INTEGER PRIMARY KEY,
+    origen    TEXT NOT NULL,
+    fila      TEXT NOT NULL,
+    creada    REAL NOT NULL,
+    rechazada REAL NOT NULL,
+    codigo    TEXT NOT NULL
+);
+"""
+
+class DiarioLocal:
+    """
+    Cola durable por Sheet destino (`origen`). anotar() confirma con synchronous=FULL:
+    cuando vuelve, las filas sobreviven a un reinicio o a un corte de luz. Las filas
+    salen con confirmar() (ya están en el Sheet) o rechazar() (el Sheet ya no las
+    admite; quedan en "rechazadas" para Diagnóstico). Seguro entre hilos.
+    """
+
+    def __init__(self, path: str, origen: str):
+        self.path = path
+        self.origen = origen
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=FULL")
+        self._con.executescript(_SCHEMA)
+
+    def _tx(self, op: str, fn, filas: int = 0):
+        with self._lock, storage_metrics.medir(op) as m:
+            m["filas"] = filas
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(self._con)
+                self._con.execute("COMMIT")
+                return out
+            except BaseException:
+                self._con.execute("ROLLBACK")
+                raise
+
+    def anotar(self, filas: list) -> list:
+        """filas [numero, nombre, equipo, fecha_iso, tipo] -> ids, en el mismo orden."""
+        ahora = time.time()
+        return self._tx("diario.anotar", lambda con: [
+            con.execute("INSERT INTO pendientes(origen, fila, creada) VALUES (?, ?, ?)",
+                        (self.origen, json.dumps(f, ensure_ascii=False), ahora)).lastrowid
+            for f in filas], len(filas))
+
+    def pendientes(self) -> list:
+        """[(id, fila, intentos)] en orden de llegada."""
+        with self._lock:
+            cur = self._con.execute(
+                "SELECT id, fila, intentos FROM pendientes WHERE origen = ? ORDER BY id", (self.origen,))
+            return [(i, json.loads(f), n) for i, f, n in cur.fetchall()]
+
+    def confirmar(self, ids: list):
+        self._tx("diario.confirmar", lambda con: con.executemany(
+            "DELETE FROM pendientes WHERE id = ?", [(i,) for i in ids]), len(ids))
+
+    def fallo(self, ids: list, error: str):
+        self._tx("diario.fallo", lambda con: con.executemany(
+            "UPDATE pendientes SET intentos = intentos + 1, error = ? WHERE id = ?",
+            [(error[:500], i) for i in ids]), len(ids))
+
+    def rechazar(self, codigos: dict):
+        """codigos: {id: código de regla}."""
+        ahora = time.time()
+
+        def fn(con):
+            for i, codigo in codigos.items():
+                con.execute("INSERT INTO rechazadas(origen, fila, creada, rechazada, codigo) "
+                            "SELECT origen, fila, creada, ?, ? FROM pendientes WHERE id = ?", (ahora, codigo, i))
+                con.execute("DELETE FROM pendientes WHERE id = ?", (i,))
+        self._tx("diario.rechazar", fn, len(codigos))
+
+    def rechazadas(self, n: int = 20) -> list:
+        """Últimas `n` rechazadas: [{numero, nombre, equipo, fecha, tipo, codigo, rechazada}]."""
+        with self._lock:
+            cur = self._con.execute(
+                "SELECT fila, codigo, rechazada FROM rechazadas WHERE origen = ? ORDER BY id DESC LIMIT ?",
+                (self.origen, n))
+            filas = cur.fetchall()
+        claves = ["numero", "nombre", "equipo", "fecha", "tipo"]
+        return [dict(zip(claves, json.loads(f)), codigo=c,
+                     rechazada=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))) for f, c, t in filas]
+
+    def cerrar(self):
+        with self._lock:
+            self._con.close()
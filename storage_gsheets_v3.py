@@ -1,10 +1,27 @@
 # Persistencia Google Sheets + validación en servidor (3 por día / no mismo equipo)
+import datetime as dt
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 import streamlit as st
 import gspread
 from google.oauth2.service_account import Credentials
-from gspread.exceptions import WorksheetNotFound, GSpreadException
+from gspread.exceptions import WorksheetNotFound
+import numpy as np
 import pandas as pd
 
+import storage_diario
+import storage_metrics
+import storage_snapshot
+from agenda_index import (OcupacionIndex, OcupacionPorAnio, OcupacionConPendientes, ClavesAgenda,
+                          compactar_agenda, ids_empleado, unir_agenda, filtrar_anios, hash_claves, fila_agenda,
+                          evaluar_fechas, registrar_fechas, OK)
+from empleados_index import EmpleadosIndex
+from gsheets_scheduler import Planificador, LECTURA, ESCRITURA, PRIO_ESCRITURA, PRIO_FONDO
+
 SCOPE = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive",
@@ -12,36 +29,145 @@ SCOPE = [
 
 EMP_HEADERS = ["numero","nombre","equipo"]
 AGENDA_HEADERS = ["numero","nombre","equipo","fecha","tipo"]
+META_HEADERS = ["clave","valor"]
 
-def _client():
-    if "gcp_service_account" not in st.secrets:
-        st.error("Faltan credenciales: agrega el bloque [gcp_service_account] en Settings → Secrets.")
-        st.stop()
+# ---------- Planificador de llamadas ----------
+# Toda llamada a la API pasa por aquí: cuota por minuto, escrituras antes que
+# lecturas, lecturas idénticas en vuelo fusionadas y reintentos ante 429/5xx (salvo appends).
+_PLAN = None
+_PLAN_LOCK = threading.Lock()
 
-    info = st.secrets["gcp_service_account"]
-    creds = Credentials.from_service_account_info(info, scopes=SCOPE)
-    gc = gspread.authorize(creds)
+def _planificador() -> Planificador:
+    global _PLAN
+    if _PLAN is None:
+        with _PLAN_LOCK:
+            if _PLAN is None:
+                from storage_backend import _secret
+                _PLAN = Planificador(
+                    lecturas_por_minuto=float(_secret("sheets_lecturas_por_minuto", 60)),
+                    escrituras_por_minuto=float(_secret("sheets_escrituras_por_minuto", 60)),
+                )
+    return _PLAN
 
-    sheet_url = st.secrets.get("sheet_url") or info.get("sheet_url")
-    if not sheet_url:
-        st.error("Falta 'sheet_url' en Secrets (al nivel raíz o dentro de [gcp_service_account]).")
-        st.stop()
+def _api(tipo: str, fn, *args, clave=None, **kwargs):
+    with storage_metrics.medir(getattr(fn, "__name__", "api")) as m:
+        out = _planificador().llamar(tipo, fn, *args, clave=clave, **kwargs)
+        if tipo == LECTURA:
+            m["filas"], m["bytes"] = storage_metrics.tamano(out)
+        else:
+            payload = kwargs.get("values", next((a for a in args if isinstance(a, list)), None))
+            m["filas"], m["bytes"] = storage_metrics.tamano(payload)
+    return out
+
+def estado() -> dict:
+    plan = _planificador()
+    return {
+        "planificador": dict(plan.stats),
+        "fichas": {t: round(b.fichas, 1) for t, b in plan.buckets.items()},
+        "agenda_filas_ingeridas": _AGENDA.n,
+        "agenda_por_anio": _VERSION.get("particion") == "anio",
+        "empleados_filas_ingeridas": _EMPLEADOS.n,
+        "foto_local": _FOTO.estado(),
+        "diario": _DIARIO.estado(),
+    }
+
+# ---------- Conexión (una por proceso) ----------
+# El cliente autorizado, el Spreadsheet y los handles de cada hoja se reutilizan
+# entre llamadas y entre sesiones de Streamlit. gspread usa AuthorizedSession de
+# google-auth, que renueva el token solo cuando expira.
+_CONN_LOCK = threading.RLock()
+_SH = None            # Spreadsheet abierto
+_WS_CACHE = {}        # nombre de hoja -> Worksheet
+_HEADERS_OK = set()   # hojas cuyos encabezados ya se verificaron en este proceso
 
+def _sheet_url():
+    """URL del Sheet según Secrets (sin conectarse); None si no está configurada."""
     try:
-        sh = gc.open_by_url(sheet_url)
+        info = st.secrets.get("gcp_service_account", {})
+        return st.secrets.get("sheet_url") or info.get("sheet_url")
+    except Exception:
+        return None
+
+def _abrir():
+    """Abre (una vez) el Spreadsheet; RuntimeError con un mensaje para el usuario si no se puede."""
+    global _SH
+    if _SH is not None:
+        return _SH
+    with _CONN_LOCK, storage_metrics.medir("_client"):
+        if _SH is not None:
+            return _SH
+
+        if "gcp_service_account" not in st.secrets:
+            raise RuntimeError("Faltan credenciales: agrega el bloque [gcp_service_account] en Settings → Secrets.")
+
+        info = st.secrets["gcp_service_account"]
+        creds = Credentials.from_service_account_info(info, scopes=SCOPE)
+        gc = gspread.authorize(creds)
+
+        sheet_url = _sheet_url()
+        if not sheet_url:
+            raise RuntimeError("Falta 'sheet_url' en Secrets (al nivel raíz o dentro de [gcp_service_account]).")
+
+        try:
+            sh = _api(LECTURA, gc.open_by_url, sheet_url)
+        except Exception as e:
+            raise RuntimeError(f"No pude abrir el Google Sheet. Revisa 'sheet_url' y permisos. Detalle: {e}") from e
+
+        # Un solo fetch de metadatos para todas las hojas existentes
+        try:
+            for w in _api(LECTURA, sh.worksheets):
+                _WS_CACHE.setdefault(w.title, w)
+        except Exception:
+            pass
+        _SH = sh
         return sh
-    except Exception as e:
-        st.error(f"No pude abrir el Google Sheet. Revisa 'sheet_url' y permisos. Detalle: {e}")
+
+def _client():
+    if _SH is not None:
+        return _SH
+    try:
+        return _abrir()
+    except RuntimeError as e:
+        st.error(str(e))
         st.stop()
 
+def reset_conexion():
+    """Descarta cliente y handles cacheados (p. ej. si alguien borró o renombró hojas)."""
+    global _SH
+    with _CONN_LOCK:
+        _SH = None
+        _WS_CACHE.clear()
+        _HEADERS_OK.clear()
+
+def usar_spreadsheet(sh, planificador: Planificador = None, foto: str = None, diario: str = None):
+    """
+    Conecta el módulo a un Spreadsheet ya abierto (p. ej. fake_gspread en benchmarks)
+    y descarta todo lo cacheado del anterior. Opcionalmente reemplaza el planificador.
+    foto: carpeta de la foto local (None = sin foto); la siguiente lectura la restaura.
+    diario: archivo SQLite del diario de registros (None = cada registro espera su append).
+    """
+    global _SH, _PLAN
+    with _CONN_LOCK:
+        reset_conexion()
+        _SH = sh
+        if planificador is not None:
+            _PLAN = planificador
+    with _VERSION_LOCK:
+        _VERSION.update(valor=None, t=0.0, local=False)
+    _AGENDA.invalidar()
+    _EMPLEADOS.invalidar()
+    origen = getattr(sh, "url", None) or "usar_spreadsheet"
+    _FOTO.configurar(foto, origen)
+    _DIARIO.configurar(diario, origen)
+
 def _ensure_headers(ws, expected_headers):
     try:
-        first = ws.row_values(1)
+        first = _api(LECTURA, ws.row_values, 1)
     except Exception:
         first = []
 
     if not first:
-        ws.update(f"A1:{chr(64+len(expected_headers))}1", [expected_headers])
+        _api(ESCRITURA, ws.update, f"A1:{chr(64+len(expected_headers))}1", [expected_headers])
         return
 
     norm_first = [c.strip().lower() for c in first]
@@ -50,169 +176,1277 @@ def _ensure_headers(ws, expected_headers):
         return
 
     try:
-        ws.insert_row(expected_headers, index=1)
+        _api(ESCRITURA, ws.insert_row, expected_headers, index=1)
     except Exception:
-        ws.update(f"A1:{chr(64+len(expected_headers))}1", [expected_headers])
+        _api(ESCRITURA, ws.update, f"A1:{chr(64+len(expected_headers))}1", [expected_headers])
 
 def _ws(name: str, expected_headers):
+    ws = _WS_CACHE.get(name)
+    if ws is not None and name in _HEADERS_OK:
+        return ws
     sh = _client()
-    try:
-        ws = sh.worksheet(name)
-    except WorksheetNotFound:
-        ws = sh.add_worksheet(title=name, rows=4000, cols=16)
-    _ensure_headers(ws, expected_headers)
+    with _CONN_LOCK:
+        ws = _WS_CACHE.get(name)
+        if ws is None:
+            try:
+                ws = _api(LECTURA, sh.worksheet, name)
+            except WorksheetNotFound:
+                try:
+                    ws = _api(ESCRITURA, sh.add_worksheet, title=name, rows=4000, cols=16)
+                except Exception as e:
+                    # add_worksheet no se reintenta: pudo crearse aunque la respuesta se perdiera
+                    try:
+                        ws = _api(LECTURA, sh.worksheet, name)
+                    except WorksheetNotFound:
+                        raise e
+            _WS_CACHE[name] = ws
+        if name not in _HEADERS_OK:
+            with storage_metrics.medir("_ensure_headers"):
+                _ensure_headers(ws, expected_headers)
+            _HEADERS_OK.add(name)
     return ws
 
+# ---------- Versión de datos ----------
+# Cada escritura estampa un valor nuevo en meta!B2. Los lectores consultan solo esa
+# celda (a lo más cada VERSION_TTL_S) para saber si deben volver a leer las hojas.
+VERSION_TTL_S = 2.0
+_VERSION_LOCK = threading.Lock()
+# local=True: se sirve lo cacheado sin consultar el Sheet (foto recién restaurada o Sheet caído)
+_VERSION = {"valor": None, "particion": "", "t": 0.0, "local": False}
+
+def _leer_version():
+    """(valor, particion) de meta!B2:B3 en una lectura; B3 = modo de la agenda ("anio" = una hoja por año)."""
+    ws = _ws("meta", META_HEADERS)
+    rango = _api(LECTURA, ws.batch_get, ["B2:B3"], clave=("meta", "B2:B3"))[0]
+    valor = str(rango[0][0]) if rango and rango[0] else "0"
+    particion = str(rango[1][0]) if len(rango) > 1 and rango[1] else ""
+    return valor, particion
+
+def _version_datos() -> str:
+    """Versión del Sheet (meta!B2): la que comparan las cachés de hojas y la foto local."""
+    _FOTO.arrancar()
+    with _VERSION_LOCK:
+        if _VERSION["valor"] is not None and (
+                _VERSION["local"] or time.monotonic() - _VERSION["t"] < VERSION_TTL_S):
+            return _VERSION["valor"]
+    try:
+        valor, particion = _leer_version()
+    except Exception as e:
+        if _FOTO.a_local(e):
+            return _VERSION["valor"]
+        valor, particion = "0", _VERSION.get("particion", "")
+    with _VERSION_LOCK:
+        _VERSION.update(valor=valor, particion=particion, t=time.monotonic())
+    return valor
+
+def get_data_version() -> str:
+    """
+    Versión para las cachés de pantalla (calendario, exportes): la del Sheet más la
+    secuencia del diario mientras haya pendientes, que también cambian lo que se ve.
+    """
+    return _DIARIO.version(_version_datos())
+
+def _particion() -> str:
+    _version_datos()
+    return _VERSION.get("particion", "")
+
+def _bump_version() -> str:
+    """Marca que los datos cambiaron (no requiere leer: el valor es un sello de tiempo único)."""
+    valor = str(time.time_ns())
+    ws = _ws("meta", META_HEADERS)
+    _api(ESCRITURA, ws.update, range_name="A2:B2", values=[["version", valor]])
+    with _VERSION_LOCK:
+        _VERSION.update(valor=valor, t=time.monotonic())
+    return valor
+
+# ---------- Lectura incremental ----------
+def _col(n: int) -> str:
+    return chr(64 + n)
+
+def _mapa_columnas(header, headers) -> list:
+    """Índice en la hoja de cada columna esperada (por nombre; si no hay nombres, por posición)."""
+    norm = [str(c).strip().lower() for c in header]
+    cols = [norm.index(h) if h in norm else None for h in headers]
+    if all(c is None for c in cols):
+        cols = list(range(len(headers)))
+    return cols
+
+def _filas_a_df(filas, headers, cols) -> pd.DataFrame:
+    data = [[(r[i] if i is not None and i < len(r) else "") for i in cols] for r in filas]
+    return pd.DataFrame(data, columns=headers)
+
+def _pad(fila, n):
+    fila = [str(c) for c in (fila or [])][:n]
+    return fila + [""] * (n - len(fila))
+
+class _HojaIncremental:
+    """
+    Copia en memoria, compartida por todas las sesiones del proceso, de una hoja
+    casi solo-append. Recuerda cuántas filas ya ingirió
+    (n) y en cada lectura trae solo la cola A{n+2}:… en una llamada, junto con la
+    primera y la última fila conocidas como anclas. Si alguna ancla cambió (clear,
+    reemplazo, filas borradas) recarga completo; también cada RECARGA_COMPLETA_S
+    para recoger ediciones manuales en medio de la hoja.
+    Si la versión de datos no cambió, ni siquiera consulta la cola (salvo cada
+    VERIFICACION_S, por si alguien agregó filas a mano en el Sheet).
+    Las lecturas concurrentes esperan el mismo lock, así que un cambio cuesta una
+    sola lectura al Sheet sin importar cuántas sesiones lo estén viendo; las
+    escrituras de este proceso se aplican directo a la copia (write-through).
+    El DataFrame devuelto es compartido: tratarlo como solo lectura.
+    """
+    RECARGA_COMPLETA_S = 600
+    VERIFICACION_S = 60
+
+    def __init__(self, nombre: str, headers):
+        self.nombre = nombre
+        self.headers = list(headers)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.df = None
+        self.n = 0              # filas de datos ya ingeridas (sin encabezado)
+        self._cols = list(range(len(self.headers)))
+        self._primera = None
+        self._ultima = None
+        self._t_completa = 0.0
+        self._version = None
+        self._t_verificada = 0.0
+
+    def invalidar(self):
+        with self._lock:
+            self._reset()
+
+    def _normalizar(self, df: pd.DataFrame) -> pd.DataFrame:
+        for c in self.headers:
+            df[c] = df[c].astype(str).str.strip()
+        return df
+
+    def _unir(self, df: pd.DataFrame, nuevo: pd.DataFrame) -> pd.DataFrame:
+        return pd.concat([df, nuevo], ignore_index=True)
+
+    def _al_cargar(self, df: pd.DataFrame):
+        """Hook: se llamó a una carga completa."""
+
+    def _al_anexar(self, df_nuevo: pd.DataFrame):
+        """Hook: se ingirieron filas nuevas al final."""
+
+    def leer(self) -> pd.DataFrame:
+        _FOTO.arrancar()
+        if self.df is not None and _VERSION["local"]:
+            return self.df      # modo local: ni siquiera espera a un refresco en curso
+        with self._lock:
+            version = _version_datos()   # antes de leer: una escritura posterior la cambia
+            ahora = time.monotonic()
+            if self.df is not None and (_VERSION["local"] or (
+                    version == self._version and ahora - self._t_verificada < self.VERIFICACION_S)):
+                return self.df
+            vencida = ahora - self._t_completa > self.RECARGA_COMPLETA_S
+            try:
+                if self.df is None or vencida or not self._delta():
+                    self._carga_completa()
+            except Exception as e:
+                if self.df is None or not _FOTO.a_local(e):
+                    raise
+                return self.df      # Sheet sin responder: lo último bueno
+            self._version = version
+            self._t_verificada = ahora
+            return self.df
+
+    def refrescar(self, version: str):
+        """Trae el delta (o recarga si cambió de fondo) aunque se esté en modo local; lo usa _FotoLocal."""
+        with self._lock:
+            if self.df is None:
+                return
+            if not self._delta():
+                self._carga_completa()
+            self._version = version
+            self._t_verificada = time.monotonic()
+
+    def caducar(self):
+        """La próxima leer() trae la cola aunque la versión no cambie (p. ej. tras un append sin respuesta)."""
+        with self._lock:
+            self._t_verificada = 0.0
+
+    def foto(self) -> dict:
+        """Estado para la foto local (lo necesario para seguir con deltas tras restaurarla)."""
+        return {"n": self.n, "cols": self._cols, "primera": self._primera, "ultima": self._ultima,
+                "version": self._version}
+
+    def restaurar(self, df: pd.DataFrame, estado: dict):
+        """
+        Carga una foto local como si fuera la última lectura: la próxima verificación
+        pide solo la cola y las anclas. Sin lock: solo se llama desde _FotoLocal.arrancar,
+        antes de que cualquier lectura pase de ahí.
+        """
+        if list(df.columns[:len(self.headers)]) != self.headers:
+            return
+        self.df = df
+        self.n = int(estado["n"])
+        self._cols = list(estado["cols"])
+        self._primera = estado["primera"]
+        self._ultima = estado["ultima"]
+        self._version = estado["version"]
+        self._t_completa = self._t_verificada = time.monotonic()
+        self._al_cargar(df)
+
+    def _carga_completa(self):
+        ws = _ws(self.nombre, self.headers)
+        values = _api(LECTURA, ws.get_all_values, clave=(self.nombre, "todo"))
+        header = values[0] if values else []
+        self._cargar(_mapa_columnas(header, self.headers), values[1:])
+
+    def _cargar(self, cols, filas):
+        self._cols = cols
+        self.df = self._normalizar(_filas_a_df(filas, self.headers, cols))
+        self.n = len(filas)
+        self._primera = _pad(filas[0], len(self.headers)) if filas else None
+        self._ultima = _pad(filas[-1], len(self.headers)) if filas else None
+        self._t_completa = time.monotonic()
+        self._al_cargar(self.df)
+
+    def establecer(self, filas, version: str):
+        """Write-through de un reemplazo completo: la hoja quedó exactamente con `filas`."""
+        with self._lock:
+            self._cargar(list(range(len(self.headers))), filas)
+            self._version = version
+            self._t_verificada = time.monotonic()
+
+    def _delta(self) -> bool:
+        """Ingiere la cola. False si se detectó reemplazo/borrado (requiere carga completa)."""
+        if self.n == 0:
+            return False   # hoja vacía: una lectura completa es igual de barata
+        ws = _ws(self.nombre, self.headers)
+        last = _col(len(self.headers))
+        rangos = [f"A2:{last}2", f"A{self.n+1}:{last}{self.n+1}", f"A{self.n+2}:{last}"]
+        primera, ultima, cola = _api(LECTURA, ws.batch_get, rangos, clave=(self.nombre, tuple(rangos)))
+        ncols = len(self.headers)
+        if (_pad(primera[0] if primera else [], ncols) != self._primera
+                or _pad(ultima[0] if ultima else [], ncols) != self._ultima):
+            return False
+        if cola:
+            self._ingerir(list(cola))
+        return True
+
+    def _ingerir(self, filas):
+        nuevo = self._normalizar(_filas_a_df(filas, self.headers, self._cols))
+        self.df = self._unir(self.df, nuevo)
+        if self.n == 0:
+            self._primera = _pad(filas[0], len(self.headers))
+        self.n += len(filas)
+        self._ultima = _pad(filas[-1], len(self.headers))
+        self._al_anexar(nuevo)
+
+    def anexadas(self, filas, rango_actualizado: str, version: str) -> bool:
+        """
+        Write-through de filas que este proceso acaba de anexar: si quedaron justo
+        después de lo ya ingerido se agregan sin volver a leerlas (True). Si no (p. ej.
+        values.append llenó una fila vaciada a mano en medio de la hoja, que el delta
+        no relee), la siguiente lectura recarga completo.
+        """
+        m = re.search(r"[A-Z]+(\d+)", (rango_actualizado or "").split("!")[-1])
+        with self._lock:
+            if self.df is not None and m and int(m.group(1)) == self.n + 2:
+                self._ingerir([_pad(f, len(self.headers)) for f in filas])
+                self._version = version
+                return True
+            self._t_completa = self._t_verificada = 0.0
+        return False
+
+class _AgendaIncremental(_HojaIncremental):
+    """Agenda + índice de ocupación, mantenido con cada carga y cada cola ingerida."""
+
+    def _reset(self):
+        super()._reset()
+        self.ocupacion = None
+        self.claves = None
+
+    def _normalizar(self, df: pd.DataFrame) -> pd.DataFrame:
+        return compactar_agenda(df)
+
+    def restaurar(self, df: pd.DataFrame, estado: dict):
+        # solo las columnas de la forma compacta actual; id_empleado se recalcula (una foto vieja puede no traerlo)
+        df = storage_snapshot.fechas_a_segundos(df)
+        df = df.assign(id_empleado=ids_empleado(df["numero"]))[AGENDA_HEADERS + ["id_empleado", "dia_n"]]
+        super().restaurar(df, estado)
+
+    def _unir(self, df: pd.DataFrame, nuevo: pd.DataFrame) -> pd.DataFrame:
+        return unir_agenda(df, nuevo)
+
+    def _al_cargar(self, df):
+        self.ocupacion = OcupacionIndex.desde_df(df)
+        self.claves = None      # se arma al primer uso (solo importaciones)
+
+    def _al_anexar(self, df_nuevo):
+        oc = self.ocupacion
+        for r in df_nuevo.itertuples(index=False):
+            oc.agregar(r.numero, r.nombre, r.equipo, r.fecha, r.tipo)
+        if self.claves is not None:
+            self.claves.agregar_df(df_nuevo)
+
+    def sincronizar(self) -> OcupacionIndex:
+        with self._lock:
+            self.leer()
+            return self.ocupacion
+
+    def sincronizar_claves(self) -> ClavesAgenda:
+        with self._lock:
+            self.leer()
+            if self.claves is None:
+                self.claves = ClavesAgenda.desde_df(self.df)
+            return self.claves
+
+class _EmpleadosIncremental(_HojaIncremental):
+    """Empleados + EmpleadosIndex, reconstruido (por columnas) al primer uso tras cada cambio."""
+
+    def _reset(self):
+        super()._reset()
+        self.indice = None
+
+    def _al_cargar(self, df):
+        self.indice = None
+
+    def _al_anexar(self, df_nuevo):
+        self.indice = None
+
+    def sincronizar(self) -> EmpleadosIndex:
+        with self._lock:
+            self.leer()
+            if self.indice is None:
+                self.indice = EmpleadosIndex(self.df)
+            return self.indice
+
+PREFIJO_PARTICION = "agenda_"
+
+class _AgendaParticionada:
+    """
+    Enruta la agenda a una sola hoja "agenda" (modo clásico) o a una hoja por año
+    "agenda_AAAA" (meta!B3 = "anio", ver migrar_agenda_por_anio). Cada hoja es un
+    _AgendaIncremental con su propia caché e índices, así que las lecturas y las
+    reglas de registro tocan solo las hojas de los años pedidos. Los años con hoja
+    se listan una vez y se vuelven a listar solo si se pide un año desconocido
+    después de un cambio de versión.
+    """
+
+    def __init__(self):
+        self.unica = _AgendaIncremental("agenda", AGENDA_HEADERS)
+        self._hojas = {}        # anio -> _AgendaIncremental
+        self._anios = None      # años con hoja propia
+        self._v_lista = None
+        self._modo = None
+        self._lock = threading.RLock()
+        self._ocupacion = OcupacionPorAnio(self.ocupacion_de)
+
+    def invalidar(self):
+        with self._lock:
+            self.unica.invalidar()
+            self._hojas = {}
+            self._anios = None
+            self._modo = None
+
+    @property
+    def n(self) -> int:
+        return self.unica.n + sum(h.n for h in self._hojas.values())
+
+    def particionada(self) -> bool:
+        modo = _particion()
+        with self._lock:
+            if modo != self._modo:
+                if self._modo is not None:
+                    self.invalidar()    # otro proceso migró: nada de lo cacheado sirve
+                self._modo = modo
+        return modo == "anio"
+
+    def hoja(self, anio: int) -> _AgendaIncremental:
+        if not self.particionada():
+            return self.unica
+        with self._lock:
+            h = self._hojas.get(anio)
+            if h is None:
+                h = self._hojas[anio] = _AgendaIncremental(f"{PREFIJO_PARTICION}{anio}", AGENDA_HEADERS)
+            return h
+
+    def anios(self) -> list:
+        """Años con hoja propia (lista las hojas del Spreadsheet si cambió la versión)."""
+        v = _version_datos()
+        with self._lock:
+            if self._anios is None or self._v_lista != v:
+                nombres = [ws.title for ws in _api(LECTURA, _client().worksheets)]
+                patron = re.compile(re.escape(PREFIJO_PARTICION) + r"(\d{4})$")
+                self._anios = sorted(int(m.group(1)) for m in map(patron.match, nombres) if m)
+                self._v_lista = v
+            return list(self._anios)
+
+    def existe(self, anio: int) -> bool:
+        with self._lock:
+            if self._anios is not None and anio in self._anios:
+                return True
+        return anio in self.anios()
+
+    def creada(self, anio: int):
+        """Este proceso acaba de escribir en la hoja del año (la creó si no existía)."""
+        with self._lock:
+            if self._modo == "anio" and self._anios is not None and anio not in self._anios:
+                self._anios = sorted(self._anios + [anio])
+
+    def leer(self, anios=None) -> pd.DataFrame:
+        """Agenda compacta de `anios` (None = todos); en modo por año une las hojas pedidas."""
+        if not self.particionada():
+            df = self.unica.leer()
+            return df if anios is None else filtrar_anios(df, anios)
+        anios = self.anios() if anios is None else [a for a in sorted({int(a) for a in anios}) if self.existe(a)]
+        out = None
+        for a in anios:
+            out = unir_agenda(out, self.hoja(a).leer())
+        return out if out is not None else compactar_agenda(pd.DataFrame(columns=AGENDA_HEADERS))
+
+    def ocupacion_de(self, anio: int) -> OcupacionIndex:
+        """
+        Índice del año al día con la versión de datos (leer() trae solo el delta si
+        cambió); vacío si el año no tiene hoja.
+        """
+        return self.sincronizar(anio)
+
+    def ocupacion_local(self, anio: int) -> OcupacionIndex:
+        """Índice del año tal como está en memoria; solo consulta el Sheet si aún no se cargó."""
+        with self._lock:
+            h = self.unica if self._modo == "" else self._hojas.get(anio) if self._modo == "anio" else None
+        if h is None or h.ocupacion is None:
+            return self.ocupacion_de(anio)
+        return h.ocupacion
+
+    def ocupacion(self):
+        if not self.particionada():
+            return self.ocupacion_de(0)
+        return self._ocupacion
+
+    def sincronizar(self, anio: int) -> OcupacionIndex:
+        if self.particionada() and not self.existe(anio):
+            return OcupacionIndex()
+        return self.hoja(anio).sincronizar()
+
+    def cargadas(self) -> list:
+        """Hojas de agenda con datos en memoria (las que entran en la foto local)."""
+        with self._lock:
+            return [h for h in [self.unica, *self._hojas.values()] if h.df is not None]
+
+    def restaurar(self, meta: dict, tablas: dict):
+        """Modo, lista de años y hojas de agenda de una foto local (ver _HojaIncremental.restaurar)."""
+        self._modo = meta.get("particion", "")
+        if meta.get("anios") is not None:
+            self._anios = sorted(int(a) for a in meta["anios"])
+            self._v_lista = meta.get("version")
+        patron = re.compile(re.escape(PREFIJO_PARTICION) + r"(\d{4})$")
+        for nombre, estado in meta.get("hojas", {}).items():
+            if nombre not in tablas:
+                continue
+            if nombre == self.unica.nombre:
+                self.unica.restaurar(tablas[nombre], estado)
+            elif patron.match(nombre):
+                h = self._hojas[int(nombre[-4:])] = _AgendaIncremental(nombre, AGENDA_HEADERS)
+                h.restaurar(tablas[nombre], estado)
+
+    def por_anio(self, filas) -> dict:
+        """
+        {anio: [filas]} según la fecha ISO (columna 3); en modo clásico, todo en {0: filas}.
+        Recibe filas ya normalizadas por _agenda_values (solo fechas válidas).
+        """
+        if not self.particionada():
+            return {0: list(filas)} if filas else {}
+        out = {}
+        for f in filas:
+            out.setdefault(int(str(f[3])[:4]), []).append(f)
+        return out
+
+_AGENDA = _AgendaParticionada()
+_EMPLEADOS = _EmpleadosIncremental("empleados", EMP_HEADERS)
+
+# ---------- Foto local ----------
+class _FotoLocal:
+    """
+    Última copia buena de empleados y agenda en disco (storage_snapshot: Parquet más
+    la versión de datos y las anclas de cada hoja). La primera lectura del proceso
+    llena las cachés desde la foto sin tocar la red y las sesiones se sirven de ella
+    ("modo local") mientras un hilo se conecta y trae solo el delta de cada hoja; el
+    mismo hilo vuelve a guardar la foto cada GUARDAR_S si los datos cambiaron. Si más
+    tarde el Sheet deja de responder con datos ya en caché, se vuelve al modo local
+    hasta que responda. Las escrituras salen del modo local antes de validar (ver
+    _en_linea). Carpeta: secret snapshot_dir (vacío = sin foto).
+    """
+    GUARDAR_S = 60
+    REINTENTO_S = 15
+
+    def __init__(self):
+        self.ruta = None
+        self.origen = None      # URL del Sheet: la foto de otro Sheet no se restaura
+        self.meta = None        # de la última foto restaurada o guardada
+        self.error = ""
+        self.iniciada = False
+        self._config = None     # (carpeta, origen) de usar_spreadsheet; None = Secrets
+        self._firma = None
+        self._lock = threading.RLock()
+        self._red = threading.Lock()    # un solo intento a la vez de salir del modo local
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    def configurar(self, base, origen):
+        with self._lock:
+            self._config = (base, origen)
+            self.ruta = self.meta = self._firma = None
+            self.error = ""
+            self.iniciada = False
+
+    def arrancar(self):
+        if self.iniciada:
+            return
+        with self._lock:
+            if self.iniciada:
+                return
+            if self._config is None:
+                from storage_backend import _secret
+                base, origen = _secret("snapshot_dir", ".vacaciones_foto"), _sheet_url()
+            else:
+                base, origen = self._config
+            self.origen = origen
+            self.ruta = storage_snapshot.carpeta(base, origen) if base and origen else None
+            if self.ruta:
+                with storage_metrics.medir("foto_cargar"):
+                    meta, tablas = storage_snapshot.cargar(self.ruta)
+                if meta and meta.get("origen") == origen and meta.get("version"):
+                    estados = meta.get("hojas", {})
+                    if _EMPLEADOS.nombre in tablas and _EMPLEADOS.nombre in estados:
+                        _EMPLEADOS.restaurar(tablas[_EMPLEADOS.nombre], estados[_EMPLEADOS.nombre])
+                    _AGENDA.restaurar(meta, tablas)
+                    with _VERSION_LOCK:
+                        _VERSION.update(valor=meta["version"], particion=meta.get("particion", ""),
+                                        t=0.0, local=True)
+                    self.meta = meta
+                    self._firma = self._hojas()[2]
+                self._arrancar_hilo()
+            self.iniciada = True
+
+    def _arrancar_hilo(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._loop, name="foto-local", daemon=True)
+                self._hilo.start()
+
+    def _loop(self):
+        while True:
+            espera = self.GUARDAR_S
+            try:
+                # PRIO_FONDO: las sesiones y las escrituras pasan antes (en modo local se sirve la foto)
+                with _planificador().prioridad(PRIO_FONDO), storage_metrics.contexto("foto_local"):
+                    if _VERSION["local"]:
+                        self.salir_de_local()
+                    self.guardar()
+                self.error = ""
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                espera = self.REINTENTO_S
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def salir_de_local(self):
+        """Se conecta, trae el delta de cada hoja en caché y vuelve a consultar el Sheet. Lanza si no responde."""
+        with self._red:
+            if not _VERSION["local"]:
+                return
+            _abrir()
+            valor, particion = _leer_version()
+            # si otro proceso cambió el modo de la agenda, particionada() descarta sus hojas
+            hojas = [_EMPLEADOS] + (_AGENDA.cargadas() if particion == _VERSION["particion"] else [])
+            for h in hojas:
+                h.refrescar(valor)
+            with _VERSION_LOCK:
+                _VERSION.update(valor=valor, particion=particion, t=time.monotonic(), local=False)
+
+    def a_local(self, error) -> bool:
+        """Una lectura al Sheet falló: si ya hay datos buenos se siguen sirviendo y el hilo reintenta."""
+        with _VERSION_LOCK:
+            if _VERSION["valor"] is None:
+                return False
+            _VERSION["local"] = True
+        self.error = f"{type(error).__name__}: {error}"
+        self._arrancar_hilo()
+        self._despertar.set()
+        return True
+
+    @staticmethod
+    def _hojas():
+        """(tablas, estados, firma) de las hojas en memoria; la firma cambia con cualquier escritura."""
+        tablas, estados = {}, {}
+        for h in [_EMPLEADOS, *_AGENDA.cargadas()]:
+            with h._lock:
+                if h.df is not None:
+                    tablas[h.nombre], estados[h.nombre] = h.df, h.foto()
+        firma = tuple(sorted((n, e["version"], e["n"]) for n, e in estados.items()))
+        return tablas, estados, firma
+
+    def guardar(self) -> bool:
+        """Escribe la foto si lo que hay en memoria cambió desde la última (nunca en modo local)."""
+        if not self.ruta or _VERSION["local"] or _VERSION["valor"] is None:
+            return False
+        tablas, estados, firma = self._hojas()
+        if not tablas or firma == self._firma:
+            return False
+        meta = {"origen": self.origen, "version": _VERSION["valor"], "particion": _VERSION["particion"],
+                "anios": _AGENDA._anios if _AGENDA._v_lista == _VERSION["valor"] else None,
+                "hojas": estados}
+        with storage_metrics.medir("foto_guardar"):
+            self.meta = storage_snapshot.guardar(self.ruta, meta, tablas)
+        self._firma = firma
+        return True
+
+    def estado(self) -> dict:
+        return {
+            "activa": bool(self.ruta),
+            "sirviendo_foto": bool(_VERSION["local"]),
+            "version": (self.meta or {}).get("version"),
+            "edad_s": round(storage_snapshot.edad_s(self.meta)) if self.meta else None,
+            "ultimo_error": self.error,
+        }
+
+_FOTO = _FotoLocal()
+
+def _en_linea():
+    """Antes de escribir: si se sirve la caché sin consultar el Sheet, conectarse y traer el delta (o lanzar)."""
+    _FOTO.arrancar()
+    if _VERSION["local"]:
+        _FOTO.salir_de_local()
+
 # ---------- Empleados ----------
 def get_empleados_df() -> pd.DataFrame:
-    ws = _ws("empleados", EMP_HEADERS)
-    try:
-        rows = ws.get_all_records()
-    except GSpreadException:
-        _ensure_headers(ws, EMP_HEADERS)
-        values = ws.get_all_values()
-        if not values or len(values) <= 1:
-            return pd.DataFrame(columns=EMP_HEADERS)
-        rows = [dict(zip(EMP_HEADERS, r + [""]*(len(EMP_HEADERS)-len(r)))) for r in values[1:]]
-    if not rows:
-        return pd.DataFrame(columns=EMP_HEADERS)
-    df = pd.DataFrame(rows, columns=EMP_HEADERS)
-    df["numero"] = df["numero"].astype(str).str.strip()
-    df["nombre"] = df["nombre"].astype(str).str.strip()
-    df["equipo"] = df["equipo"].astype(str).str.strip()
-    return df
+    return _EMPLEADOS.leer().copy(deep=False)
+
+def get_empleados_index() -> EmpleadosIndex:
+    """Índice compartido entre sesiones (solo lectura), al día con la versión de datos."""
+    return _EMPLEADOS.sincronizar()
 
 def get_empleados_dict() -> dict:
-    df = get_empleados_df()
-    d = {}
-    for _, r in df.iterrows():
-        num = str(r["numero"]).strip()
-        if not num:
-            continue
-        d[num] = {"nombre": r["nombre"], "equipo": r["equipo"]}
-        # alias sin ceros a la izquierda
-        num_nz = num.lstrip("0")
-        if num_nz and num_nz != num and num_nz not in d:
-            d[num_nz] = {"nombre": r["nombre"], "equipo": r["equipo"]}
-    return d
+    """Diccionario compartido entre sesiones (solo lectura)."""
+    return _EMPLEADOS.sincronizar().como_dict()
 
 # ---------- Agenda ----------
-def _agenda_df_fresh() -> pd.DataFrame:
-    """Lee la hoja agenda SIN caché y normaliza fecha."""
-    ws = _ws("agenda", AGENDA_HEADERS)
-    try:
-        rows = ws.get_all_records()
-    except GSpreadException:
-        _ensure_headers(ws, AGENDA_HEADERS)
-        values = ws.get_all_values()
-        if not values or len(values) <= 1:
-            return pd.DataFrame(columns=AGENDA_HEADERS)
-        rows = [dict(zip(AGENDA_HEADERS, r + [""]*(len(AGENDA_HEADERS)-len(r)))) for r in values[1:]]
-
-    if not rows:
-        return pd.DataFrame(columns=AGENDA_HEADERS)
-
-    df = pd.DataFrame(rows, columns=AGENDA_HEADERS)
-    df["numero"] = df["numero"].astype(str).str.strip()
-    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-    df = df.dropna(subset=["fecha"])
-    df["equipo"] = df["equipo"].astype(str).str.strip()
-    return df
-
-def get_agenda_df() -> pd.DataFrame:
-    return _agenda_df_fresh()
+def _agenda_df_fresh(anios=None) -> pd.DataFrame:
+    """Agenda al día con el Sheet (solo trae filas nuevas), en forma compacta (compactar_agenda)."""
+    return _AGENDA.leer(anios).copy(deep=False)
+
+def get_agenda_df(anios=None) -> pd.DataFrame:
+    """
+    anios: solo esos años (con hojas por año, solo se leen esas hojas). None = todo.
+    Incluye los registros aceptados que el diario aún no envía al Sheet.
+    """
+    return _DIARIO.agenda(_agenda_df_fresh(anios), anios)
+
+def get_ocupacion():
+    """
+    Índice por fecha (conteo, equipos, nombres), sincronizado con la versión de datos:
+    si otro proceso escribió, se ingiere el delta antes de responder. Con hojas por año,
+    cada consulta sincroniza solo el año de su fecha (cargado al primer uso).
+    Cuenta también los registros del diario pendientes de enviar.
+    """
+    return _DIARIO.ocupacion(_AGENDA.ocupacion())
+
+def _append(ws, values: list) -> str:
+    """Anexa al final de la tabla con values.append; devuelve el rango escrito."""
+    resp = _api(ESCRITURA, ws.append_rows, values, value_input_option="RAW", table_range="A1")
+    return ((resp or {}).get("updates") or {}).get("updatedRange", "")
+
+class _EscritorAgenda:
+    """
+    Único escritor de la agenda en el proceso. Las solicitudes (una o varias fechas)
+    se encolan y un hilo las procesa en lotes: una sincronización incremental de la
+    agenda (solo filas nuevas) y un solo append por lote. Las reglas se evalúan en
+    orden de llegada contra el índice de ocupación más lo ya aceptado en el mismo
+    lote, así que la solicitud perdedora se rechaza ANTES de escribir. Con diario
+    local (_EnvioDiario) el lote se anota en disco en lugar del append.
+    (Serializa dentro de este proceso; Streamlit Cloud corre un solo proceso.)
+    """
+    VENTANA_S = 0.02   # espera breve para juntar clics simultáneos
+
+    def __init__(self):
+        self._q = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._escribiendo = threading.Lock()
+
+    def registrar_lote(self, filas, todo_o_nada: bool = False) -> list:
+        """filas: [(fecha, fila)] -> código por fila (ver agenda_index.evaluar_fechas)."""
+        fut = Future()
+        self._q.put((filas, todo_o_nada, fut))
+        self._arrancar()
+        return fut.result()
+
+    def registrar(self, fecha, fila):
+        codigo = self.registrar_lote([(fecha, fila)])[0]
+        if codigo != OK:
+            raise ValueError(codigo)
+
+    @contextmanager
+    def exclusivo(self):
+        """Ninguna solicitud encolada se escribe mientras dura el bloque."""
+        with self._escribiendo:
+            yield
+
+    def _arrancar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._loop, name="escritor-agenda", daemon=True)
+                self._hilo.start()
+
+    def _loop(self):
+        while True:
+            lote = [self._q.get()]
+            time.sleep(self.VENTANA_S)
+            while True:
+                try:
+                    lote.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._escribiendo, _planificador().prioridad(PRIO_ESCRITURA), storage_metrics.contexto("registro"):
+                    self._procesar(lote)
+            except Exception as e:
+                for _, _, fut in lote:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _procesar(self, lote):
+        fechas = {fecha for filas, _, _ in lote for fecha, _ in filas}
+        # Solo las hojas de los años del lote (una, salvo solicitudes que cruzan de año)
+        anios = {f.year for f in fechas}
+        if _DIARIO.activo:
+            # caché + pendientes del diario, sin red; _EnvioDiario lo lleva al Sheet
+            ocupacion = {a: _AGENDA.ocupacion_local(a) for a in anios}
+            with _DIARIO.lock:
+                aceptadas, resultados = self._evaluar(lote, fechas, lambda a: _DIARIO.ocupacion(ocupacion[a]))
+                if aceptadas:
+                    _DIARIO.aceptar(aceptadas)
+        else:
+            _en_linea()     # si el Sheet dejó de responder, no validar contra una foto vieja
+            ocupacion = {a: _AGENDA.sincronizar(a) for a in anios}
+            aceptadas, resultados = self._evaluar(lote, fechas, ocupacion.get)
+            if aceptadas:
+                _anexar_agenda(aceptadas)
+        for fut, codigos in resultados:
+            fut.set_result(codigos)
+
+    @staticmethod
+    def _evaluar(lote, fechas, ocupacion_de):
+        """Reglas en orden de llegada contra una foto de los días del lote -> (filas aceptadas, [(fut, códigos)])."""
+        lectura = OcupacionIndex.desde_equipos(
+            {fecha: [r[2] for r in ocupacion_de(fecha.year).registros(fecha)] for fecha in fechas})
+        aceptadas = []
+        resultados = []
+        for filas, todo_o_nada, fut in lote:
+            codigos = evaluar_fechas(lectura, filas, todo_o_nada)
+            aceptadas += [fila for (_, fila), c in zip(filas, codigos) if c == OK]
+            resultados.append((fut, codigos))
+        return aceptadas, resultados
+
+_ESCRITOR = _EscritorAgenda()
+
+# ---------- Diario local de registros ----------
+class _EnvioDiario:
+    """
+    Registros aceptados que aún no están en el Sheet. Con diario (secret diario_path;
+    sin él no hay diario: solo con disco persistente), _EscritorAgenda valida contra la ocupación en memoria más
+    estos pendientes, los anota en storage_diario.DiarioLocal (SQLite WAL, durable
+    al volver) y responde sin esperar a la API. Un hilo los envía en lotes: trae el
+    delta de las hojas de sus años, vuelve a validar (lo que otro proceso o una
+    edición a mano haya ocupado se rechaza y queda en Diagnóstico), un append por
+    hoja y reintentos con espera creciente mientras el Sheet no responda. Si una
+    respuesta se perdió, lo que sí se escribió se reconoce por su clave (numero,
+    día, tipo) y no se duplica. Los pendientes cuentan en get_ocupacion y
+    get_agenda_df, y los de un proceso anterior se envían al arrancar.
+    """
+    LOTE = 500
+    ESPERA_MIN_S = 1.0
+    ESPERA_MAX_S = 60.0
+
+    def __init__(self):
+        self.diario = None
+        self.iniciado = False
+        self._config = None                 # (ruta, origen) de usar_spreadsheet; None = Secrets
+        self.lock = threading.RLock()       # pendientes en memoria frente a la caché de la agenda
+        self._envio = threading.Lock()      # un envío a la vez (hilo o enviar_todo)
+        self._despertar = threading.Event()
+        self._hilo = None
+        self.secuencia = 0                  # sube con cada cambio de _pend (nunca se repite)
+        self._reset()
+
+    def _reset(self):
+        self._pend = []             # [(id, fila)] en orden de llegada
+        self.indice = OcupacionIndex()
+        self._df = None
+        self._reintento = False     # el último envío falló: parte pudo llegar al Sheet
+        self.enviadas = 0
+        self.fallos = 0             # seguidos
+        self.error = ""
+        self.ultimo_envio = None
+
+    def configurar(self, ruta, origen):
+        with self.lock:
+            if self.diario is not None:
+                self.diario.cerrar()
+            self.diario = None
+            self._config = (ruta, origen)
+            self._reset()
+            self.iniciado = False
+
+    @property
+    def activo(self) -> bool:
+        self.arrancar()
+        return self.diario is not None
+
+    def arrancar(self):
+        if self.iniciado:
+            return
+        with self.lock:
+            if self.iniciado:
+                return
+            if self._config is None:
+                from storage_backend import _secret
+                ruta, origen = _secret("diario_path", ""), _sheet_url()   # opt-in: requiere disco persistente
+            else:
+                ruta, origen = self._config
+            if ruta and origen:
+                try:
+                    self.diario = storage_diario.DiarioLocal(ruta, origen)
+                    pend = self.diario.pendientes()
+                except Exception as e:      # p. ej. disco de solo lectura: cada registro espera su append
+                    self.diario, pend = None, []
+                    self.error = f"{type(e).__name__}: {e}"
+                if pend:
+                    self._agregar([(i, f) for i, f, _ in pend])
+                    self._reintento = True  # el proceso anterior pudo caerse a media escritura
+                    self._arrancar_hilo()
+            self.iniciado = True
+
+    def _arrancar_hilo(self):
+        with self.lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._loop, name="envio-diario", daemon=True)
+                self._hilo.start()
+
+    def _agregar(self, items):
+        self._pend += items
+        for _, f in items:
+            self.indice.agregar(*f)
+        self._df = None
+        self.secuencia += 1
+
+    def _quitar(self, ids):
+        ids = set(ids)
+        self._pend = [(i, f) for i, f in self._pend if i not in ids]
+        indice = OcupacionIndex()
+        for _, f in self._pend:
+            indice.agregar(*f)
+        self.indice = indice
+        self._df = None
+        self.secuencia += 1
+
+    def aceptar(self, filas: list):
+        """Con `lock` tomado y ya validadas: quedan en disco y cuentan desde ya; el hilo las envía."""
+        ids = self.diario.anotar(filas)
+        self._agregar(list(zip(ids, filas)))
+        self._arrancar_hilo()
+        self._despertar.set()
+
+    def version(self, valor: str) -> str:
+        """`valor` con la secuencia del diario si hay pendientes (arranca el diario: recupera los de antes)."""
+        self.arrancar()
+        return f"{valor}+{self.secuencia}" if self._pend else valor
+
+    def ocupacion(self, base):
+        self.arrancar()     # los pendientes de un proceso anterior cuentan desde la primera consulta
+        return OcupacionConPendientes(base, self.indice) if self._pend else base
+
+    def agenda(self, df: pd.DataFrame, anios=None) -> pd.DataFrame:
+        self.arrancar()
+        if not self._pend:
+            return df
+        with self.lock:
+            if self._df is None:
+                self._df = compactar_agenda(pd.DataFrame([f for _, f in self._pend], columns=AGENDA_HEADERS))
+            pend = self._df
+        return unir_agenda(df, pend if anios is None else filtrar_anios(pend, anios))
+
+    def _loop(self):
+        espera = 0
+        while True:
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            if not self._pend:
+                espera = None       # hasta el próximo registro
+                continue
+            try:
+                with _planificador().prioridad(PRIO_ESCRITURA), storage_metrics.contexto("envio_diario"):
+                    self.enviar()
+                espera = 0
+            except Exception:
+                espera = min(self.ESPERA_MIN_S * 2 ** (self.fallos - 1), self.ESPERA_MAX_S)
+
+    def enviar_todo(self):
+        """Envía ya todo lo pendiente (antes de reemplazar, migrar o importar); lanza si el Sheet no responde."""
+        if not self.activo:
+            return
+        while self._pend:
+            self.enviar()
+
+    def enviar(self):
+        """Un lote de hasta LOTE pendientes: confirmados, rechazados o (si falla) con un intento más."""
+        with self._envio:
+            with self.lock:
+                lote = self._pend[:self.LOTE]
+            if not lote:
+                return
+            try:
+                self._enviar(lote)
+            except Exception as e:
+                self.fallos += 1
+                self._reintento = True
+                self.error = f"{type(e).__name__}: {e}"
+                try:
+                    self.diario.fallo([i for i, _ in lote], self.error)
+                except Exception:
+                    pass
+                raise
+            self.fallos = 0
+            self.error = ""
+            self.ultimo_envio = time.time()
+
+    def _enviar(self, lote):
+        _en_linea()
+        filas = [(dt.date.fromisoformat(f[3]), i, f) for i, f in lote]
+        anios = sorted({fecha.year for fecha, _, _ in filas})
+        hechas, rechazos = set(), {}
+        if self._reintento:
+            for a in anios:
+                if _AGENDA.particionada() and not _AGENDA.existe(a):
+                    continue
+                hoja = _AGENDA.hoja(a)
+                hoja.refrescar(_version_datos())  # la cola aunque la versión no haya cambiado
+                de_a = [(i, f) for fecha, i, f in filas if fecha.year == a]
+                ya = hoja.sincronizar_claves().contiene(
+                    hash_claves(pd.DataFrame([f for _, f in de_a], columns=AGENDA_HEADERS)))
+                hechas |= {i for (i, _), si in zip(de_a, ya) if si}
+        ocupacion = {a: _AGENDA.sincronizar(a) for a in anios}     # delta de cada hoja
+        lectura = OcupacionIndex.desde_equipos(
+            {fecha: [r[2] for r in ocupacion[fecha.year].registros(fecha)] for fecha, _, _ in filas})
+        ok = []
+        for fecha, i, f in filas:
+            if i in hechas:
+                continue
+            try:
+                lectura.validar(fecha, f[2])
+            except ValueError as e:
+                rechazos[i] = str(e)
+                continue
+            lectura.agregar(*f)
+            ok.append((i, f))
+        if hechas:
+            self.diario.confirmar(sorted(hechas))
+        if rechazos:
+            self.diario.rechazar(rechazos)
+        if hechas or rechazos:
+            with self.lock:
+                self._quitar(hechas | set(rechazos))
+            self.enviadas += len(hechas)
+
+        grupos = {}
+        for i, f in ok:
+            grupos.setdefault(int(f[3][:4]) if _AGENDA.particionada() else 0, []).append((i, f))
+        for anio, items in grupos.items():
+            h = _AGENDA.hoja(anio)
+            ws = _ws(h.nombre, AGENDA_HEADERS)      # crea la hoja del año si no existe
+            _AGENDA.creada(anio)
+            ids, valores = [i for i, _ in items], [f for _, f in items]
+            rango = _append(ws, valores)
+            version = _bump_version()
+            self.diario.confirmar(ids)
+            with self.lock:
+                al_dia = h.anexadas(valores, rango, version)
+                if al_dia:
+                    self._quitar(ids)
+            if not al_dia:
+                h.sincronizar()     # otro escritor anexó en medio: traer la cola antes de soltarlas
+                with self.lock:
+                    self._quitar(ids)
+            self.enviadas += len(ids)
+        self._reintento = False
+
+    def estado(self) -> dict:
+        return {
+            "activo": self.activo,
+            "pendientes": len(self._pend),
+            "enviadas": self.enviadas,
+            "fallos_seguidos": self.fallos,
+            "ultimo_error": self.error,
+            "ultimo_envio_s": round(time.time() - self.ultimo_envio, 1) if self.ultimo_envio else None,
+            "rechazadas": self.diario.rechazadas(10) if self.diario is not None else [],
+        }
+
+_DIARIO = _EnvioDiario()
+
+def _preparar_registro():
+    """
+    Sin diario, los errores de conexión/credenciales salen en la sesión que llama.
+    La hoja "agenda" se asegura solo en modo clásico: por año, _anexar_agenda crea la
+    del año destino y "agenda" (respaldo) no se vuelve a tocar.
+    """
+    if _DIARIO.activo:
+        return
+    _en_linea()
+    if not _AGENDA.particionada():
+        _ws("agenda", AGENDA_HEADERS)
 
 def append_agenda_row_safe(rec: dict):
     """
     Inserta SOLO si respeta reglas en estado actual del Sheet:
       - Máx 3 personas por día
       - No dos del mismo equipo el mismo día
+    Las escrituras pasan por un único escritor por proceso (ver _EscritorAgenda);
+    con diario local, "inserta" = queda anotado en disco y se envía en segundo plano.
     """
-    import pandas as pd
-    ws = _ws("agenda", AGENDA_HEADERS)
+    _preparar_registro()
+    fecha, fila = fila_agenda(rec)
+    _ESCRITOR.registrar(fecha, fila)
 
-    # Releer estado actual
-    df = _agenda_df_fresh()
+def append_agenda_rows_safe(rec: dict, fechas, todo_o_nada: bool = False) -> list:
+    """
+    Registra `rec` en varias fechas con las mismas reglas: una foto de la ocupación,
+    un solo append con las aceptadas. Devuelve [(fecha_iso, código)]; con todo_o_nada
+    no escribe nada si alguna fecha falla.
+    """
+    _preparar_registro()
+    return registrar_fechas(rec, fechas, todo_o_nada, _ESCRITOR.registrar_lote)
 
-    # Blindaje extra
-    if df is None or df.empty or "fecha" not in df.columns:
-        df = pd.DataFrame(columns=AGENDA_HEADERS)
-    if not pd.api.types.is_datetime64_any_dtype(df.get("fecha", pd.Series([], dtype="datetime64[ns]"))):
-        df["fecha"] = pd.to_datetime(df.get("fecha"), errors="coerce")
-    df = df.dropna(subset=["fecha"])
+# Escrituras masivas en lotes: ~25k celdas por llamada queda muy por debajo del límite
+# de payload de la API (y de su timeout) y cada lote confirmado ya es visible.
+LOTE_FILAS = 5000
 
-    # Normalizar inputs
-    try:
-        fecha = pd.to_datetime(rec.get("fecha"), errors="coerce").date()
-    except Exception:
-        raise ValueError("FORMATO_FECHA")
-    if pd.isna(fecha):
-        raise ValueError("FORMATO_FECHA")
-
-    equipo = str(rec.get("equipo", "")).strip()
-
-    # Reglas
-    if df.empty:
-        mismos = df.iloc[0:0]
-    else:
-        mismos = df[df["fecha"].dt.date == fecha]
-
-    if len(mismos) >= 3:
-        raise ValueError("LLENO")
-    if any(mismos["equipo"].astype(str).str.strip() == equipo):
-        raise ValueError("MISMO_EQUIPO")
-
-    # Escribir
-    values = [[
-        str(rec.get("numero", "")).strip(),
-        str(rec.get("nombre", "")).strip(),
-        equipo,
-        fecha.isoformat(),
-        str(rec.get("tipo", "")).strip()
-    ]]
-    current_rows = len(ws.get_all_values())
-    start_row = max(2, current_rows + 1)
-    ws.update(f"A{start_row}", values)
-
-    # Revalidar por carrera extrema
-    df2 = _agenda_df_fresh()
-    if df2 is None or df2.empty or "fecha" not in df2.columns:
-        return
-    if not pd.api.types.is_datetime64_any_dtype(df2["fecha"]):
-        df2["fecha"] = pd.to_datetime(df2["fecha"], errors="coerce")
+def _lotes(values: list):
+    for i in range(0, len(values), LOTE_FILAS):
+        yield i, values[i:i + LOTE_FILAS]
+
+def _anexar_agenda(values: list):
+    """
+    Anexa filas ya normalizadas a la hoja de su año (o a "agenda"), en lotes de
+    LOTE_FILAS, con un solo cambio de versión por lote. Si un lote falla, los
+    anteriores quedan escritos y en caché.
+    """
+    for anio, filas in _AGENDA.por_anio(values).items():
+        h = _AGENDA.hoja(anio)
+        ws = _ws(h.nombre, AGENDA_HEADERS)      # crea la hoja del año si no existe
+        _AGENDA.creada(anio)
+        for _, lote in _lotes(filas):
+            try:
+                rango = _append(ws, lote)
+            except Exception:
+                h.caducar()     # el append no se reintenta y pudo quedar escrito
+                raise
+            h.anexadas(lote, rango, _bump_version())
+
+def _agenda_values(df: pd.DataFrame) -> list:
+    """Filas normalizadas (fecha ISO); las de fecha vacía o inválida se descartan, como en SQLite."""
+    if df is None or df.empty:
+        return []
+    df2 = df[AGENDA_HEADERS].copy()
+    df2["fecha"] = pd.to_datetime(df2["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
     df2 = df2.dropna(subset=["fecha"])
-    total = len(df2[df2["fecha"].dt.date == fecha])
-    if total > 3:
-        raise ValueError("RACE_CONDITION")
-
-def replace_agenda_df(df: pd.DataFrame):
-    ws = _ws("agenda", AGENDA_HEADERS)
-    ws.clear()
-    ws.update("A1:E1", [AGENDA_HEADERS])
+    return df2.astype(str).fillna("").values.tolist()
+
+def append_agenda_rows(df: pd.DataFrame):
+    """Anexa filas de agenda SIN validar reglas (importación de histórico)."""
     if df is None or df.empty:
         return
-    df2 = df.copy()
-    df2["fecha"] = pd.to_datetime(df2["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
-    values = df2[AGENDA_HEADERS].astype(str).fillna("").values.tolist()
-    ws.update("A2", values)
+    _en_linea()
+    _anexar_agenda(_agenda_values(df))
+
+def append_agenda_rows_nuevas(df: pd.DataFrame):
+    """
+    Como append_agenda_rows, pero omite filas cuya clave (numero, día, tipo) ya está en
+    la agenda o se repite antes en `df`. La sincronización, la consulta a ClavesAgenda
+    y el append ocurren con el escritor de la agenda detenido, así que un registro
+    simultáneo no se cuela entre la verificación y la escritura.
+    Devuelve bool por fila de `df`: True = duplicada (no se escribió).
+    """
+    if df is None or df.empty:
+        return np.zeros(0, dtype=bool)
+    _en_linea()
+    with _ESCRITOR.exclusivo():
+        _DIARIO.enviar_todo()       # lo aceptado antes va primero
+        if not _AGENDA.particionada():
+            dup = _AGENDA.unica.sincronizar_claves().duplicadas(df)
+        else:
+            # cada fila contra las claves de la hoja de su año; repetidas dentro de df en cualquier año
+            # (fecha inválida -> año 0: no se consulta y append_agenda_rows la descarta)
+            anios = pd.to_datetime(df["fecha"], errors="coerce").dt.year.fillna(0).astype(int).to_numpy()
+            h = hash_claves(df)
+            dup = pd.Series(h).duplicated().to_numpy(copy=True)
+            for a in np.unique(anios):
+                m = anios == a
+                if a and _AGENDA.existe(int(a)):
+                    dup[m] |= _AGENDA.hoja(int(a)).sincronizar_claves().contiene(h[m])
+        append_agenda_rows(df[~dup])
+    return dup
+
+def _plan_reemplazo(viejas: list, nuevas: list) -> list:
+    """
+    Disposición final de la hoja con el mismo contenido (multiconjunto de filas) que
+    `nuevas` tocando el mínimo de filas: cada fila que ya existe se queda donde está;
+    los huecos de [0, len(nuevas)) se llenan con las conservadas que quedaron más
+    abajo y con las filas nuevas. El orden final puede diferir del de `nuevas`.
+    """
+    n = len(nuevas)
+    pendientes = {}
+    for f in nuevas:
+        k = tuple(f)
+        pendientes[k] = pendientes.get(k, 0) + 1
+    final = [None] * n
+    relleno = []
+    for i, f in enumerate(viejas):
+        k = tuple(f)
+        if pendientes.get(k):
+            pendientes[k] -= 1
+            if i < n:
+                final[i] = f
+            else:
+                relleno.append(f)
+    for f in nuevas:
+        k = tuple(f)
+        if pendientes.get(k):
+            pendientes[k] -= 1
+            relleno.append(f)
+    relleno = iter(relleno)
+    return [f if f is not None else next(relleno) for f in final]
+
+def _rangos_cambiados(viejas: list, final: list, ncols: int) -> list:
+    """[(rango A1, filas)] de los tramos contiguos de `final` que difieren de `viejas`."""
+    last = _col(ncols)
+    cambiadas = [i for i, f in enumerate(final) if i >= len(viejas) or viejas[i] != f]
+    rangos = []
+    ini = None
+    for j, i in enumerate(cambiadas):
+        if ini is None:
+            ini = i
+        if j + 1 == len(cambiadas) or cambiadas[j + 1] != i + 1 or i + 1 - ini >= LOTE_FILAS:
+            rangos.append((f"A{ini + 2}:{last}{i + 2}", final[ini:i + 1]))
+            ini = None
+    return rangos
+
+def _reemplazar_por_diferencias(hoja: _HojaIncremental, values: list, conservar_orden: bool = False) -> dict:
+    """
+    Deja la hoja con exactamente `values` escribiendo solo lo que cambió: lee la hoja
+    una vez, arma el plan (_plan_reemplazo) y aplica las filas distintas con
+    batch_update por tramos (hasta LOTE_FILAS filas por llamada) y limpia la cola
+    sobrante. La hoja nunca queda vacía para otras sesiones; si una llamada falla,
+    repetir el reemplazo completa lo pendiente. Si los encabezados no están en el
+    orden esperado se reescribe todo (sin clear) en lotes. conservar_orden: la hoja
+    queda en el orden de `values` (diferencias fila por fila, sin reacomodar).
+    """
+    ws = _ws(hoja.nombre, hoja.headers)
+    ncols = len(hoja.headers)
+    with hoja._lock:
+        actual = _api(LECTURA, ws.get_all_values, clave=(hoja.nombre, "todo"))
+        header = [str(c).strip().lower() for c in (actual[0] if actual else [])][:ncols]
+        viejas = [_pad(f, ncols) for f in actual[1:]]
+        values = [_pad(f, ncols) for f in values]
+        if header == hoja.headers:
+            final = values if conservar_orden else _plan_reemplazo(viejas, values)
+            rangos = _rangos_cambiados(viejas, final, ncols)
+        else:
+            final = values
+            rangos = [(f"A1:{_col(ncols)}1", [hoja.headers])] + [
+                (f"A{2 + i}:{_col(ncols)}{1 + i + len(lote)}", lote) for i, lote in _lotes(values)]
+        lote, filas = [], 0
+        for rango, filas_rango in rangos:
+            if lote and filas + len(filas_rango) > LOTE_FILAS:
+                _api(ESCRITURA, ws.batch_update, lote, value_input_option="RAW")
+                lote, filas = [], 0
+            lote.append({"range": rango, "values": filas_rango})
+            filas += len(filas_rango)
+        if lote:
+            _api(ESCRITURA, ws.batch_update, lote, value_input_option="RAW")
+        if len(viejas) > len(final):
+            _api(ESCRITURA, ws.batch_clear, [f"A{len(final) + 2}:{_col(ncols)}{len(viejas) + 1}"])
+        cambio = bool(rangos) or len(viejas) > len(final)
+        hoja.establecer(final, _bump_version() if cambio else _version_datos())
+    return {"filas": len(final), "escritas": sum(len(f) for _, f in rangos),
+            "borradas": max(len(viejas) - len(final), 0)}
+
+def replace_agenda_df(df: pd.DataFrame) -> dict:
+    """
+    Reemplazo por diferencias (ver _reemplazar_por_diferencias). Con el escritor de la
+    agenda detenido, para que ningún registro se anexe a media operación.
+    """
+    values = _agenda_values(df)
+    _en_linea()
+    with _ESCRITOR.exclusivo():
+        _DIARIO.enviar_todo()       # lo aceptado antes va primero
+        if not _AGENDA.particionada():
+            return _reemplazar_por_diferencias(_AGENDA.unica, values)
+        # hoja por hoja; los años que ya no tienen filas quedan vacíos
+        por_anio = _AGENDA.por_anio(values)
+        res = {"filas": 0, "escritas": 0, "borradas": 0}
+        for anio in sorted(set(_AGENDA.anios()) | set(por_anio)):
+            _ws(_AGENDA.hoja(anio).nombre, AGENDA_HEADERS)
+            _AGENDA.creada(anio)
+            r = _reemplazar_por_diferencias(_AGENDA.hoja(anio), por_anio.get(anio, []))
+            res = {k: res[k] + r[k] for k in res}
+        return res
+
+def migrar_agenda_por_anio() -> dict:
+    """
+    Copia la hoja única "agenda" a una hoja por año (agenda_AAAA) y cambia el modo en
+    meta!B3; "agenda" se conserva como respaldo y deja de usarse. Se puede repetir
+    (cada hoja se escribe por diferencias). Las filas sin fecha válida no se migran
+    y se cuentan en "descartadas".
+    """
+    _en_linea()
+    with _ESCRITOR.exclusivo():
+        _DIARIO.enviar_todo()       # lo aceptado antes va primero
+        if _AGENDA.particionada():
+            return {"anios": {a: _AGENDA.hoja(a).n for a in _AGENDA.anios()}, "descartadas": 0, "ya_migrada": True}
+        df = _AGENDA.unica.leer()
+        descartadas = _AGENDA.unica.n - len(df)
+        values = _agenda_values(df)
+        por_anio = {}
+        for f in values:
+            por_anio.setdefault(int(f[3][:4]), []).append(f)
+        for anio, filas in sorted(por_anio.items()):
+            h = _AgendaIncremental(f"{PREFIJO_PARTICION}{anio}", AGENDA_HEADERS)
+            _ws(h.nombre, AGENDA_HEADERS)
+            _reemplazar_por_diferencias(h, filas)
+        ws = _ws("meta", META_HEADERS)
+        _api(ESCRITURA, ws.update, range_name="A3:B3", values=[["particion", "anio"]])
+        _bump_version()
+        with _VERSION_LOCK:
+            _VERSION.update(particion="anio")
+        _AGENDA.invalidar()
+        return {"anios": {a: len(f) for a, f in sorted(por_anio.items())}, "descartadas": descartadas, "ya_migrada": False}
 
 def append_empleados_rows(df: pd.DataFrame):
+    _en_linea()
     ws = _ws("empleados", EMP_HEADERS)
     df2 = df.copy()
     df2 = df2[EMP_HEADERS].astype(str).fillna("")
     values = df2.values.tolist()
     if not values:
         return
-    current_rows = len(ws.get_all_values())
-    start_row = max(2, current_rows + 1)
-    ws.update(f"A{start_row}", values)
+    for _, lote in _lotes(values):
+        rango = _append(ws, lote)
+        _EMPLEADOS.anexadas(lote, rango, _bump_version())
 
-def replace_empleados_df(df: pd.DataFrame):
-    ws = _ws("empleados", EMP_HEADERS)
-    ws.clear()
-    ws.update("A1:C1", [EMP_HEADERS])
-    if df is None or df.empty:
-        return
-    df2 = df.copy()
-    df2 = df2[EMP_HEADERS].astype(str).fillna("")
-    ws.update("A2", df2.values.tolist())
+def replace_empleados_df(df: pd.DataFrame) -> dict:
+    """Reemplazo por diferencias; con números repetidos se conserva el orden de `df` (gana la última fila)."""
+    values, repetidos = [], False
+    if df is not None and not df.empty:
+        df2 = df.copy()
+        df2 = df2[EMP_HEADERS].astype(str).fillna("")
+        values = df2.values.tolist()
+        repetidos = df2["numero"].str.strip().duplicated().any()
+    _en_linea()
+    return _reemplazar_por_diferencias(_EMPLEADOS, values, conservar_orden=bool(repetidos))
@@ -0,0 +1,132 @@
+# Instrumentación de llamadas al almacenamiento: conteo, filas, bytes y latencias por quién llama
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+import pandas as pd
+
+MUESTRAS_MAX = 2048   # latencias recientes por (contexto, operación) para percentiles
+
+_contexto = ContextVar("storage_contexto", default="otros")
+_lock = threading.Lock()
+_stats = {}           # (contexto, op) -> dict
+_trace = {"path": None, "fh": None}
+_secciones = {}       # sección de la app -> segundos acumulados (ver `seccion`)
+
+@contextmanager
+def contexto(nombre: str):
+    """Etiqueta las llamadas hechas dentro del bloque (p. ej. "captura", "registro")."""
+    token = _contexto.set(nombre)
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+def contexto_actual() -> str:
+    return _contexto.get()
+
+@contextmanager
+def seccion(nombre: str):
+    """Como `contexto`, y además acumula el tiempo de pared del bloque (perfil por rerun)."""
+    t0 = time.perf_counter()
+    try:
+        with contexto(nombre):
+            yield
+    finally:
+        dt_s = time.perf_counter() - t0
+        with _lock:
+            _secciones[nombre] = _secciones.get(nombre, 0.0) + dt_s
+
+def secciones(reset: bool = False) -> dict:
+    """{sección: segundos} acumulado desde el último reset."""
+    with _lock:
+        out = dict(_secciones)
+        if reset:
+            _secciones.clear()
+    return out
+
+def configurar_trace(path: str = None):
+    """Activa (o desactiva con None) el archivo JSON-lines con una línea por llamada."""
+    with _lock:
+        if _trace["fh"] is not None:
+            _trace["fh"].close()
+        _trace["path"] = path or None
+        _trace["fh"] = open(path, "a", encoding="utf-8") if path else None
+
+def trace_path():
+    return _trace["path"]
+
+def tamano(valor) -> tuple:
+    """(filas, bytes aprox.) de una respuesta/payload tipo lista de filas."""
+    if not isinstance(valor, (list, tuple)):
+        return 0, 0
+    filas = 0
+    nbytes = 0
+    for r in valor:
+        if isinstance(r, (list, tuple)):
+            if r and isinstance(r[0], (list, tuple)):   # batch_get: lista de rangos
+                f, b = tamano(r)
+                filas += f
+                nbytes += b
+            else:
+                filas += 1
+                nbytes += sum(len(str(c)) for c in r)
+    return filas, nbytes
+
+def registrar(op: str, segundos: float, filas: int = 0, nbytes: int = 0, error: str = None):
+    ctx = _contexto.get()
+    with _lock:
+        s = _stats.get((ctx, op))
+        if s is None:
+            s = _stats[(ctx, op)] = {"llamadas": 0, "errores": 0, "filas": 0, "bytes": 0,
+                                     "total_s": 0.0, "lat": deque(maxlen=MUESTRAS_MAX)}
+        s["llamadas"] += 1
+        s["errores"] += 1 if error else 0
+        s["filas"] += filas
+        s["bytes"] += nbytes
+        s["total_s"] += segundos
+        s["lat"].append(segundos)
+        fh = _trace["fh"]
+        if fh is not None:
+            fh.write(json.dumps({"ts": time.time(), "contexto": ctx, "op": op, "ms": round(segundos * 1000, 3),
+                                 "filas": filas, "bytes": nbytes, "error": error}, ensure_ascii=False) + "\n")
+            fh.flush()
+
+@contextmanager
+def medir(op: str):
+    """Mide un bloque; el llamador puede fijar m["filas"] / m["bytes"] dentro."""
+    m = {"filas": 0, "bytes": 0}
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield m
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        registrar(op, time.perf_counter() - t0, m["filas"], m["bytes"], error)
+
+def resumen() -> pd.DataFrame:
+    cols = ["contexto", "op", "llamadas", "errores", "filas", "bytes", "total_s", "p50_ms", "p95_ms", "p99_ms"]
+    with _lock:
+        items = [(k, dict(v, lat=list(v["lat"]))) for k, v in _stats.items()]
+    rows = []
+    for (ctx, op), s in items:
+        p50, p95, p99 = (np.percentile(s["lat"], [50, 95, 99]) * 1000) if s["lat"] else (0, 0, 0)
+        rows.append([ctx, op, s["llamadas"], s["errores"], s["filas"], s["bytes"],
+                     round(s["total_s"], 3), round(p50, 1), round(p95, 1), round(p99, 1)])
+    df = pd.DataFrame(rows, columns=cols)
+    return df.sort_values("total_s", ascending=False, ignore_index=True)
+
+def total_llamadas() -> int:
+    with _lock:
+        return sum(s["llamadas"] for s in _stats.values())
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _secciones.clear()
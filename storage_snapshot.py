@@ -0,0 +1,65 @@
+# Foto local en disco (Parquet + versión de datos) de las hojas del Sheet, para arrancar sin esperar a la red
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+ARCHIVO_META = "foto.json"
+
+def carpeta(base: str, origen: str) -> str:
+    """Subcarpeta por Spreadsheet (hash de su URL): la foto de un Sheet nunca se carga en otro."""
+    return os.path.join(base, hashlib.sha1(str(origen).encode("utf-8")).hexdigest()[:12])
+
+def guardar(ruta: str, meta: dict, tablas: dict) -> dict:
+    """
+    tablas: {nombre: DataFrame}. Cada Parquet lleva un sufijo único y foto.json se
+    reemplaza al final (os.replace es atómico): quien lea ve la foto anterior completa
+    o la nueva completa, nunca una mezcla. Los Parquet que ya no referencia se borran.
+    Devuelve la meta escrita.
+    """
+    os.makedirs(ruta, exist_ok=True)
+    token = uuid.uuid4().hex[:10]
+    archivos = {}
+    for nombre, df in tablas.items():
+        archivos[nombre] = f"{nombre}.{token}.parquet"
+        df.to_parquet(os.path.join(ruta, archivos[nombre]), index=False)
+    meta = dict(meta, archivos=archivos, guardada=time.time())
+    tmp = os.path.join(ruta, f"{ARCHIVO_META}.{token}")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(meta, fh, ensure_ascii=False)
+    os.replace(tmp, os.path.join(ruta, ARCHIVO_META))
+    for f in os.listdir(ruta):
+        if f.endswith(".parquet") and f not in archivos.values():
+            try:
+                os.remove(os.path.join(ruta, f))
+            except OSError:
+                pass
+    return meta
+
+def cargar(ruta: str):
+    """
+    (meta, {nombre: DataFrame}) de la última foto, o (None, {}) si no hay o está dañada.
+    Los Parquet se abren con memory_map: el archivo no se copia a un búfer antes de decodificar.
+    """
+    try:
+        with open(os.path.join(ruta, ARCHIVO_META), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        tablas = {nombre: pq.read_table(os.path.join(ruta, arch), memory_map=True).to_pandas()
+                  for nombre, arch in meta.get("archivos", {}).items()}
+    except Exception:
+        return None, {}
+    return meta, tablas
+
+def edad_s(meta: dict) -> float:
+    """Segundos desde que se guardó la foto."""
+    return max(time.time() - float((meta or {}).get("guardada", 0)), 0.0)
+
+def fechas_a_segundos(df: pd.DataFrame, col: str = "fecha") -> pd.DataFrame:
+    """Parquet guarda timestamps en ms; la agenda compacta usa datetime64[s]."""
+    if col in df.columns:
+        df[col] = df[col].to_numpy().astype("datetime64[s]")
+    return df
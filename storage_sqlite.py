@@ -0,0 +1,303 @@
+# Persistencia SQLite local (mismo contrato que Google Sheets) + espejo opcional a Sheets
+import datetime as dt
+import logging
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+import storage_metrics
+from agenda_index import (OcupacionIndex, ClavesAgenda, compactar_agenda, unir_agenda, filtrar_anios,
+                          validar_reglas, fila_agenda, evaluar_fechas, registrar_fechas, OK)
+from empleados_index import EmpleadosIndex
+from storage_backend import StorageBackend, EMP_HEADERS, AGENDA_HEADERS
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS empleados (
+    id     INTEGER PRIMARY KEY,
+    numero TEXT NOT NULL,
+    nombre TEXT NOT NULL DEFAULT '',
+    equipo TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS ix_empleados_numero ON empleados(numero);
+
+CREATE TABLE IF NOT EXISTS agenda (
+    id     INTEGER PRIMARY KEY,
+    numero TEXT NOT NULL DEFAULT '',
+    nombre TEXT NOT NULL DEFAULT '',
+    equipo TEXT NOT NULL DEFAULT '',
+    fecha  TEXT NOT NULL,            -- ISO YYYY-MM-DD
+    tipo   TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS ix_agenda_fecha_equipo ON agenda(fecha, equipo);
+CREATE INDEX IF NOT EXISTS ix_agenda_equipo_fecha ON agenda(equipo, fecha);
+CREATE INDEX IF NOT EXISTS ix_agenda_numero_fecha ON agenda(numero, fecha);
+
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta(clave, valor) VALUES ('version', 0);
+INSERT OR IGNORE INTO meta(clave, valor) VALUES ('version_empleados', 0);
+INSERT OR IGNORE INTO meta(clave, valor) VALUES ('version_agenda', 0);
+"""
+
+def _emp_values(df: pd.DataFrame) -> list:
+    if df is None or df.empty:
+        return []
+    return df[EMP_HEADERS].astype(str).apply(lambda s: s.str.strip()).values.tolist()
+
+def _agenda_values(df: pd.DataFrame) -> list:
+    if df is None or df.empty:
+        return []
+    df2 = df[AGENDA_HEADERS].copy()
+    df2["fecha"] = pd.to_datetime(df2["fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
+    df2 = df2.dropna(subset=["fecha"])
+    return df2.astype(str).apply(lambda s: s.str.strip()).values.tolist()
+
+class _VersionCambiada(Exception):
+    """Otro proceso escribió entre la lectura de la caché y la transacción."""
+
+class SQLiteBackend(StorageBackend):
+    """
+    Base local con índices en fecha/equipo/numero. Cada escritura es una transacción;
+    append_agenda_row_safe valida y escribe dentro de BEGIN IMMEDIATE, así que las
+    reglas se cumplen aun con varios procesos sobre el mismo archivo.
+    Si hay `espejo` (otro backend, p. ej. Sheets) se le replica cada escritura ya confirmada.
+    Empleados y agenda se cachean en memoria, compartidos por todas las sesiones, cada
+    uno por su propia versión (meta version_empleados / version_agenda): un registro de
+    vacaciones no recarga empleados. Las escrituras de este proceso se aplican directo
+    a la caché.
+    """
+    nombre = "sqlite"
+    REINTENTOS_VERSION = 3
+
+    def __init__(self, path: str = "vacaciones.db", espejo: StorageBackend = None):
+        self.path = path
+        self.espejo = espejo
+        self._lock = threading.RLock()
+        self._con = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.executescript(_SCHEMA)
+        self._ocupacion = None
+        self._claves = None      # ClavesAgenda de la agenda en caché (al primer uso)
+        self._agenda = None      # (version, DataFrame)
+        self._empleados = None   # (version, DataFrame, EmpleadosIndex)
+        self._v_tx = None        # (antes, después) de la versión de la tabla escrita en la última transacción
+
+    def _select(self, sql: str) -> pd.DataFrame:
+        with self._lock, storage_metrics.medir("sqlite.select") as m:
+            df = pd.read_sql_query(sql, self._con)
+            m["filas"] = len(df)
+        return df
+
+    def _tx(self, tabla: str, fn, filas: int = 0):
+        """
+        Ejecuta fn(con) en una transacción IMMEDIATE (lock de escritura desde el inicio)
+        e incrementa en la misma transacción la versión de datos y la de `tabla`
+        ("empleados" | "agenda"); _v_tx queda con la de `tabla` antes y después.
+        """
+        with self._lock, storage_metrics.medir("sqlite.tx") as m:
+            m["filas"] = filas
+            con = self._con
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(con)
+                antes = con.execute("SELECT valor FROM meta WHERE clave = ?", (f"version_{tabla}",)).fetchone()[0]
+                con.execute("UPDATE meta SET valor = valor + 1 WHERE clave IN ('version', ?)", (f"version_{tabla}",))
+                con.execute("COMMIT")
+                self._v_tx = (str(antes), str(antes + 1))
+                return out
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+
+    def _espejar(self, metodo: str, *args):
+        if self.espejo is None:
+            return
+        try:
+            getattr(self.espejo, metodo)(*args)
+        except Exception as e:
+            # La base local es la autoritativa; el espejo no debe tumbar la operación
+            log.warning("Espejo %s.%s falló: %s", self.espejo.nombre, metodo, e)
+
+    def _version(self, clave: str = "version") -> str:
+        with self._lock:
+            return str(self._con.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()[0])
+
+    def get_data_version(self) -> str:
+        return self._version()
+
+    def estado(self) -> dict:
+        return {"sqlite_path": self.path, "version": self.get_data_version(),
+                "espejo": self.espejo.nombre if self.espejo else None}
+
+    # ---------- Empleados ----------
+    def _empleados_cache(self):
+        with self._lock:
+            v = self._version("version_empleados")
+            if self._empleados is None or self._empleados[0] != v:
+                df = self._select("SELECT numero, nombre, equipo FROM empleados ORDER BY id")
+                if df.empty:
+                    df = pd.DataFrame(columns=EMP_HEADERS)
+                self._empleados = (v, df, None)
+            return self._empleados
+
+    def get_empleados_df(self) -> pd.DataFrame:
+        return self._empleados_cache()[1].copy(deep=False)
+
+    def get_empleados_index(self) -> EmpleadosIndex:
+        """Índice compartido entre sesiones (solo lectura)."""
+        with self._lock:
+            v, df, idx = self._empleados_cache()
+            if idx is None:
+                idx = EmpleadosIndex(df)
+                self._empleados = (v, df, idx)
+            return idx
+
+    def append_empleados_rows(self, df: pd.DataFrame):
+        values = _emp_values(df)
+        if not values:
+            return
+        self._tx("empleados", lambda con: con.executemany(
+            "INSERT INTO empleados(numero, nombre, equipo) VALUES (?,?,?)", values), len(values))
+        self._espejar("append_empleados_rows", df)
+
+    def replace_empleados_df(self, df: pd.DataFrame):
+        values = _emp_values(df)
+        def run(con):
+            con.execute("DELETE FROM empleados")
+            con.executemany("INSERT INTO empleados(numero, nombre, equipo) VALUES (?,?,?)", values)
+        self._tx("empleados", run, len(values))
+        self._espejar("replace_empleados_df", df)
+
+    # ---------- Agenda ----------
+    def _agenda_cache(self) -> pd.DataFrame:
+        with self._lock:
+            v = self._version("version_agenda")
+            if self._agenda is None or self._agenda[0] != v:
+                df = compactar_agenda(self._select("SELECT numero, nombre, equipo, fecha, tipo FROM agenda ORDER BY id"))
+                self._agenda = (v, df)
+                self._ocupacion = OcupacionIndex.desde_df(df)
+                self._claves = None
+            return self._agenda[1]
+
+    def _claves_agenda(self):
+        """(versión, ClavesAgenda) al día; el índice se arma al primer uso tras cada recarga."""
+        with self._lock:
+            df = self._agenda_cache()
+            if self._claves is None:
+                self._claves = ClavesAgenda.desde_df(df)
+            return self._agenda[0], self._claves
+
+    def _agenda_anexadas(self, rows):
+        """Write-through: agrega a la caché si estaba al día justo antes de esta escritura."""
+        antes, despues = self._v_tx
+        if self._agenda is None or self._agenda[0] != antes:
+            return
+        nuevo = compactar_agenda(pd.DataFrame(rows, columns=AGENDA_HEADERS))
+        self._agenda = (despues, unir_agenda(self._agenda[1], nuevo))
+        for r in rows:
+            self._ocupacion.agregar(*r)
+        if self._claves is not None:
+            self._claves.agregar_df(nuevo)
+
+    def get_agenda_df(self, anios=None) -> pd.DataFrame:
+        """La tabla local ya está indexada por fecha: los años se filtran sobre la caché (dia_n)."""
+        df = self._agenda_cache()
+        return (df if anios is None else filtrar_anios(df, anios)).copy(deep=False)
+
+    def get_ocupacion(self) -> OcupacionIndex:
+        with self._lock:
+            self._agenda_cache()
+            return self._ocupacion
+
+    def append_agenda_row_safe(self, rec: dict):
+        _, row = fila_agenda(rec)
+
+        def run(con):
+            equipos = [r[0] for r in con.execute(
+                "SELECT equipo FROM agenda WHERE fecha = ?", (row[3],))]
+            validar_reglas(equipos, row[2])
+            con.execute("INSERT INTO agenda(numero, nombre, equipo, fecha, tipo) VALUES (?,?,?,?,?)", row)
+        with self._lock:
+            self._tx("agenda", run, 1)
+            self._agenda_anexadas([row])
+        self._espejar("append_agenda_rows", pd.DataFrame([row], columns=AGENDA_HEADERS))
+
+    def append_agenda_rows_safe(self, rec: dict, fechas, todo_o_nada: bool = False) -> list:
+        """Todas las fechas se validan y escriben en una sola transacción IMMEDIATE."""
+        aceptadas = []
+
+        def escribir(filas, todo):
+            def run(con):
+                dias = sorted({f.isoformat() for f, _ in filas})
+                equipos = {}
+                for fecha, equipo in con.execute(
+                        f"SELECT fecha, equipo FROM agenda WHERE fecha IN ({','.join('?' * len(dias))})", dias):
+                    equipos.setdefault(dt.date.fromisoformat(fecha), []).append(equipo)
+                codigos = evaluar_fechas(OcupacionIndex.desde_equipos(equipos), filas, todo)
+                aceptadas.extend(fila for (_, fila), c in zip(filas, codigos) if c == OK)
+                if aceptadas:
+                    con.executemany("INSERT INTO agenda(numero, nombre, equipo, fecha, tipo) VALUES (?,?,?,?,?)", aceptadas)
+                return codigos
+            with self._lock:
+                codigos = self._tx("agenda", run, len(filas))
+                self._agenda_anexadas(aceptadas)
+            return codigos
+
+        out = registrar_fechas(rec, fechas, todo_o_nada, escribir)
+        if aceptadas:
+            self._espejar("append_agenda_rows", pd.DataFrame(aceptadas, columns=AGENDA_HEADERS))
+        return out
+
+    def append_agenda_rows(self, df: pd.DataFrame):
+        values = _agenda_values(df)
+        if not values:
+            return
+        with self._lock:
+            self._tx("agenda", lambda con: con.executemany(
+                "INSERT INTO agenda(numero, nombre, equipo, fecha, tipo) VALUES (?,?,?,?,?)", values), len(values))
+            self._agenda_anexadas(values)
+        self._espejar("append_agenda_rows", df)
+
+    def append_agenda_rows_nuevas(self, df: pd.DataFrame):
+        """
+        Consulta ClavesAgenda y escribe en la misma transacción IMMEDIATE; si otro proceso
+        escribió desde la última lectura (cambió la versión) se relee y se reintenta.
+        """
+        if df is None or df.empty:
+            return np.zeros(0, dtype=bool)
+        with self._lock:
+            for _ in range(self.REINTENTOS_VERSION):
+                v, claves = self._claves_agenda()
+                dup = claves.duplicadas(df)
+                values = _agenda_values(df[~dup])
+
+                def run(con):
+                    if str(con.execute("SELECT valor FROM meta WHERE clave = 'version_agenda'").fetchone()[0]) != v:
+                        raise _VersionCambiada()
+                    con.executemany("INSERT INTO agenda(numero, nombre, equipo, fecha, tipo) VALUES (?,?,?,?,?)", values)
+                if not values:
+                    return dup
+                try:
+                    self._tx("agenda", run, len(values))
+                except _VersionCambiada:
+                    continue
+                self._agenda_anexadas(values)
+                break
+            else:
+                raise RuntimeError("La agenda cambia demasiado rápido; intenta de nuevo la importación.")
+        self._espejar("append_agenda_rows", df[~dup])
+        return dup
+
+    def replace_agenda_df(self, df: pd.DataFrame):
+        values = _agenda_values(df)
+        def run(con):
+            con.execute("DELETE FROM agenda")
+            con.executemany("INSERT INTO agenda(numero, nombre, equipo, fecha, tipo) VALUES (?,?,?,?,?)", values)
+        self._tx("agenda", run, len(values))
+        self._espejar("replace_agenda_df", df)
@@ -0,0 +1,45 @@
+# Pruebas sin red: storage_gsheets_v3 contra fake_gspread (Sheet en memoria)
+import json
+import os
+import sys
+
+import pytest
+import requests
+from gspread.exceptions import APIError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage_gsheets_v3 as s3
+from fake_gspread import FakeSpreadsheet
+from gsheets_scheduler import Planificador
+
+def planificador() -> Planificador:
+    """Sin cuota y con backoff casi nulo: las pruebas no esperan a la API simulada."""
+    return Planificador(lecturas_por_minuto=1e9, escrituras_por_minuto=1e9, backoff_base_s=0.001)
+
+def error_api(status: int) -> APIError:
+    r = requests.Response()
+    r.status_code = status
+    r._content = json.dumps({"error": {"code": status, "message": "fake", "status": "FAKE"}}).encode()
+    return APIError(r)
+
+@pytest.fixture
+def hoja(tmp_path):
+    """
+    hoja(agenda=[...], empleados=[...], diario=False, foto=False) -> FakeSpreadsheet
+    con agenda/empleados/meta, ya conectado a storage_gsheets_v3. El diario y la foto
+    viven en tmp_path (diario.db, foto/), así que una prueba puede "reiniciar" el
+    proceso llamando de nuevo a s3.usar_spreadsheet con las mismas rutas.
+    """
+    def crear(agenda=(), empleados=(), diario=False, foto=False):
+        sh = FakeSpreadsheet()
+        sh.hoja("agenda", [s3.AGENDA_HEADERS] + [list(f) for f in agenda])
+        sh.hoja("empleados", [s3.EMP_HEADERS] + [list(f) for f in empleados])
+        sh.hoja("meta", [s3.META_HEADERS, ["version", "1"]])
+        s3.usar_spreadsheet(sh, planificador(),
+                            foto=str(tmp_path / "foto") if foto else None,
+                            diario=str(tmp_path / "diario.db") if diario else None)
+        return sh
+
+    yield crear
+    s3.usar_spreadsheet(FakeSpreadsheet())      # cierra el diario y suelta la foto
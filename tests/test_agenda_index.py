@@ -0,0 +1,84 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from agenda_index import ClavesAgenda, OcupacionIndex, buscar_disponibles, compactar_agenda, hash_claves, unir_agenda
+
+LUNES = dt.date(2030, 1, 7)
+
+def dia(i: int) -> dt.date:
+    return LUNES + dt.timedelta(days=i)
+
+def ocupacion(*registros) -> OcupacionIndex:
+    """registros: (día relativo a LUNES, equipo)."""
+    idx = OcupacionIndex()
+    for n, (i, equipo) in enumerate(registros):
+        idx.agregar(f"{n:06d}", f"Empleado {n}", equipo, dia(i), "Vacaciones")
+    return idx
+
+# ---------- buscador de disponibilidad ----------
+def test_salta_dias_llenos_y_dias_con_su_equipo():
+    idx = ocupacion((0, "EQ01"), (1, "EQ02"), (1, "EQ03"), (1, "EQ04"), (3, "EQ09"))
+    assert buscar_disponibles(idx, "EQ01", LUNES, 30, 3) == [dia(2), dia(3), dia(4)]
+    assert buscar_disponibles(idx, "EQ09", LUNES, 30, 3) == [dia(0), dia(2), dia(4)]
+
+def test_solo_habiles_omite_fines_de_semana():
+    jueves = dia(3)
+    assert buscar_disponibles(OcupacionIndex(), "EQ01", jueves, 30, 3, solo_habiles=True) == [dia(3), dia(4), dia(7)]
+
+def test_bloque_de_habiles_no_se_corta_en_el_fin_de_semana():
+    idx = ocupacion((8, "EQ01"))                                # martes siguiente
+    assert buscar_disponibles(idx, "EQ01", dia(3), 30, 3, consecutivos=True, solo_habiles=True) == [
+        dia(3), dia(4), dia(7)]
+    idx = ocupacion((7, "EQ01"))                                # lunes siguiente
+    assert buscar_disponibles(idx, "EQ01", dia(3), 30, 3, consecutivos=True, solo_habiles=True) == [
+        dia(8), dia(9), dia(10)]
+    # sin solo_habiles el bloque es de días corridos
+    assert buscar_disponibles(idx, "EQ01", dia(3), 30, 5, consecutivos=True) == [dia(i) for i in range(8, 13)]
+
+def test_sin_lugar_suficiente_en_el_horizonte():
+    idx = ocupacion(*[(i, "EQ01") for i in range(12)])          # hasta el viernes siguiente
+    assert buscar_disponibles(idx, "EQ01", LUNES, 12, 1) == []
+    assert buscar_disponibles(idx, "EQ01", LUNES, 14, 2) == [dia(12), dia(13)]
+    assert buscar_disponibles(idx, "EQ01", LUNES, 14, 1, solo_habiles=True) == []
+    assert buscar_disponibles(idx, "EQ01", LUNES, 0, 1) == []
+
+# ---------- claves de deduplicado ----------
+def agenda(*filas) -> pd.DataFrame:
+    """filas: (numero, día relativo a LUNES, tipo)."""
+    return pd.DataFrame([[n, f"Empleado {n}", "EQ01", dia(i).isoformat(), t] for n, i, t in filas],
+                        columns=["numero", "nombre", "equipo", "fecha", "tipo"])
+
+def test_hash_no_depende_de_la_forma_de_la_agenda():
+    df = agenda(("000001", 0, "Vacaciones"), ("000002", 3, "Sanción"))
+    assert (hash_claves(df) == hash_claves(compactar_agenda(df))).all()       # texto vs. categóricas + dia_n
+
+def test_duplicadas_contra_la_agenda_y_dentro_del_archivo():
+    claves = ClavesAgenda.desde_df(agenda(("000001", 0, "Vacaciones")))
+    nuevas = agenda(("000001", 0, "Vacaciones"),      # ya está
+                    ("000001", 0, "Sanción"),         # otro tipo
+                    ("000001", 1, "Vacaciones"),      # otro día
+                    ("000002", 0, "Vacaciones"),
+                    ("000002", 0, "Vacaciones"))      # repetida en el archivo
+    assert claves.duplicadas(nuevas).tolist() == [True, False, False, False, True]
+
+def test_agregadas_cuentan_antes_y_despues_de_fusionar(monkeypatch):
+    monkeypatch.setattr(ClavesAgenda, "FUSION", 3)
+    claves = ClavesAgenda()
+    uno, dos = agenda(("000001", 0, "Vacaciones")), agenda(("000002", 0, "Vacaciones"), ("000003", 0, "Vacaciones"))
+    claves.agregar_df(uno)
+    assert claves.contiene(hash_claves(uno)).all() and len(claves._nuevas) == 1
+    claves.agregar_df(dos)                            # llega a FUSION: pasa al arreglo ordenado
+    assert claves._nuevas == [] and len(claves) == 3
+    assert claves.contiene(hash_claves(pd.concat([uno, dos]))).all()
+    assert not claves.contiene(hash_claves(agenda(("000004", 0, "Vacaciones")))).any()
+    assert ClavesAgenda().contiene(np.zeros(2, dtype=np.uint64)).tolist() == [False, False]
+
+# ---------- forma compacta ----------
+def test_compacta_id_entero_y_numero_con_ceros():
+    df = compactar_agenda(agenda(("000123", 0, "Vacaciones"), ("A-7", 1, "Permiso"), ("000123", 9, "Vacaciones")))
+    assert df["numero"].tolist() == ["000123", "A-7", "000123"]
+    assert df["id_empleado"].dtype == np.int32 and df["id_empleado"].tolist() == [123, -1, 123]
+    junta = unir_agenda(df, compactar_agenda(agenda(("42", 2, "Vacaciones"))))
+    assert junta["id_empleado"].tolist() == [123, -1, 123, 42] and junta["id_empleado"].dtype == np.int32
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+
+import calendario
+from agenda_index import compactar_agenda
+
+def agenda(*filas) -> pd.DataFrame:
+    return compactar_agenda(pd.DataFrame([list(f) for f in filas],
+                                         columns=["numero", "nombre", "equipo", "fecha", "tipo"]))
+
+@pytest.fixture(autouse=True)
+def sin_agregados():
+    calendario._AGREGADO.clear()
+    yield
+    calendario._AGREGADO.clear()
+
+# ---------- agregado por mes ----------
+AGENDA = [["000001", "Ana", "EQ01", "2030-01-07", "Vacaciones"],
+          ["000002", "Beto", "EQ02", "2030-01-07", "Vacaciones"],
+          ["000003", "Caro", "EQ01", "2030-01-31", "Sanción"],
+          ["000004", "Dani", "EQ03", "2030-02-01", "Vacaciones"],
+          ["000001", "Ana", "EQ01", "2031-01-07", "Vacaciones"]]
+
+@pytest.mark.parametrize("anio,mes", [(2030, 1), (2030, 2), (2031, 1), (2030, 3)])
+@pytest.mark.parametrize("equipo", ["Todos", "EQ01", "EQ09"])
+def test_mes_igual_al_calculo_con_pandas(anio, mes, equipo):
+    df = agenda(*AGENDA)
+    agg = calendario.AgregadoMeses(df)
+    esperado = calendario.agregar_mes(calendario.filtrar_mes(df, anio, mes), equipo)
+    assert agg.mes(anio, mes, equipo) == esperado
+    assert agg.html(anio, mes, equipo, False) == calendario.html_mes(anio, mes, *esperado, equipo, False)
+
+def test_dias_y_detalle_del_mes():
+    agg = calendario.AgregadoMeses(agenda(*AGENDA))
+    assert agg.dias_con_registros(2030, 1) == [7, 31]
+    assert agg.detalle_df(2030, 1, 7)["nombre"].tolist() == ["Ana", "Beto"]
+    assert agg.detalle_df(2030, 1, 8).empty
+    assert calendario.AgregadoMeses(agenda()).dias(2030, 1) == {}
+
+def test_html_se_arma_una_vez_y_el_lru_descarta_el_menos_usado(monkeypatch):
+    monkeypatch.setattr(calendario, "HTML_CACHE_MAX", 2)
+    armados = []
+    original = calendario.html_mes
+    monkeypatch.setattr(calendario, "html_mes", lambda *a: armados.append(a[:2]) or original(*a))
+    agg = calendario.AgregadoMeses(agenda(*AGENDA))
+    enero = agg.html(2030, 1, "Todos", False)
+    assert agg.html(2030, 1, "Todos", False) is enero
+    agg.html(2030, 2, "Todos", False)
+    agg.html(2030, 1, "Todos", False)                              # enero pasa a ser el más reciente
+    agg.html(2030, 3, "Todos", False)                              # sale febrero
+    assert agg.html(2030, 1, "Todos", False) is enero
+    agg.html(2030, 2, "Todos", False)
+    assert armados == [(2030, 1), (2030, 2), (2030, 3), (2030, 2)]
+
+# ---------- caché de agregados ----------
+def test_agregado_carga_la_agenda_solo_si_falta():
+    cargas = []
+
+    def cargar():
+        cargas.append(1)
+        return agenda(["1", "Ana", "EQ01", "2030-01-07", "Vacaciones"])
+
+    a = calendario.agregado(("v1", 2030), cargar)
+    assert calendario.agregado(("v1", 2030), cargar) is a
+    assert len(cargas) == 1
+    assert calendario.agregado(("v2", 2030), cargar) is not a     # otra versión: se reconstruye
+    assert len(cargas) == 2
+
+def test_agregado_de_otro_anio_no_desaloja_al_anterior():
+    cargas = []
+
+    def cargar():
+        cargas.append(1)
+        return agenda()
+
+    a30 = calendario.agregado(("v1", 2030), cargar)
+    calendario.agregado(("v1", 2031), cargar)
+    assert calendario.agregado(("v1", 2030), cargar) is a30
+    assert len(cargas) == 2
+
+def test_agregado_lru_descarta_el_menos_usado(monkeypatch):
+    monkeypatch.setattr(calendario, "AGREGADO_MAX", 2)
+    a = calendario.agregado("a", agenda)
+    calendario.agregado("b", agenda)
+    assert calendario.agregado("a", agenda) is a                   # "a" pasa a ser el más reciente
+    calendario.agregado("c", agenda)                               # sale "b"
+    assert list(calendario._AGREGADO) == ["a", "c"]
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from empleados_index import EmpleadosIndex, normalizar_numero
+
+def indice(*filas) -> EmpleadosIndex:
+    return EmpleadosIndex(pd.DataFrame([list(f) for f in filas], columns=["numero", "nombre", "equipo"]))
+
+def test_normalizar_numero():
+    assert normalizar_numero("  000123 ") == "123"
+    assert normalizar_numero("000") == ""
+
+def test_busca_por_numero_exacto_y_por_alias_sin_ceros():
+    idx = indice(["000123", "Ana", "EQ01"], ["77", "Beto", "EQ02"])
+    assert idx["000123"] == {"nombre": "Ana", "equipo": "EQ01"}
+    assert "123" in idx and idx["123"]["nombre"] == "Ana"
+    assert idx.buscar(" 0123 ") == {"numero": "000123", "nombre": "Ana", "equipo": "EQ01"}
+    assert idx.buscar("0077")["nombre"] == "Beto"
+    assert idx.buscar("999") is None and idx.get("999") is None
+    assert idx.equipos == ["EQ01", "EQ02"]
+
+def test_numero_repetido_gana_la_ultima_fila():
+    idx = indice(["000001", "Ana", "EQ01"], ["000001", "Ana M.", "EQ03"], ["000002", "Beto", "EQ02"],
+                 ["000002", "Beto", "EQ02"])
+    assert idx["000001"] == {"nombre": "Ana M.", "equipo": "EQ03"}
+    dup = idx.duplicados.set_index("numero")
+    assert dup.loc["000001", "filas"] == 2 and dup.loc["000001", "conflicto"]
+    assert not dup.loc["000002", "conflicto"]
+
+def test_alias_gana_la_primera_fila_y_no_tapa_un_exacto():
+    idx = indice(["0012", "Primero", "EQ01"], ["012", "Segundo", "EQ02"], ["12", "Exacto", "EQ03"])
+    assert idx["12"]["nombre"] == "Exacto"
+    idx = indice(["0012", "Primero", "EQ01"], ["012", "Segundo", "EQ02"])
+    assert idx["12"]["nombre"] == "Primero"
+    assert idx.alias_en_conflicto.to_dict("records") == [{"alias": "12", "numeros": "0012, 012"}]
+
+def test_como_dict_incluye_alias_y_omite_numeros_vacios():
+    idx = indice(["000005", "Eva", "EQ01"], ["  ", "Sin número", "EQ02"])
+    assert idx.como_dict() == {"000005": {"nombre": "Eva", "equipo": "EQ01"},
+                               "5": {"nombre": "Eva", "equipo": "EQ01"}}
+    assert len(idx) == 2 and idx.equipos == ["EQ01"]
+    assert len(EmpleadosIndex(None)) == 0
@@ -0,0 +1,62 @@
+import datetime as dt
+import io
+
+import pandas as pd
+import pytest
+
+import exportes
+from agenda_index import compactar_agenda
+
+@pytest.fixture(autouse=True)
+def cache_vacia(monkeypatch):
+    monkeypatch.setattr(exportes, "_CACHE", type(exportes._CACHE)())
+    monkeypatch.setattr(exportes, "_cache_bytes", 0)
+
+def agenda(*filas) -> pd.DataFrame:
+    return compactar_agenda(pd.DataFrame([list(f) for f in filas], columns=["numero", "nombre", "equipo", "fecha", "tipo"]))
+
+# ---------- caché de archivos ----------
+def test_genera_solo_la_primera_vez_por_clave():
+    generados = []
+
+    def generar():
+        generados.append(1)
+        return b"xlsx"
+
+    assert exportes.cacheado(("mes", 2030, 1, "Todos", "v1"), generar) == b"xlsx"
+    assert exportes.cacheado(("mes", 2030, 1, "Todos", "v1"), generar) == b"xlsx"
+    assert len(generados) == 1
+    exportes.cacheado(("mes", 2030, 1, "Todos", "v2"), generar)            # otra versión de datos
+    assert len(generados) == 2
+
+def test_lru_por_tamano_descarta_el_menos_usado(monkeypatch):
+    monkeypatch.setattr(exportes, "CACHE_MAX_BYTES", 10)
+    exportes.cacheado("a", lambda: b"1234")
+    exportes.cacheado("b", lambda: b"1234")
+    exportes.cacheado("a", lambda: b"otra")                                 # "a" pasa a ser la más reciente
+    exportes.cacheado("c", lambda: b"1234")                                 # 12 bytes: sale "b"
+    assert list(exportes._CACHE) == ["a", "c"] and exportes._cache_bytes == 8
+    exportes.cacheado("grande", lambda: b"x" * 50)                          # más grande que el tope: queda sola
+    assert list(exportes._CACHE) == ["grande"]
+
+# ---------- exportación por rango ----------
+def leer(data: bytes) -> pd.DataFrame:
+    return pd.read_excel(io.BytesIO(data), dtype={"numero": str})
+
+def test_rango_filtra_fechas_y_equipo_ordenado_por_fecha():
+    df = agenda(["000003", "Caro", "EQ01", "2030-03-01", "Vacaciones"],
+                ["000001", "Ana", "EQ01", "2030-01-07", "Vacaciones"],
+                ["000002", "Beto", "EQ02", "2030-01-08", "Permiso"],
+                ["A-7", "Dani", "EQ01", "2030-02-01", "Sanción"],
+                ["000004", "Eva", "EQ01", "2031-01-01", "Vacaciones"])
+    todo = leer(exportes.excel_rango(df, dt.date(2030, 1, 1), dt.date(2030, 12, 31)))
+    assert list(todo.columns) == exportes.COLS_EXPORT
+    assert todo["fecha"].tolist() == ["2030-01-07", "2030-01-08", "2030-02-01", "2030-03-01"]
+    assert todo["numero"].tolist() == ["000001", "000002", "A-7", "000003"]
+    assert todo["id_empleado"].fillna(-1).tolist() == [1, 2, -1, 3]
+    eq = leer(exportes.excel_rango(df, dt.date(2030, 1, 1), dt.date(2030, 2, 1), "EQ01"))
+    assert eq["nombre"].tolist() == ["Ana", "Dani"]
+
+def test_rango_sin_registros_solo_encabezado():
+    data = exportes.excel_rango(agenda(), dt.date(2030, 1, 1), dt.date(2030, 12, 31))
+    assert leer(data).empty and list(leer(data).columns) == exportes.COLS_EXPORT
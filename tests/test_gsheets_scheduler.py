@@ -0,0 +1,53 @@
+import pytest
+import requests
+from gspread.exceptions import APIError
+
+from conftest import error_api, planificador
+from gsheets_scheduler import ESCRITURA, LECTURA, Planificador
+
+def test_reintenta_llamadas_idempotentes():
+    intentos = []
+
+    def update(rango, valores):
+        intentos.append(rango)
+        if len(intentos) < 3:
+            raise error_api(503)
+        return "ok"
+
+    plan = planificador()
+    assert plan.llamar(ESCRITURA, update, "A1", [["x"]]) == "ok"
+    assert len(intentos) == 3
+    assert plan.stats["reintentos"] == 2
+
+@pytest.mark.parametrize("error", [error_api(429), error_api(503), requests.ConnectionError("timeout")])
+def test_no_reintenta_appends(error):
+    # el append pudo quedar escrito aunque la respuesta falle: repetirlo duplica filas
+    intentos = []
+
+    def append_rows(values, **kwargs):
+        intentos.append(values)
+        raise error
+
+    with pytest.raises(type(error)):
+        planificador().llamar(ESCRITURA, append_rows, [["1", "A", "EQ01", "2030-01-01", "Vacaciones"]])
+    assert len(intentos) == 1
+
+def test_429_en_append_vacia_la_cuota():
+    def append_rows(values, **kwargs):
+        raise error_api(429)
+
+    plan = Planificador(escrituras_por_minuto=60)
+    with pytest.raises(APIError):
+        plan.llamar(ESCRITURA, append_rows, [["x"]])
+    assert plan.buckets[ESCRITURA].fichas <= 0
+
+def test_no_reintenta_errores_del_cliente():
+    intentos = []
+
+    def batch_get(rangos):
+        intentos.append(rangos)
+        raise error_api(400)
+
+    with pytest.raises(APIError):
+        planificador().llamar(LECTURA, batch_get, ["A1"])
+    assert len(intentos) == 1
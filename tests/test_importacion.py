@@ -0,0 +1,88 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from importacion import importar_agenda, leer_agenda_por_partes, reporte_duplicados, vista_previa
+from storage_sqlite import SQLiteBackend
+
+COLS = ["numero", "nombre", "equipo", "fecha", "tipo"]
+
+def subido(nombre: str, datos: bytes) -> io.BytesIO:
+    up = io.BytesIO(datos)
+    up.name = nombre
+    return up
+
+def filas(n: int) -> list:
+    return [[f"{i:06d}", f"Empleado {i}", f"EQ{i % 7:02d}", f"2030-01-{1 + i % 28:02d}", "Vacaciones"]
+            for i in range(n)]
+
+def csv(n: int) -> io.BytesIO:
+    return subido("agenda.csv", pd.DataFrame(filas(n), columns=COLS).to_csv(index=False).encode())
+
+def xlsx(n: int) -> io.BytesIO:
+    wb = Workbook()
+    ws = wb.active
+    ws.append(COLS)
+    for i, f in enumerate(filas(n)):
+        ws.append(f)
+        if i == 2:
+            ws.append([None] * 5)           # fila vacía: se salta
+    buf = io.BytesIO()
+    wb.save(buf)
+    return subido("agenda.xlsx", buf.getvalue())
+
+# ---------- lectura por partes ----------
+@pytest.mark.parametrize("archivo", [csv, xlsx])
+def test_partes_de_tam_filas_y_avance_hasta_1(archivo):
+    up = archivo(25)
+    partes = list(leer_agenda_por_partes(up, tam=10))
+    assert [len(df) for df, _ in partes] == [10, 10, 5]
+    avances = [a for _, a in partes]
+    assert avances == sorted(avances) and avances[-1] == 1.0
+    assert pd.concat([df for df, _ in partes])["numero"].tolist() == [f[0] for f in filas(25)]   # con ceros
+    assert not up.closed
+
+def test_json_con_lista_agenda_se_reparte():
+    raw = [dict(zip(COLS, f)) for f in filas(7)]
+    up = subido("agenda.json", json.dumps({"agenda": raw}).encode())
+    partes = list(leer_agenda_por_partes(up, tam=3))
+    assert [len(df) for df, _ in partes] == [3, 3, 1]
+    assert partes[-1][1] == 1.0
+
+def test_vista_previa_lee_solo_el_principio_y_rebobina():
+    up = csv(50)
+    assert len(vista_previa(up, n=4)) == 4
+    assert up.tell() == 0
+
+# ---------- importación ----------
+@pytest.fixture
+def db(tmp_path):
+    b = SQLiteBackend(str(tmp_path / "vacaciones.db"))
+    yield b
+    b._con.close()
+
+def test_anexar_por_partes_omite_duplicadas_entre_partes_y_se_puede_repetir(db):
+    datos = filas(12) + filas(3)            # las 3 primeras se repiten en la última parte
+    up = subido("agenda.csv", pd.DataFrame(datos, columns=COLS).to_csv(index=False).encode())
+    res = list(importar_agenda(db, leer_agenda_por_partes(up, tam=5)))
+    assert len(res) == 3
+    assert {k: res[-1][k] for k in ("leidas", "validas", "importadas", "duplicadas")} == {
+        "leidas": 15, "validas": 15, "importadas": 12, "duplicadas": 3}
+    assert reporte_duplicados(res[-1])["numero"].tolist() == ["000000", "000001", "000002"]
+    up.seek(0)
+    otra = list(importar_agenda(db, leer_agenda_por_partes(up, tam=5)))[-1]
+    assert otra["importadas"] == 0 and otra["duplicadas"] == 15
+    assert len(db.get_agenda_df()) == 12
+
+def test_reemplazar_escribe_una_vez_al_final(db, monkeypatch):
+    db.append_agenda_rows(pd.DataFrame(filas(4), columns=COLS))
+    reemplazos = []
+    original = db.replace_agenda_df
+    monkeypatch.setattr(db, "replace_agenda_df", lambda df: reemplazos.append(len(df)) or original(df))
+    res = list(importar_agenda(db, leer_agenda_por_partes(csv(9), tam=4), reemplazar=True))
+    assert reemplazos == [9]
+    assert res[-1]["importadas"] == 9 and res[-1]["avance"] == 1.0
+    assert len(db.get_agenda_df()) == 9
@@ -0,0 +1,399 @@
+import datetime as dt
+import functools
+import time
+from collections import Counter
+
+import pandas as pd
+import pytest
+import requests
+from gspread.exceptions import APIError
+
+import storage_gsheets_v3 as s3
+from conftest import error_api, planificador
+
+DIA = dt.date(2030, 1, 7)
+
+def fila(numero, equipo, fecha=DIA, tipo="Vacaciones") -> list:
+    return [f"{int(numero):06d}", f"Empleado {numero}", equipo, str(fecha), tipo]
+
+def rec(numero, equipo, fecha=DIA, tipo="Vacaciones") -> dict:
+    return dict(zip(s3.AGENDA_HEADERS, fila(numero, equipo, fecha, tipo)))
+
+def filas_de(sh, nombre: str) -> list:
+    """Filas de datos de una hoja del fake (sin encabezado ni filas en blanco)."""
+    return [list(r) for r in sh._hojas[nombre].rows[1:] if any(r)]
+
+def escribe_y_falla(original):
+    """append que llega al Sheet pero cuya respuesta se pierde."""
+    @functools.wraps(original)
+    def append_rows(*args, **kwargs):
+        original(*args, **kwargs)
+        raise error_api(503)
+    return append_rows
+
+# ---------- appends sin respuesta ----------
+def test_append_sin_respuesta_no_se_duplica(hoja, monkeypatch):
+    sh = hoja()
+    s3.get_ocupacion()
+    ws = sh._hojas["agenda"]
+    monkeypatch.setattr(ws, "append_rows", escribe_y_falla(ws.append_rows))
+    with pytest.raises(APIError):
+        s3.append_agenda_row_safe(rec(1, "EQ01"))
+    assert filas_de(sh, "agenda") == [fila(1, "EQ01")]
+
+def test_fila_de_append_sin_respuesta_cuenta_para_las_reglas(hoja, monkeypatch):
+    sh = hoja()
+    s3.get_ocupacion()
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", escribe_y_falla(original))
+    with pytest.raises(APIError):
+        s3.append_agenda_row_safe(rec(1, "EQ01"))
+    monkeypatch.setattr(ws, "append_rows", original)
+    with pytest.raises(ValueError, match="MISMO_EQUIPO"):
+        s3.append_agenda_row_safe(rec(2, "EQ01"))
+    assert filas_de(sh, "agenda") == [fila(1, "EQ01")]
+
+def test_append_que_cae_en_un_hueco_cuenta_para_las_reglas(hoja):
+    # alguien vació una fila a mano: values.append escribe ahí, no al final
+    sh = hoja(agenda=[fila(1, "EQ01"), [""] * 5, fila(2, "EQ02")])
+    assert s3.get_ocupacion().conteo(DIA) == 2
+    s3.append_agenda_row_safe(rec(3, "EQ03"))
+    assert sh._hojas["agenda"].rows[2] == fila(3, "EQ03")
+    assert s3.get_ocupacion().conteo(DIA) == 3
+    with pytest.raises(ValueError, match="LLENO"):
+        s3.append_agenda_row_safe(rec(4, "EQ04"))
+    assert multiconjunto(filas_de(sh, "agenda")) == multiconjunto([fila(1, "EQ01"), fila(3, "EQ03"), fila(2, "EQ02")])
+
+# ---------- versión de datos y ocupación compartida ----------
+def otro_proceso_anexa(sh, *filas, hoja="agenda"):
+    """Otro proceso anexa filas y estampa una versión nueva en meta!B2."""
+    sh._hojas[hoja].rows += [list(f) for f in filas]
+    sh._hojas["meta"].rows[1][1] = f"otro-{len(sh._hojas[hoja].rows)}"
+
+def test_ocupacion_ve_lo_que_escribe_otro_proceso(hoja, monkeypatch):
+    monkeypatch.setattr(s3, "VERSION_TTL_S", 0.0)
+    sh = hoja(agenda=[fila(1, "EQ01")])
+    assert s3.get_ocupacion().conteo(DIA) == 1
+    otro_proceso_anexa(sh, fila(2, "EQ02"), fila(3, "EQ03"))
+    assert s3.get_ocupacion().conteo(DIA) == 3
+    with pytest.raises(ValueError, match="LLENO"):
+        s3.append_agenda_row_safe(rec(4, "EQ04"))
+    assert len(filas_de(sh, "agenda")) == 3
+
+def test_sin_cambio_de_version_no_lee_la_agenda(hoja):
+    sh = hoja(agenda=[fila(1, "EQ01")])
+    s3.get_ocupacion()
+    antes = dict(sh.llamadas)
+    for _ in range(5):
+        assert s3.get_ocupacion().conteo(DIA) == 1
+    assert sh.llamadas == antes     # versión dentro de VERSION_TTL_S: ni meta!B2 se consulta
+
+def test_cambio_de_version_trae_solo_el_delta(hoja, monkeypatch):
+    monkeypatch.setattr(s3, "VERSION_TTL_S", 0.0)
+    sh = hoja(agenda=[fila(n, f"EQ{n:02d}", DIA + dt.timedelta(days=n)) for n in range(50)])
+    assert len(s3.get_agenda_df()) == 50
+    otro_proceso_anexa(sh, fila(99, "EQ99"))
+    antes = dict(sh.llamadas)
+    assert len(s3.get_agenda_df()) == 51
+    llamadas = {k: v - antes.get(k, 0) for k, v in sh.llamadas.items() if v != antes.get(k, 0)}
+    assert "get_all_values" not in llamadas
+
+def test_version_publica_cambia_con_cada_registro(hoja):
+    hoja()
+    v0 = s3.get_data_version()
+    s3.append_agenda_row_safe(rec(1, "EQ01"))
+    v1 = s3.get_data_version()
+    s3.append_agenda_row_safe(rec(2, "EQ02"))
+    assert len({v0, v1, s3.get_data_version()}) == 3
+
+# ---------- reemplazo por diferencias ----------
+def multiconjunto(filas) -> Counter:
+    return Counter(tuple(f) for f in filas)
+
+def test_reemplazo_deja_exactamente_las_filas_pedidas(hoja):
+    viejas = [fila(n, f"EQ{n % 7:02d}", DIA + dt.timedelta(days=n % 20)) for n in range(60)]
+    sh = hoja(agenda=viejas)
+    nuevas = [list(f) for f in viejas[::-1]]            # otro orden
+    for f in nuevas[::10]:
+        f[4] = "Permiso"                                # ediciones
+    del nuevas[20:25]                                   # borradas
+    nuevas += [fila(100, "EQ01"), fila(100, "EQ01")]    # nuevas, una repetida
+    res = s3.replace_agenda_df(pd.DataFrame(nuevas, columns=s3.AGENDA_HEADERS))
+    assert multiconjunto(filas_de(sh, "agenda")) == multiconjunto(nuevas)
+    assert res["filas"] == len(nuevas)
+    assert res["escritas"] < len(nuevas)                # solo lo que cambió
+    # la caché quedó igual que el Sheet (write-through del reemplazo)
+    antes = dict(sh.llamadas)
+    assert len(s3.get_agenda_df()) == len(nuevas)
+    assert s3.get_ocupacion().conteo(DIA) == sum(f[3] == str(DIA) for f in nuevas)
+    assert sh.llamadas == antes
+
+def test_reemplazo_sin_cambios_no_escribe(hoja):
+    viejas = [fila(n, "EQ01", DIA + dt.timedelta(days=n)) for n in range(10)]
+    sh = hoja(agenda=viejas)
+    antes = dict(sh.llamadas)
+    res = s3.replace_agenda_df(pd.DataFrame(viejas[::-1], columns=s3.AGENDA_HEADERS))
+    assert res == {"filas": 10, "escritas": 0, "borradas": 0}
+    assert sh.llamadas.get("batch_update", 0) == antes.get("batch_update", 0)
+
+def test_reemplazo_de_empleados_conserva_el_orden_con_numeros_repetidos(hoja):
+    sh = hoja(empleados=[["1", "Ana", "EQ01"], ["2", "Beto", "EQ02"]])
+    nuevos = [["2", "Beto", "EQ02"], ["1", "Ana", "EQ01"], ["1", "Ana María", "EQ03"]]
+    s3.replace_empleados_df(pd.DataFrame(nuevos, columns=s3.EMP_HEADERS))
+    assert filas_de(sh, "empleados") == nuevos         # gana la última fila del número
+    assert s3.get_empleados_dict()["1"]["nombre"] == "Ana María"
+
+@pytest.mark.parametrize("vacio", [pd.DataFrame(), pd.DataFrame(columns=s3.EMP_HEADERS), None])
+def test_reemplazo_con_tabla_vacia_deja_la_hoja_vacia(hoja, vacio):
+    sh = hoja(agenda=[fila(1, "EQ01")], empleados=[["1", "Ana", "EQ01"]])
+    s3.replace_empleados_df(vacio)
+    s3.replace_agenda_df(vacio)
+    assert filas_de(sh, "empleados") == []
+    assert filas_de(sh, "agenda") == []
+    assert s3.get_empleados_df().empty and s3.get_agenda_df().empty
+
+# ---------- agenda por año ----------
+def agenda_dos_anios():
+    return ([fila(n, f"EQ{n:02d}", dt.date(2029, 3, 1) + dt.timedelta(days=n)) for n in range(6)]
+            + [fila(n, f"EQ{n:02d}", DIA + dt.timedelta(days=n)) for n in range(10, 14)])
+
+def test_migracion_reparte_la_agenda_por_anio(hoja):
+    viejas = agenda_dos_anios()
+    sh = hoja(agenda=viejas + [["000077", "Sin fecha", "EQ01", "no-es-fecha", "Vacaciones"]])
+    res = s3.migrar_agenda_por_anio()
+    assert res == {"anios": {2029: 6, 2030: 4}, "descartadas": 1, "ya_migrada": False}
+    for anio in (2029, 2030):
+        assert multiconjunto(filas_de(sh, f"agenda_{anio}")) == multiconjunto(
+            f for f in viejas if f[3].startswith(str(anio)))
+    assert len(filas_de(sh, "agenda")) == len(viejas) + 1     # respaldo intacto
+    assert sh._hojas["meta"].rows[2] == ["particion", "anio"]
+    assert s3.migrar_agenda_por_anio()["ya_migrada"]
+
+def test_con_hojas_por_anio_cada_lectura_y_registro_va_a_su_hoja(hoja):
+    sh = hoja(agenda=agenda_dos_anios())
+    s3.migrar_agenda_por_anio()
+    df = s3.get_agenda_df([2030])
+    assert len(df) == 4 and set(df["fecha"].dt.year) == {2030}
+    assert len(s3.get_agenda_df()) == 10
+    assert s3.get_ocupacion().conteo(dt.date(2029, 3, 1)) == 1
+    s3.append_agenda_row_safe(rec(50, "EQ50", dt.date(2031, 2, 2)))    # crea agenda_2031
+    s3.append_agenda_row_safe(rec(51, "EQ51", DIA))
+    assert filas_de(sh, "agenda_2031") == [fila(50, "EQ50", dt.date(2031, 2, 2))]
+    assert filas_de(sh, "agenda_2030")[-1] == fila(51, "EQ51")
+    assert len(filas_de(sh, "agenda")) == 10
+    assert s3.get_ocupacion().conteo(dt.date(2031, 2, 2)) == 1
+    assert len(s3.get_agenda_df([2030, 2031])) == 6
+
+def test_con_hojas_por_anio_registrar_no_toca_la_hoja_agenda(hoja):
+    sh = hoja(agenda=agenda_dos_anios())
+    s3.migrar_agenda_por_anio()
+    sh.del_worksheet(sh._hojas["agenda"])           # el respaldo se puede borrar
+    s3.usar_spreadsheet(sh, planificador())         # proceso nuevo: sin hojas en caché
+    s3.append_agenda_row_safe(rec(50, "EQ50"))
+    s3.append_agenda_rows_safe(rec(51, "EQ51"), [DIA + dt.timedelta(days=1), DIA + dt.timedelta(days=2)])
+    assert "agenda" not in sh._hojas
+    assert filas_de(sh, "agenda_2030")[-3:] == [fila(50, "EQ50"), fila(51, "EQ51", DIA + dt.timedelta(days=1)),
+                                                 fila(51, "EQ51", DIA + dt.timedelta(days=2))]
+
+def test_con_hojas_por_anio_se_descartan_las_fechas_invalidas(hoja):
+    sh = hoja(agenda=agenda_dos_anios())
+    s3.migrar_agenda_por_anio()
+    malas = pd.DataFrame([["000080", "Sin fecha", "EQ01", "", "Vacaciones"],
+                          ["000081", "Mal fecha", "EQ01", "2030-13-45", "Vacaciones"]], columns=s3.AGENDA_HEADERS)
+    s3.append_agenda_rows(pd.concat([pd.DataFrame([fila(60, "EQ60")], columns=s3.AGENDA_HEADERS), malas]))
+    assert filas_de(sh, "agenda_2030")[-1] == fila(60, "EQ60")
+    nuevas = [fila(1, "EQ01", dt.date(2029, 5, 5)), fila(2, "EQ02")]
+    s3.replace_agenda_df(pd.concat([pd.DataFrame(nuevas, columns=s3.AGENDA_HEADERS), malas]))
+    assert filas_de(sh, "agenda_2029") == [nuevas[0]]
+    assert filas_de(sh, "agenda_2030") == [nuevas[1]]
+    assert len(s3.get_agenda_df()) == 2
+
+def test_leer_un_anio_no_toca_las_hojas_de_otros(hoja):
+    sh = hoja(agenda=agenda_dos_anios())
+    s3.migrar_agenda_por_anio()
+    s3.usar_spreadsheet(sh, planificador())     # proceso nuevo: caché vacía
+    lecturas = []
+    for nombre in ("agenda", "agenda_2029", "agenda_2030"):
+        ws = sh._hojas[nombre]
+        original = ws.get_all_values
+
+        @functools.wraps(original)
+        def espia(*a, _nombre=nombre, _original=original, **k):
+            lecturas.append(_nombre)
+            return _original(*a, **k)
+        ws.get_all_values = espia
+    assert len(s3.get_agenda_df([2030])) == 4
+    assert lecturas == ["agenda_2030"]
+
+def test_otro_proceso_migra_y_este_cambia_de_modo(hoja, monkeypatch):
+    monkeypatch.setattr(s3, "VERSION_TTL_S", 0.0)
+    sh = hoja(agenda=[fila(1, "EQ01")])
+    assert len(s3.get_agenda_df()) == 1
+    sh.hoja("agenda_2030", [s3.AGENDA_HEADERS, fila(1, "EQ01"), fila(2, "EQ02")])
+    sh._hojas["meta"].rows.append(["particion", "anio"])
+    sh._hojas["meta"].rows[1][1] = "migrada"
+    assert len(s3.get_agenda_df()) == 2
+    assert s3.get_ocupacion().conteo(DIA) == 2
+
+# ---------- diario local ----------
+def sin_red(original):
+    @functools.wraps(original)
+    def append_rows(*args, **kwargs):
+        raise requests.ConnectionError("sin red")
+    return append_rows
+
+def esperar(condicion, timeout_s=10.0):
+    limite = time.monotonic() + timeout_s
+    while not condicion():
+        assert time.monotonic() < limite, "tiempo agotado"
+        time.sleep(0.01)
+
+def test_diario_acepta_sin_red_y_envia_al_volver(hoja, monkeypatch):
+    sh = hoja(diario=True)
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", sin_red(original))
+    s3.append_agenda_row_safe(rec(1, "EQ01"))
+    s3.append_agenda_row_safe(rec(2, "EQ02"))
+    assert filas_de(sh, "agenda") == []
+    assert s3.get_ocupacion().conteo(DIA) == 2                  # los pendientes cuentan
+    assert len(s3.get_agenda_df([DIA.year])) == 2
+    with pytest.raises(ValueError, match="MISMO_EQUIPO"):
+        s3.append_agenda_row_safe(rec(3, "EQ01"))
+    esperar(lambda: s3.estado()["diario"]["fallos_seguidos"] >= 1)
+    monkeypatch.setattr(ws, "append_rows", original)
+    s3._DIARIO.enviar_todo()
+    assert multiconjunto(filas_de(sh, "agenda")) == multiconjunto([fila(1, "EQ01"), fila(2, "EQ02")])
+    assert s3.estado()["diario"]["pendientes"] == 0
+    assert s3.get_ocupacion().conteo(DIA) == 2
+
+def test_diario_envia_en_segundo_plano(hoja):
+    sh = hoja(diario=True)
+    for n in range(5):
+        s3.append_agenda_row_safe(rec(n, f"EQ{n:02d}", DIA + dt.timedelta(days=n)))
+    esperar(lambda: len(filas_de(sh, "agenda")) == 5)
+    esperar(lambda: s3.estado()["diario"]["pendientes"] == 0)
+
+def test_diario_no_duplica_si_se_pierde_la_respuesta(hoja, monkeypatch):
+    sh = hoja(diario=True)
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", escribe_y_falla(original))
+    s3.append_agenda_row_safe(rec(1, "EQ01"))
+    esperar(lambda: s3.estado()["diario"]["fallos_seguidos"] >= 1)
+    monkeypatch.setattr(ws, "append_rows", original)
+    s3._DIARIO.enviar_todo()
+    assert filas_de(sh, "agenda") == [fila(1, "EQ01")]
+    assert s3.estado()["diario"]["pendientes"] == 0
+
+def test_diario_recupera_pendientes_tras_reiniciar(hoja, monkeypatch, tmp_path):
+    sh = hoja(diario=True)
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", sin_red(original))
+    s3.append_agenda_row_safe(rec(1, "EQ01"))
+    esperar(lambda: s3.estado()["diario"]["fallos_seguidos"] >= 1)
+    monkeypatch.setattr(ws, "append_rows", original)
+    s3.usar_spreadsheet(sh, planificador(), diario=str(tmp_path / "diario.db"))    # proceso nuevo
+    assert s3.get_ocupacion().conteo(DIA) == 1
+    s3._DIARIO.enviar_todo()
+    assert filas_de(sh, "agenda") == [fila(1, "EQ01")]
+
+def test_diario_rechaza_lo_que_el_sheet_ya_no_admite(hoja, monkeypatch):
+    sh = hoja(diario=True)
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", sin_red(original))
+    s3.append_agenda_row_safe(rec(1, "EQ01"))
+    esperar(lambda: s3.estado()["diario"]["fallos_seguidos"] >= 1)
+    otro_proceso_anexa(sh, fila(10, "EQ10"), fila(11, "EQ11"), fila(12, "EQ12"))     # día lleno
+    monkeypatch.setattr(ws, "append_rows", original)
+    s3._DIARIO.enviar_todo()
+    assert fila(1, "EQ01") not in filas_de(sh, "agenda")
+    rechazadas = s3.estado()["diario"]["rechazadas"]
+    assert [(r["numero"], r["codigo"]) for r in rechazadas] == [(fila(1, "EQ01")[0], "LLENO")]
+
+def test_version_publica_cuenta_los_pendientes(hoja, monkeypatch):
+    sh = hoja(diario=True)
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", sin_red(original))
+    versiones = [s3.get_data_version()]
+    s3.append_agenda_row_safe(rec(1, "EQ01"))
+    versiones.append(s3.get_data_version())
+    s3.append_agenda_row_safe(rec(2, "EQ02"))
+    versiones.append(s3.get_data_version())
+    monkeypatch.setattr(ws, "append_rows", original)
+    s3._DIARIO.enviar_todo()
+    versiones.append(s3.get_data_version())
+    assert len(set(versiones)) == 4
+
+def test_reemplazo_envia_antes_lo_pendiente(hoja, monkeypatch):
+    sh = hoja(agenda=[fila(1, "EQ01")], diario=True)
+    ws = sh._hojas["agenda"]
+    original = ws.append_rows
+    monkeypatch.setattr(ws, "append_rows", sin_red(original))
+    s3.append_agenda_row_safe(rec(2, "EQ02"))
+    monkeypatch.setattr(ws, "append_rows", original)
+    s3.replace_agenda_df(pd.DataFrame([fila(3, "EQ03")], columns=s3.AGENDA_HEADERS))
+    assert filas_de(sh, "agenda") == [fila(3, "EQ03")]
+    assert s3.estado()["diario"]["pendientes"] == 0
+
+# ---------- foto local ----------
+def caido(original):
+    @functools.wraps(original)
+    def batch_get(*args, **kwargs):
+        raise requests.ConnectionError("sin red")
+    return batch_get
+
+def test_foto_arranca_sin_el_sheet_y_luego_trae_solo_el_delta(hoja, monkeypatch, tmp_path):
+    sh = hoja(agenda=[fila(1, "EQ01")], empleados=[["1", "Ana", "EQ01"]], foto=True)
+    s3.get_agenda_df()
+    s3.get_empleados_df()
+    assert s3._FOTO.guardar()
+    otro_proceso_anexa(sh, fila(2, "EQ02"))
+    meta = sh._hojas["meta"]
+    original = meta.batch_get
+    monkeypatch.setattr(meta, "batch_get", caido(original))
+    completas = sh.llamadas.get("get_all_values", 0)
+    s3.usar_spreadsheet(sh, planificador(), foto=str(tmp_path / "foto"))     # reinicio con el Sheet caído
+    assert len(s3.get_agenda_df()) == 1
+    assert len(s3.get_empleados_df()) == 1
+    assert s3.estado()["foto_local"]["sirviendo_foto"]
+    monkeypatch.setattr(meta, "batch_get", original)
+    s3._FOTO._despertar.set()
+    esperar(lambda: not s3.estado()["foto_local"]["sirviendo_foto"])
+    assert len(s3.get_agenda_df()) == 2
+    assert sh.llamadas.get("get_all_values", 0) == completas     # solo deltas, nunca una lectura completa
+
+def test_sheet_caido_sirve_lo_ultimo_bueno_y_no_acepta_registros(hoja, monkeypatch):
+    monkeypatch.setattr(s3, "VERSION_TTL_S", 0.0)
+    sh = hoja(agenda=[fila(1, "EQ01")], foto=True)
+    assert len(s3.get_agenda_df()) == 1
+    meta = sh._hojas["meta"]
+    monkeypatch.setattr(meta, "batch_get", caido(meta.batch_get))
+    assert len(s3.get_agenda_df()) == 1
+    assert s3.get_ocupacion().conteo(DIA) == 1
+    assert s3.estado()["foto_local"]["sirviendo_foto"]
+    with pytest.raises(requests.ConnectionError):
+        s3.append_agenda_row_safe(rec(2, "EQ02"))     # sin diario: no se valida contra una copia vieja
+    assert filas_de(sh, "agenda") == [fila(1, "EQ01")]
+
+def test_foto_sin_id_empleado_se_completa_al_restaurar(hoja, monkeypatch, tmp_path):
+    sh = hoja(agenda=[fila(1, "EQ01")], foto=True)
+    s3.get_agenda_df()
+    assert s3._FOTO.guardar()
+    archivos = list((tmp_path / "foto").glob("*/agenda*.parquet"))
+    assert archivos
+    for arch in archivos:                                            # foto con la forma anterior
+        pd.read_parquet(arch).drop(columns="id_empleado").to_parquet(arch, index=False)
+    otro_proceso_anexa(sh, fila(2, "EQ02"))
+    meta = sh._hojas["meta"]
+    monkeypatch.setattr(meta, "batch_get", caido(meta.batch_get))
+    s3.usar_spreadsheet(sh, planificador(), foto=str(tmp_path / "foto"))
+    assert s3.get_agenda_df()["id_empleado"].tolist() == [1]
+    monkeypatch.undo()
+    s3._FOTO._despertar.set()
+    esperar(lambda: len(s3.get_agenda_df()) == 2)
+    assert s3.get_agenda_df()["id_empleado"].tolist() == [1, 2]
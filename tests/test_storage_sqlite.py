@@ -0,0 +1,109 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+from storage_sqlite import SQLiteBackend
+
+DIA = dt.date(2030, 1, 7)
+
+def rec(numero, equipo="EQ01", fecha=DIA):
+    return {"numero": f"{int(numero):06d}", "nombre": f"Empleado {numero}", "equipo": equipo,
+            "fecha": fecha, "tipo": "Vacaciones"}
+
+@pytest.fixture
+def db(tmp_path):
+    b = SQLiteBackend(str(tmp_path / "vacaciones.db"))
+    b.replace_empleados_df(pd.DataFrame([["000001", "Empleado 1", "EQ01"], ["000002", "Empleado 2", "EQ02"]],
+                                        columns=["numero", "nombre", "equipo"]))
+    yield b
+    b._con.close()
+
+# ---------- versión por tabla ----------
+def test_registrar_no_recarga_empleados(db):
+    idx = db.get_empleados_index()
+    v = db.get_data_version()
+    db.append_agenda_row_safe(rec(1))
+    assert db.get_data_version() != v                 # la versión pública sí cambia
+    assert db.get_empleados_index() is idx
+
+def test_escribir_empleados_no_recarga_agenda(db):
+    db.append_agenda_row_safe(rec(1))
+    ocupacion = db.get_ocupacion()
+    db.append_empleados_rows(pd.DataFrame([["000003", "Empleado 3", "EQ03"]], columns=["numero", "nombre", "equipo"]))
+    assert db.get_ocupacion() is ocupacion
+    assert len(db.get_empleados_df()) == 3
+
+def test_otro_proceso_en_la_agenda_invalida_solo_la_agenda(db, tmp_path):
+    idx = db.get_empleados_index()
+    db.get_agenda_df()
+    otro = SQLiteBackend(db.path)
+    otro.append_agenda_row_safe(rec(2, "EQ02"))
+    otro._con.close()
+    assert len(db.get_agenda_df()) == 1
+    assert db.get_empleados_index() is idx
+
+# ---------- reglas dentro de BEGIN IMMEDIATE ----------
+def test_registro_respeta_cupo_y_equipo(db):
+    for n, eq in ((1, "EQ01"), (2, "EQ02"), (3, "EQ03")):
+        db.append_agenda_row_safe(rec(n, eq))
+    with pytest.raises(ValueError, match="LLENO"):
+        db.append_agenda_row_safe(rec(4, "EQ04"))
+    otro_dia = DIA + dt.timedelta(days=1)
+    db.append_agenda_row_safe(rec(1, "EQ01", otro_dia))
+    with pytest.raises(ValueError, match="MISMO_EQUIPO"):
+        db.append_agenda_row_safe(rec(5, "EQ01", otro_dia))
+    assert len(db.get_agenda_df()) == 4
+
+def test_reglas_se_validan_contra_el_archivo_no_contra_la_cache(db):
+    db.get_ocupacion()                                 # caché de este proceso
+    otro = SQLiteBackend(db.path)
+    otro.append_agenda_row_safe(rec(2, "EQ01"))
+    otro._con.close()
+    with pytest.raises(ValueError, match="MISMO_EQUIPO"):
+        db.append_agenda_row_safe(rec(1, "EQ01"))
+    assert db.get_ocupacion().conteo(DIA) == 1
+
+def test_varias_fechas_codigos_por_fecha(db):
+    db.append_agenda_row_safe(rec(9, "EQ01", DIA + dt.timedelta(days=1)))
+    fechas = [DIA, DIA, DIA + dt.timedelta(days=1), "no-es-fecha"]
+    assert db.append_agenda_rows_safe(rec(1), fechas) == [
+        ("2030-01-07", "OK"), ("2030-01-07", "DUPLICADA"), ("2030-01-08", "MISMO_EQUIPO"),
+        ("no-es-fecha", "FORMATO_FECHA")]
+    assert len(db.get_agenda_df()) == 2
+
+def test_todo_o_nada_cancela_las_validas(db):
+    db.append_agenda_row_safe(rec(9, "EQ01", DIA + dt.timedelta(days=1)))
+    res = db.append_agenda_rows_safe(rec(1), [DIA, DIA + dt.timedelta(days=1)], todo_o_nada=True)
+    assert res == [("2030-01-07", "CANCELADO"), ("2030-01-08", "MISMO_EQUIPO")]
+    assert len(db.get_agenda_df()) == 1
+
+# ---------- anexar sin duplicados ----------
+def agenda_df(*filas) -> pd.DataFrame:
+    return pd.DataFrame([[r["numero"], r["nombre"], r["equipo"], r["fecha"].isoformat(), r["tipo"]] for r in filas],
+                        columns=["numero", "nombre", "equipo", "fecha", "tipo"])
+
+def test_nuevas_omite_las_ya_registradas_y_las_repetidas(db):
+    db.append_agenda_row_safe(rec(1))
+    df = agenda_df(rec(1), rec(2, "EQ02"), rec(2, "EQ02"), rec(3, "EQ03", DIA + dt.timedelta(days=1)))
+    assert db.append_agenda_rows_nuevas(df).tolist() == [True, False, True, False]
+    assert len(db.get_agenda_df()) == 3
+    assert db.append_agenda_rows_nuevas(df).all()
+
+def test_nuevas_relee_si_otro_proceso_escribe_antes(db, monkeypatch):
+    otro = SQLiteBackend(db.path)
+    original = db._claves_agenda
+    lecturas = []
+
+    def claves_y_otro_escribe():
+        v, claves = original()
+        lecturas.append(v)
+        if len(lecturas) == 1:          # entre la consulta y la transacción
+            otro.append_agenda_rows(agenda_df(rec(2, "EQ02")))
+        return v, claves
+    monkeypatch.setattr(db, "_claves_agenda", claves_y_otro_escribe)
+    dup = db.append_agenda_rows_nuevas(agenda_df(rec(1), rec(2, "EQ02")))
+    otro._con.close()
+    assert dup.tolist() == [False, True]
+    assert len(lecturas) == 2
+    assert len(db.get_agenda_df()) == 2